@@ -1,16 +1,49 @@
 from django.contrib import admin
 from django import forms
 from django.conf import settings
-from pathlib import Path
-from .models import Video, CastMember, Genre
+from django.http import JsonResponse
+from django.urls import path, reverse
+from .models import Video, CastMember, Genre, MediaProbe, ImportFile
+from . import ingest, progress
 # Register your models here.
 
+class ServerFileSelect(forms.Select):
+    # select2 box that pages through the import index (VideoAdmin.server_files_view)
+    # instead of rendering one <option> per file
+    def build_attrs(self, base_attrs, extra_attrs=None):
+        attrs = super().build_attrs(base_attrs, extra_attrs=extra_attrs)
+        attrs.update({
+            "class": (attrs.get("class", "") + " admin-autocomplete").strip(),
+            "data-ajax--url": reverse("admin:content_video_server_files"),
+            "data-ajax--cache": "true",
+            "data-ajax--delay": 250,
+            "data-ajax--type": "GET",
+            "data-theme": "admin-autocomplete",
+            "data-allow-clear": "true",
+            "data-placeholder": "— Select a server file —",
+        })
+        return attrs
+
+    @property
+    def media(self):
+        extra = "" if settings.DEBUG else ".min"
+        return forms.Media(
+            js=(
+                f"admin/js/vendor/jquery/jquery{extra}.js",
+                f"admin/js/vendor/select2/select2.full{extra}.js",
+                "admin/js/jquery.init.js",
+                "admin/js/autocomplete.js",
+            ),
+            css={"screen": (f"admin/css/vendor/select2/select2{extra}.css", "admin/css/autocomplete.css")},
+        )
+
 class VideoAdminForm(forms.ModelForm):
-    # Replace the TextField with a Select listing files from ALLOWED_IMPORT_DIRS
-    server_path = forms.ChoiceField(
+    # Files from ALLOWED_IMPORT_DIRS, searched through the import index;
+    # Video.clean still checks the path is a file inside an allowed directory
+    server_path = forms.CharField(
         required=False,
-        choices=[],
-        help_text="Pick a file from the server-mounted imports directories.",
+        widget=ServerFileSelect,
+        help_text="Search the files in the server-mounted imports directories.",
     )
 
     class Meta:
@@ -19,24 +52,12 @@ class VideoAdminForm(forms.ModelForm):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
-
-        allowed_dirs = (getattr(settings, "ALLOWED_IMPORT_DIRS", []) or [])
-        allowed_exts = set(e.lower() for e in getattr(settings, "ALLOWED_IMPORT_EXTS", [".mp4", ".m4v", ".mov", ".mkv", ".webm"]))
-
-        files = []
-        for base in allowed_dirs:
-            base_path = Path(base).expanduser().resolve()
-            if not base_path.is_dir():
-                continue
-            # Recursively list files under this dir
-            for p in base_path.rglob("*"):
-                if p.is_file() and p.suffix.lower() in allowed_exts:
-                    # Value: full container path (e.g. /imports/SomeMovie.mp4)
-                    # Label: readable "filename — parent"
-                    files.append((str(p), f"{p.name} — {p.parent}"))
-
-        files.sort(key=lambda t: t[1].lower())
-        self.fields["server_path"].choices = [("", "— Select a server file —")] + files
+        # Only the current value is rendered; everything else comes from the endpoint
+        if self.is_bound:
+            current = self.data.get(self.add_prefix("server_path")) or ""
+        else:
+            current = self.initial.get("server_path") or ""
+        self.fields["server_path"].widget.choices = [("", "")] + ([(current, ingest.file_label(current))] if current else [])
 
     def clean(self):
         cleaned = super().clean()
@@ -61,6 +82,23 @@ class VideoAdminForm(forms.ModelForm):
     class Media:
         js = ("admin/video_toggle.js",)  # see step 3 below
 
+class MediaProbeInline(admin.StackedInline):
+    # Read-only view of the stored ffprobe result; refreshed by the encode pipeline
+    model = MediaProbe
+    can_delete = False
+    extra = 0
+    max_num = 0
+    fields = (
+        'source_path', 'format_name', 'duration', 'bit_rate',
+        'video_codec', 'resolution', 'frame_rate',
+        'audio_codec', 'audio_channels', 'audio_layout',
+        'keyframe_count', 'probed_at',
+    )
+    readonly_fields = fields
+
+    def keyframe_count(self, obj):
+        return len(obj.keyframes or [])
+
 @admin.register(Video)
 class VideoAdmin(admin.ModelAdmin):
     def delete_queryset(self, request, queryset):
@@ -71,8 +109,53 @@ class VideoAdmin(admin.ModelAdmin):
         # After custom delete logic, call the parent method to complete deletion
         super().delete_queryset(request, queryset)
         
-    list_display = ('name', 'duration', 'status', 'is_running')
+    list_display = ('name', 'duration', 'resolution', 'status', 'encode_progress', 'is_running')
+    list_select_related = ('probe',)
+    readonly_fields = ('fingerprint',)
     form = VideoAdminForm
+    inlines = [MediaProbeInline]
+
+    def get_urls(self):
+        return [
+            path('server-files/', self.admin_site.admin_view(self.server_files_view),
+                 name='content_video_server_files'),
+        ] + super().get_urls()
+
+    def server_files_view(self, request):
+        # select2 autocomplete: ?term=<words>&page=<n>, matched against the whole path
+        ingest.ensure_index()
+        per_page = int(getattr(settings, 'IMPORT_INDEX_PAGE_SIZE', 50))
+        try:
+            page = max(1, int(request.GET.get('page') or 1))
+        except ValueError:
+            page = 1
+        qs = ImportFile.objects.all()
+        for word in request.GET.get('term', '').split():
+            qs = qs.filter(path__icontains=word)
+        # One extra row tells whether there is a next page without a COUNT
+        paths = list(qs.values_list('path', flat=True)[(page - 1) * per_page:page * per_page + 1])
+        return JsonResponse({
+            'results': [{'id': p, 'text': ingest.file_label(p)} for p in paths[:per_page]],
+            'pagination': {'more': len(paths) > per_page},
+        })
+
+    @admin.display(description='Resolution')
+    def resolution(self, obj):
+        probe = getattr(obj, 'probe', None)
+        return f"{probe.resolution} {probe.video_codec}" if probe else '—'
+
+    @admin.display(description='Progress')
+    def encode_progress(self, obj):
+        stats = progress.snapshot(obj.id) if obj.status == 'Processing' else None
+        if not stats:
+            return '—'
+        text = f"{stats['percent'] or 0:.0f}% · {stats['speed']:.2f}x · {stats['fps']:.0f} fps"
+        if stats['eta_seconds'] is not None:
+            text += f" · ETA {stats['eta_seconds'] // 60}m{stats['eta_seconds'] % 60:02d}s"
+        if stats['parts'] > 1:
+            text += f" · {stats['parts_running']}/{stats['parts']} chunks running"
+        return text
+
 
 class GenreAdmin(admin.ModelAdmin):
     list_display = ('name',)
@@ -0,0 +1,111 @@
+# content/caching.py
+# Small in-process caches for the playback views, kept coherent across
+# processes through a per-video version number stored in the Django cache.
+import threading
+import time
+from collections import OrderedDict
+from django.core.cache import cache
+
+
+class LRU:
+    """Thread-safe least-recently-used map bounded by entry count and/or total size."""
+
+    def __init__(self, max_items=None, max_bytes=None):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value, size = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size=0):
+        with self._lock:
+            if self.max_bytes is not None and size > self.max_bytes:
+                return
+            old = self._data.pop(key, None)
+            if old:
+                self.bytes -= old[1]
+            self._data[key] = (value, size)
+            self.bytes += size
+            while self._data and (
+                (self.max_items is not None and len(self._data) > self.max_items)
+                or (self.max_bytes is not None and self.bytes > self.max_bytes)
+            ):
+                _, (_, evicted) = self._data.popitem(last=False)
+                self.bytes -= evicted
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'items': len(self._data), 'bytes': self.bytes,
+                'max_items': self.max_items, 'max_bytes': self.max_bytes,
+                'hits': self.hits, 'misses': self.misses,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+# --- Per-video version ---
+# Anything cached about a video is keyed with its version; bumping it (from
+# the Video signals) orphans those entries in every process at once. Pages
+# listing many videos use the catalog version, bumped along with any of them.
+
+CATALOG_VERSION_KEY = "catalog-version"
+
+
+def _version_key(video_id):
+    return f"video-version:{video_id}"
+
+
+def _version(key):
+    version = cache.get(key)
+    if version is None:
+        # Never falls back to a value used before, even if the key was evicted
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def video_version(video_id):
+    return _version(_version_key(video_id))
+
+
+def video_versions(video_ids):
+    """{video_id: version} in one cache round trip (plus one per video never versioned yet)."""
+    found = cache.get_many([_version_key(pk) for pk in video_ids])
+    return {pk: found.get(_version_key(pk)) or video_version(pk) for pk in video_ids}
+
+
+def catalog_version():
+    return _version(CATALOG_VERSION_KEY)
+
+
+async def avideo_version(video_id):
+    version = await cache.aget(_version_key(video_id))
+    if version is None:
+        await cache.aadd(_version_key(video_id), time.time_ns(), None)
+        version = await cache.aget(_version_key(video_id))
+    return version
+
+
+def bump_video_version(video_id):
+    now = time.time_ns()
+    cache.set_many({_version_key(video_id): now, CATALOG_VERSION_KEY: now}, None)
@@ -0,0 +1,80 @@
+# content/catalog.py
+# The playable catalog, as the home page lists it and as the JSON API pages
+# through it: newest first, keyset-paginated on the primary key and loading
+# only the columns and relations the requested fields need.
+from django.db.models import Prefetch, Q
+from django.urls import reverse
+from .models import CastMember, Genre, Video
+
+# API field -> Video columns it reads
+COLUMNS = {
+    'id': ('id',),
+    'slug': ('slug',),
+    'name': ('name',),
+    'description': ('description',),
+    'release_year': ('release_year',),
+    'duration': ('duration',),
+    'status': ('status',),
+    'thumbnail': ('thumbnail',),
+    'playlist': ('hls',),
+    'genres': (),
+    'cast': (),
+}
+RELATIONS = {
+    'genres': Prefetch('genres', queryset=Genre.objects.only('id', 'name')),
+    'cast': Prefetch('cast', queryset=CastMember.objects.only('id', 'name')),
+}
+DEFAULT_FIELDS = ('id', 'slug', 'name', 'thumbnail', 'duration', 'status', 'playlist')
+MAX_LIMIT = 200
+# Columns the home page cards use (content/components/movie_list_group.html)
+CARD_COLUMNS = ('id', 'slug', 'name', 'description', 'thumbnail', 'duration', 'status', 'hls')
+
+
+def playable():
+    # Encodes in progress are listed once their first segments are published (video.hls is set)
+    return Video.objects.filter(Q(status='Completed') | Q(status='Processing', hls__isnull=False))
+
+
+def cards():
+    return playable().only(*CARD_COLUMNS).order_by('-pk')
+
+
+def parse_fields(value):
+    """['id', 'name', ...] from a ?fields=id,name parameter; raises ValueError on unknown names."""
+    if not value:
+        return list(DEFAULT_FIELDS)
+    fields = list(dict.fromkeys(f.strip() for f in value.split(',') if f.strip()))
+    unknown = [f for f in fields if f not in COLUMNS]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(COLUMNS)}.")
+    return fields
+
+
+def page(fields, after=None, limit=50):
+    """(videos, has_more) for the `limit` playable videos after the one with pk `after`."""
+    columns = {'id'}.union(*(COLUMNS[f] for f in fields))
+    qs = playable().only(*columns).prefetch_related(*(RELATIONS[f] for f in fields if f in RELATIONS))
+    if after is not None:
+        qs = qs.filter(pk__lt=after)
+    # One extra row tells whether there is a next page without a COUNT
+    videos = list(qs.order_by('-pk')[:limit + 1])
+    return videos[:limit], len(videos) > limit
+
+
+def serialize(video, fields, request):
+    item = {}
+    for field in fields:
+        if field == 'thumbnail':
+            item[field] = request.build_absolute_uri(video.thumbnail.url) if video.thumbnail else None
+        elif field == 'playlist':
+            item[field] = request.build_absolute_uri(reverse('serve_hls_playlist', args=[video.id])) if video.hls else None
+        elif field == 'duration':
+            try:
+                item[field] = float(video.duration) if video.duration else None
+            except ValueError:
+                item[field] = None
+        elif field in RELATIONS:
+            item[field] = [str(related) for related in getattr(video, field).all()]
+        else:
+            item[field] = getattr(video, field)
+    return item
@@ -0,0 +1,146 @@
+# content/checkpoints.py
+# Segment-level checkpoints so an interrupted encode continues where it stopped.
+import hashlib
+import json
+import os
+from django.conf import settings
+from django.utils import timezone
+from . import encoding
+from .chunked import chunk_dir
+from .models import EncodeCheckpoint, Video
+
+
+def enabled() -> bool:
+    # A single-file rendition keeps growing, so its segments can't be verified
+    # one by one; those encodes always start over.
+    return getattr(settings, 'HLS_RESUME', True) and not encoding.single_file()
+
+
+def plan_key(cmds, probe) -> str:
+    payload = json.dumps([cmds, probe.source_path, probe.source_size, probe.source_mtime])
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def heartbeat(video_id):
+    # Queryset update: no signals, no re-read of the row
+    Video.objects.filter(pk=video_id).update(heartbeat_at=timezone.now())
+
+
+def record(video_id, key, output_dir, playlist):
+    """Store checkpoints for the segments `playlist` lists that aren't stored yet.
+
+    ffmpeg only lists a segment once the file is closed, so every listed
+    segment is complete; its size is kept to verify it on resume.
+    """
+    path = os.path.join(output_dir, playlist)
+    if not os.path.isfile(path):
+        return 0
+    _, segments, _ = encoding.read_media_playlist(path)
+    known = EncodeCheckpoint.objects.filter(video_id=video_id, plan_key=key, playlist=playlist).count()
+    seg_dir = os.path.dirname(path)
+    new = []
+    for sequence, (duration, filename, _) in enumerate(segments[known:], start=known):
+        try:
+            size = os.path.getsize(os.path.join(seg_dir, filename))
+        except OSError:
+            break
+        new.append(EncodeCheckpoint(
+            video_id=video_id, plan_key=key, playlist=playlist,
+            sequence=sequence, filename=filename, duration=duration, size=size,
+        ))
+    EncodeCheckpoint.objects.bulk_create(new, ignore_conflicts=True)
+    return len(new)
+
+
+def verified(video_id, key, output_dir, playlist):
+    """Leading checkpoints of `playlist` whose files are still intact."""
+    good = []
+    seg_dir = os.path.dirname(os.path.join(output_dir, playlist))
+    for cp in EncodeCheckpoint.objects.filter(video_id=video_id, plan_key=key, playlist=playlist):
+        if cp.sequence != len(good):
+            break
+        try:
+            if os.path.getsize(os.path.join(seg_dir, cp.filename)) != cp.size:
+                break
+        except OSError:
+            break
+        good.append(cp)
+    return good
+
+
+def _truncate(path, count):
+    """Cut a media playlist down to its first `count` segments, without ENDLIST."""
+    with open(path, "r") as f:
+        lines = f.read().splitlines()
+    kept = []
+    seen = 0
+    for line in lines:
+        if line == "#EXT-X-ENDLIST":
+            continue
+        if line and not line.startswith("#"):
+            if seen == count:
+                break
+            seen += 1
+        elif line.startswith("#EXTINF:") and seen == count:
+            break
+        kept.append(line)
+    # Drop tags that belonged to the first segment we cut
+    while kept and kept[-1].startswith(("#EXT-X-DISCONTINUITY", "#EXT-X-BYTERANGE")):
+        kept.pop()
+    with open(path, "w") as f:
+        f.write("\n".join(kept) + "\n")
+
+
+def discard_other_plans(video_id, key):
+    EncodeCheckpoint.objects.filter(video_id=video_id).exclude(plan_key=key).delete()
+
+
+def prepare_resume(video_id, key, output_dir, playlists):
+    """Get the output ready to continue an interrupted single-pass encode.
+
+    Returns the number of segments every rendition has in common and the
+    media time they cover (0, 0.0 means start from scratch). Playlists are
+    truncated to that many segments so ffmpeg can append to them.
+    """
+    discard_other_plans(video_id, key)
+    if not enabled():
+        return 0, 0.0
+
+    good = {name: verified(video_id, key, output_dir, name) for name, _ in playlists}
+    # The last listed segment is given back: an ffmpeg that was stopped rather
+    # than killed lists its cut-short final segment too.
+    count = min(len(v) for v in good.values()) - 1 if good else 0
+    if count <= 0:
+        return 0, 0.0
+
+    for name, _ in playlists:
+        _truncate(os.path.join(output_dir, name), count)
+    EncodeCheckpoint.objects.filter(video_id=video_id, plan_key=key, sequence__gte=count).delete()
+    first = good[playlists[0][0]]
+    return count, sum(cp.duration for cp in first[:count])
+
+
+def _chunk_playlist(output_dir, index, name):
+    return os.path.relpath(os.path.join(chunk_dir(output_dir, index), name), output_dir)
+
+
+def chunk_done(video_id, key, output_dir, index, playlists):
+    """True when every playlist of a chunk is complete and all its segments verify."""
+    for name, _ in playlists:
+        rel = _chunk_playlist(output_dir, index, name)
+        path = os.path.join(output_dir, rel)
+        if not os.path.isfile(path):
+            return False
+        _, segments, ended = encoding.read_media_playlist(path)
+        if not ended or len(verified(video_id, key, output_dir, rel)) != len(segments):
+            return False
+    return True
+
+
+def record_chunk(video_id, key, output_dir, index, playlists):
+    for name, _ in playlists:
+        record(video_id, key, output_dir, _chunk_playlist(output_dir, index, name))
+
+
+def clear(video_id):
+    EncodeCheckpoint.objects.filter(video_id=video_id).delete()
@@ -0,0 +1,201 @@
+# content/chunked.py
+# Split -> encode -> stitch: long sources are cut at keyframes into time ranges
+# that are encoded independently and then joined into one VOD playlist.
+import math
+import os
+import shutil
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from django.conf import settings
+from . import encoding
+from .runner import run_ffmpeg
+
+
+# Shorter trailing segments of a non-final chunk only repeat the next chunk's start
+TAIL_SECONDS = 0.5
+
+
+def parallel_mode() -> str:
+    # 'off', 'local' (thread pool of ffmpeg processes) or 'celery' (chord)
+    return getattr(settings, 'HLS_PARALLEL_MODE', 'off')
+
+
+def chunk_seconds() -> int:
+    # Round to whole segments so only the last segment of the file is short
+    seg = encoding.segment_seconds()
+    target = int(getattr(settings, 'HLS_CHUNK_SECONDS', 300))
+    return max(seg, target - target % seg)
+
+
+def parallel_workers() -> int:
+    return int(getattr(settings, 'HLS_PARALLEL_WORKERS', 0) or os.cpu_count() or 1)
+
+
+def plan_chunks(keyframes, duration, target=None):
+    """Return [{'index', 'start', 'length'}] covering the whole source.
+
+    Boundaries are the first keyframe at or after every `target` seconds, so a
+    stream-copied chunk starts exactly on an IDR frame. The last chunk has no
+    length and runs to the end of the input; a tail shorter than half a chunk
+    is folded into the previous one.
+    """
+    target = target or chunk_seconds()
+    duration = float(duration or 0)
+    bounds = [0.0]
+    next_cut = target
+    for t in keyframes:
+        if t >= next_cut and (not duration or duration - t >= target / 2):
+            bounds.append(t)
+            next_cut = t + target
+
+    chunks = []
+    for i, start in enumerate(bounds):
+        end = bounds[i + 1] if i + 1 < len(bounds) else None
+        chunks.append({
+            "index": i,
+            "start": start,
+            "length": (end - start) if end is not None else None,
+        })
+    return chunks
+
+
+def chunk_dir(output_dir, index) -> str:
+    return os.path.join(output_dir, "chunks", f"{index:04d}")
+
+
+def chunk_commands(input_path, output_dir, safe_base, chunks, renditions=None, has_audio=True):
+    cmds = {}
+    for c in chunks:
+        out = chunk_dir(output_dir, c["index"])
+        os.makedirs(out, exist_ok=True)
+        # Poster and sprite sheets go straight to the final directory
+        if renditions:
+            cmd = encoding.ladder_command(
+                input_path, out, safe_base, renditions, has_audio,
+                start=c["start"], length=c["length"], preview_dir=output_dir)
+        else:
+            cmd = encoding.copy_command(
+                input_path, out, safe_base, start=c["start"], length=c["length"],
+                preview_dir=output_dir)
+        cmds[c["index"]] = cmd
+    return cmds
+
+
+def run_local(cmds, workers=None, on_done=None, on_tick=None, on_progress=None, interval=5):
+    """Run the chunk encodes concurrently; the first failure is re-raised.
+
+    `cmds` maps chunk index -> ffmpeg command. `on_done(index)` and `on_tick()`
+    are called from the calling thread, so they may use the ORM;
+    `on_progress(index, block)` is called from the pool threads. On the first
+    failure the chunks not started yet are cancelled and the running ffmpeg
+    processes killed, so the error surfaces at once.
+    """
+    workers = workers or parallel_workers()
+    stop = threading.Event()
+    lock = threading.Lock()
+    procs = []
+
+    def started(proc):
+        with lock:
+            procs.append(proc)
+            if stop.is_set():
+                proc.kill()
+
+    def abort():
+        with lock:
+            stop.set()
+            for proc in procs:
+                if proc.poll() is None:
+                    proc.kill()
+
+    def run(index, cmd):
+        if stop.is_set():
+            return
+        report = (lambda block: on_progress(index, block)) if on_progress else None
+        try:
+            run_ffmpeg(cmd, interval=interval, on_progress=report, on_start=started)
+        except BaseException:
+            # Before this thread picks up the next chunk
+            abort()
+            raise
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(run, index, cmd): index for index, cmd in cmds.items()}
+        try:
+            while pending:
+                done, _ = wait(pending, timeout=interval, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    future.result()
+                    if on_done:
+                        on_done(index)
+                if on_tick:
+                    on_tick()
+        except BaseException:
+            # Leaving the block waits for the pool threads; make that quick
+            abort()
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+
+
+def stitch(output_dir, playlists, chunk_count):
+    """Join the chunk playlists into one continuous VOD playlist per rendition.
+
+    Segment files are moved out of the chunk directories and renumbered from
+    0 (in single-file fMP4 mode each chunk contributes one file with its
+    byte ranges untouched). Each chunk boundary gets an EXT-X-DISCONTINUITY,
+    and its own EXT-X-MAP for fMP4, so players reset their decoders across
+    the audio priming gap every chunk encode starts with.
+    """
+    for playlist_name, prefix in playlists:
+        stem = prefix.rstrip("_")
+        lines = []
+        number = 0
+        target = 0
+        for index in range(chunk_count):
+            src_dir = chunk_dir(output_dir, index)
+            init, segments, _ = encoding.read_media_playlist(os.path.join(src_dir, playlist_name))
+            # With B-frames a stream-copied chunk also picks up the next chunk's
+            # opening keyframe (its DTS precedes the cut), which ffmpeg puts in a
+            # sliver of a final segment. Those frames are repeated in the next
+            # chunk, so the sliver is dropped.
+            if index < chunk_count - 1 and len(segments) > 1 and segments[-1][0] < TAIL_SECONDS:
+                segments = segments[:-1]
+
+            renamed = {}
+            for _, seg_name, _ in segments:
+                if seg_name not in renamed:
+                    ext = os.path.splitext(seg_name)[1]
+                    renamed[seg_name] = f"{prefix}{number:03d}{ext}"
+                    number += 1
+            if init and init[0] not in renamed:
+                renamed[init[0]] = f"{stem}_init{index:03d}.mp4"
+            for old, new in renamed.items():
+                os.replace(os.path.join(src_dir, old), os.path.join(output_dir, new))
+
+            if index:
+                lines.append("#EXT-X-DISCONTINUITY")
+            if init:
+                attrs = 'URI="{{ dynamic_path }}/' + renamed[init[0]] + '"'
+                if init[1]:
+                    attrs += f',BYTERANGE="{init[1]}"'
+                lines.append("#EXT-X-MAP:" + attrs)
+            for seg_duration, seg_name, byterange in segments:
+                target = max(target, math.ceil(seg_duration))
+                lines.append(f"#EXTINF:{seg_duration:.6f},")
+                if byterange:
+                    lines.append(f"#EXT-X-BYTERANGE:{byterange}")
+                lines.append("{{ dynamic_path }}/" + renamed[seg_name])
+
+        header = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:7" if encoding.segment_type() == 'fmp4' else "#EXT-X-VERSION:6",
+            f"#EXT-X-TARGETDURATION:{target or encoding.segment_seconds()}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-PLAYLIST-TYPE:VOD",
+            "#EXT-X-INDEPENDENT-SEGMENTS",
+        ]
+        with open(os.path.join(output_dir, playlist_name), "w") as f:
+            f.write("\n".join(header + lines + ["#EXT-X-ENDLIST"]) + "\n")
+
+    shutil.rmtree(os.path.join(output_dir, "chunks"), ignore_errors=True)
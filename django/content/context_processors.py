@@ -1,7 +1,5 @@
 from django.templatetags.static import static
 from django.utils.html import strip_tags
-from django.urls import resolve
-from content.models import Video
 from django.conf import settings
 
 def dynamic_og_context(request):
@@ -14,18 +12,13 @@ def dynamic_og_context(request):
     og_image = request.build_absolute_uri(static('img/favicon.png'))
     og_url = request.build_absolute_uri(path)
 
-    # Check if this is a video detail view
-    match = resolve(path)
-    if match.url_name == 'movie':  # Adjust based on your actual URL name
-        slug = match.kwargs.get('video_id')
-        try:
-            video = Video.objects.get(slug=slug)
-            og_title = video.name
-            og_description = strip_tags(video.description)[:200]
-            if video.thumbnail:
-                og_image = request.build_absolute_uri(video.thumbnail.url)
-        except Video.DoesNotExist:
-            pass
+    # A video detail view leaves its video on the request
+    video = getattr(request, 'og_video', None)
+    if video:
+        og_title = video.name
+        og_description = strip_tags(video.description)[:200]
+        if video.thumbnail:
+            og_image = request.build_absolute_uri(video.thumbnail.url)
 
     return {
         'og_title': og_title,
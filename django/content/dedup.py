@@ -0,0 +1,185 @@
+# content/dedup.py
+# Content-addressed sources: the same media imported twice (upload and
+# server_path, or a re-upload of an unchanged file) is encoded once. Videos
+# share the HLS outputs of their SourceFingerprint, which is reference-counted
+# by the videos pointing at it.
+import hashlib
+import os
+import shutil
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from . import caching, encoding
+from .models import MediaProbe, SourceFingerprint, Video
+
+# An encoder in one of these states will still produce the outputs
+ACTIVE = ('Pending', 'Queued', 'Processing')
+
+
+def enabled() -> bool:
+    return getattr(settings, 'HLS_DEDUP', True)
+
+
+def fingerprint(path):
+    """(sha256 hexdigest, size) of a source file, from its size and sampled chunks.
+
+    HLS_FINGERPRINT_SAMPLES chunks of HLS_FINGERPRINT_CHUNK bytes are read at
+    evenly spaced offsets (the first and last included), so the cost doesn't
+    grow with the file; files smaller than that are hashed whole.
+    """
+    samples = max(2, int(getattr(settings, 'HLS_FINGERPRINT_SAMPLES', 16)))
+    chunk = int(getattr(settings, 'HLS_FINGERPRINT_CHUNK', 64 * 1024))
+    size = os.path.getsize(path)
+    h = hashlib.sha256(str(size).encode())
+    with open(path, 'rb') as f:
+        if size <= samples * chunk:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                h.update(block)
+        else:
+            step = (size - chunk) / (samples - 1)
+            for i in range(samples):
+                f.seek(int(i * step))
+                h.update(f.read(chunk))
+    return h.hexdigest(), size
+
+
+def _output_dir(digest):
+    return os.path.join("videos/hls_output", f"src-{digest[:16]}")
+
+
+def claim(video, path):
+    """Attach `video` to the index entry of its source and decide what it does.
+
+    Returns (entry, role): 'reuse' when finished outputs made with the current
+    encode settings exist, 'wait' when another video is encoding the same
+    source (the video is parked as Queued until that encode finishes), or
+    'encode' when this video produces them.
+    """
+    digest, size = fingerprint(path)
+    previous = video.fingerprint_id
+    key = encoding.settings_key()
+    with transaction.atomic():
+        entry, _ = SourceFingerprint.objects.select_for_update().get_or_create(
+            digest=digest, defaults={'size': size, 'output_dir': _output_dir(digest)})
+        if previous != entry.pk:
+            Video.objects.filter(pk=video.pk).update(fingerprint=entry)
+            video.fingerprint = entry
+
+        finished = entry.hls and os.path.isfile(os.path.join(settings.MEDIA_ROOT, entry.hls))
+        if finished and entry.settings_key == key:
+            role = 'reuse'
+        elif (not finished and entry.encoder_id not in (None, video.pk)
+              and Video.objects.filter(pk=entry.encoder_id, status__in=ACTIVE).exists()):
+            # Parked under the lock so complete() can't run in between
+            Video.objects.filter(pk=video.pk).update(status='Queued', is_running=False)
+            caching.bump_video_version(video.pk)
+            role = 'wait'
+        else:
+            # No outputs yet, or stale ones (the encode settings changed since):
+            # encoded again into the same directory
+            entry.encoder = video
+            entry.hls = None
+            entry.settings_key = key
+            entry.save(update_fields=['encoder', 'hls', 'settings_key'])
+            role = 'encode'
+
+    # The video's source changed: drop its reference to the old media
+    if previous and previous != entry.pk:
+        _release(previous, video.pk)
+    return entry, role
+
+
+def adopt(video, entry, path):
+    """Point `video` at the finished outputs of `entry` instead of encoding."""
+    if not MediaProbe.objects.filter(video=video).exists():
+        # Same media, same probe: copy a sibling's instead of scanning the file again
+        probe = MediaProbe.objects.filter(video__fingerprint=entry).exclude(video=video).first()
+        if probe:
+            st = os.stat(path)
+            probe.pk = None
+            probe.video = video
+            probe.source_path, probe.source_size, probe.source_mtime = path, st.st_size, st.st_mtime
+            probe.save()
+    video.hls = entry.hls
+    video.duration = entry.duration
+    if not video.thumbnail:
+        video.thumbnail = entry.thumbnail
+    video.status = 'Completed'
+    video.is_running = False
+    video.errors = None
+    video.save(update_fields=["hls", "duration", "thumbnail", "status", "is_running", "errors"])
+
+
+def complete(video, hls, thumbnail):
+    """Publish a finished encode to the index and to the videos waiting on it."""
+    if not video.fingerprint_id:
+        return 0
+    with transaction.atomic():
+        entry = SourceFingerprint.objects.select_for_update().filter(pk=video.fingerprint_id).first()
+        if not entry:
+            return 0
+        entry.hls, entry.thumbnail, entry.duration = hls, thumbnail, video.duration
+        entry.save(update_fields=['hls', 'thumbnail', 'duration'])
+        waiting = entry.videos.filter(status='Queued').exclude(pk=video.pk)
+        ids = list(waiting.values_list('pk', flat=True))
+        waiting.filter(Q(thumbnail='') | Q(thumbnail__isnull=True)).update(thumbnail=thumbnail)
+        done = waiting.update(hls=hls, duration=video.duration, status='Completed',
+                              is_running=False, errors=None)
+        # A re-encode under new settings: siblings still playing the old outputs move over
+        stale = entry.videos.filter(status='Completed').exclude(pk=video.pk).exclude(hls=hls)
+        ids += list(stale.values_list('pk', flat=True))
+        done += stale.update(hls=hls, duration=video.duration)
+    for pk in ids:
+        caching.bump_video_version(pk)
+    return done
+
+
+def _hand_off(entry, video_id):
+    # Runs under the entry lock. The encode `video_id` was running won't
+    # finish; requeue the waiting videos so one of them takes it over.
+    entry.encoder = None
+    entry.save(update_fields=['encoder'])
+    waiting = list(entry.videos.filter(status='Queued').exclude(pk=video_id))
+    # Saving as Pending re-triggers process_video once the transaction commits
+    for other in waiting:
+        other.status = 'Pending'
+        other.errors = None
+        other.save(update_fields=["status", "errors"])
+    return len(waiting)
+
+
+def abandon(video):
+    """The encode `video` was running for its source failed."""
+    if not video or not video.fingerprint_id:
+        return 0
+    with transaction.atomic():
+        entry = SourceFingerprint.objects.select_for_update().filter(
+            pk=video.fingerprint_id, encoder=video, hls__isnull=True).first()
+        return _hand_off(entry, video.pk) if entry else 0
+
+
+def _release(entry_id, video_id):
+    with transaction.atomic():
+        entry = SourceFingerprint.objects.select_for_update().filter(pk=entry_id).first()
+        if not entry:
+            return False
+        if entry.videos.exclude(pk=video_id).exists():
+            # After a delete the encoder column is already NULL (SET_NULL)
+            if entry.encoder_id in (None, video_id) and not entry.hls:
+                _hand_off(entry, video_id)
+            return True
+        entry.delete()
+    output_dir = os.path.join(settings.MEDIA_ROOT, entry.output_dir)
+    transaction.on_commit(lambda: shutil.rmtree(output_dir, ignore_errors=True))
+    return False
+
+
+def release(video):
+    """Drop `video`'s reference to its shared outputs.
+
+    Returns True while other videos still use them. The last reference
+    deletes the index entry and the output directory.
+    """
+    if not video.fingerprint_id:
+        return False
+    return _release(video.fingerprint_id, video.pk)
@@ -0,0 +1,490 @@
+# content/encoding.py
+import glob
+import hashlib
+import json
+import os
+import re
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# H.264 High@4.1 and AAC-LC, matching the -profile/-level flags used below
+VIDEO_CODEC_TAG = "avc1.640029"
+AUDIO_CODEC_TAG = "mp4a.40.2"
+
+
+def segment_seconds() -> int:
+    return int(getattr(settings, 'HLS_SEGMENT_SECONDS', 6))
+
+
+def segment_type() -> str:
+    # 'mpegts' (.ts segments) or 'fmp4' (CMAF fragments)
+    return getattr(settings, 'HLS_SEGMENT_TYPE', 'mpegts')
+
+
+def single_file() -> bool:
+    # fMP4 only: one media file per rendition, segments addressed by byte range
+    return segment_type() == 'fmp4' and bool(getattr(settings, 'HLS_SINGLE_FILE', False))
+
+
+def ffmpeg_threads() -> int:
+    # Threads one ffmpeg job may use; 0 leaves it to ffmpeg (one per core)
+    return int(getattr(settings, 'HLS_FFMPEG_THREADS', 0) or 0)
+
+
+def _thread_args():
+    n = ffmpeg_threads()
+    return ['-threads', str(n), '-filter_complex_threads', str(n)] if n else []
+
+
+# Poster frame time, as the old separate thumbnail pass used
+POSTER_SECONDS = 2
+
+
+def trickplay() -> dict:
+    """Seek-preview sprite settings, or None when HLS_TRICKPLAY is off."""
+    if not getattr(settings, 'HLS_TRICKPLAY', True):
+        return None
+    return {
+        "interval": int(getattr(settings, 'HLS_SPRITE_INTERVAL', 10)),
+        "width": int(getattr(settings, 'HLS_SPRITE_WIDTH', 160)),
+        "columns": int(getattr(settings, 'HLS_SPRITE_COLUMNS', 10)),
+        "rows": int(getattr(settings, 'HLS_SPRITE_ROWS', 10)),
+    }
+
+
+def poster_name(safe_base) -> str:
+    return f"{safe_base}_thumb.jpg"
+
+
+def preview_prefix(safe_base, start=None) -> str:
+    # Single preview frames, named after the media time their series starts at
+    # (chunks and resumed runs each write their own); tiled into sheets at the end
+    return f"{safe_base}_preview_{int(round((start or 0) * 1000)):09d}_"
+
+
+def thumbnails_vtt_name(safe_base) -> str:
+    return f"{safe_base}_thumbs.vtt"
+
+
+def get_ladder():
+    # Highest to lowest quality (see HLS_LADDER in settings, the one definition)
+    ladder = getattr(settings, 'HLS_LADDER', None)
+    if not ladder:
+        raise ImproperlyConfigured(
+            "HLS_LADDER must list at least one rendition "
+            "({'name', 'height', 'video_bitrate', 'audio_bitrate'}, highest first).")
+    return ladder
+
+
+# Settings that change what an encode writes
+OUTPUT_SETTINGS = (
+    'HLS_ENCODE_MODE', 'HLS_LADDER', 'HLS_SEGMENT_SECONDS', 'HLS_SEGMENT_TYPE', 'HLS_SINGLE_FILE',
+    'HLS_X264_PRESET', 'HLS_TRICKPLAY', 'HLS_SPRITE_INTERVAL', 'HLS_SPRITE_WIDTH',
+    'HLS_SPRITE_COLUMNS', 'HLS_SPRITE_ROWS',
+)
+
+
+def settings_key() -> str:
+    """Hash of the encode settings; outputs made under another one are stale."""
+    payload = json.dumps([getattr(settings, name, None) for name in OUTPUT_SETTINGS], sort_keys=True)
+    return hashlib.sha1(payload.encode()).hexdigest()
+
+
+def _even(value) -> int:
+    return max(2, int(round(value / 2.0)) * 2)
+
+
+def select_renditions(src_width, src_height, ladder=None):
+    """Return the ladder rungs that fit the source, with the output size filled in.
+
+    Each rung is treated as a 16:9 box of its height; the source is scaled to fit
+    inside the box keeping its aspect ratio. Rungs that would upscale are dropped,
+    but the source always gets at least one rendition.
+    """
+    ladder = ladder or get_ladder()
+    src_width = int(src_width or 0)
+    src_height = int(src_height or 0)
+    if not src_width or not src_height:
+        # Unknown geometry: assume 1080p and keep the whole ladder
+        src_width, src_height = 1920, 1080
+
+    rungs = []
+    for rung in ladder:
+        box_height = int(rung["height"])
+        box_width = box_height * 16 / 9
+        factor = min(box_width / src_width, box_height / src_height)
+        if factor > 1:
+            continue
+        r = dict(rung)
+        r["width"] = _even(src_width * factor)
+        r["height"] = _even(src_height * factor)
+        if not any(x["height"] == r["height"] for x in rungs):
+            rungs.append(r)
+
+    if not rungs:
+        r = dict(ladder[-1])
+        r["width"] = _even(src_width)
+        r["height"] = _even(src_height)
+        rungs = [r]
+    return rungs
+
+
+def stream_inf(rendition, has_audio=True) -> str:
+    video_kbps = int(rendition["video_bitrate"])
+    audio_kbps = int(rendition.get("audio_bitrate", 128)) if has_audio else 0
+    # Peak is bounded by -maxrate; allow ~10% for container overhead
+    peak = int((video_kbps * 1.07 + audio_kbps) * 1000 * 1.1)
+    average = int((video_kbps + audio_kbps) * 1000 * 1.05)
+    codecs = VIDEO_CODEC_TAG + (f",{AUDIO_CODEC_TAG}" if has_audio else "")
+    return (
+        f'#EXT-X-STREAM-INF:BANDWIDTH={peak},AVERAGE-BANDWIDTH={average},'
+        f'RESOLUTION={rendition["width"]}x{rendition["height"]},CODECS="{codecs}"'
+    )
+
+
+def _input_args(input_path, start=None, length=None, keyframes_only=False):
+    # -ss before -i seeks the demuxer, so a chunk never decodes what precedes it
+    args = ['ffmpeg', '-y']
+    if start:
+        args += ['-ss', f'{start:.6f}']
+    if keyframes_only:
+        # Decoder option: stream copies are not decoded and keep every frame
+        args += ['-skip_frame', 'nokey']
+    args += ['-i', input_path]
+    if length:
+        args += ['-t', f'{length:.6f}']
+    return args
+
+
+def _ts_offset_args(start=None):
+    # Keep chunk timestamps continuous with the chunks that precede it
+    return ['-output_ts_offset', f'{start:.6f}'] if start else []
+
+
+def _segment_args(output_dir, prefix, append=False):
+    """Segment muxing options; `prefix` is the file name up to the segment number.
+
+    With `append`, ffmpeg continues an existing (truncated) playlist instead of
+    starting a new one, numbering new segments after the ones already listed.
+    """
+    flags = 'independent_segments' + ('+append_list' if append else '')
+    if segment_type() != 'fmp4':
+        return ['-hls_flags', flags,
+                '-hls_segment_filename', os.path.join(output_dir, f"{prefix}%03d.ts")]
+
+    stem = prefix.rstrip('_')
+    args = ['-hls_segment_type', 'fmp4']
+    if single_file():
+        # The init section and every fragment go into one file per rendition
+        return args + ['-hls_flags', flags + '+single_file',
+                       '-hls_segment_filename', os.path.join(output_dir, f"{stem}.mp4")]
+    return args + ['-hls_flags', flags,
+                   '-hls_fmp4_init_filename', f"{stem}_init.mp4",
+                   '-hls_segment_filename', os.path.join(output_dir, f"{prefix}%03d.m4s")]
+
+
+def _preview_outputs(preview_dir, safe_base, start=None, keyframes_only=False):
+    """[(filter chain, output args)] for the poster and the sprite sheets.
+
+    They are fed from the video the HLS pass decodes anyway, so the source is
+    read once. Only the part of the source that starts at 0 has the poster.
+    With `keyframes_only` (stream copies, which decode nothing else), the
+    poster is the first keyframe after POSTER_SECONDS and each sprite interval
+    shows the keyframe nearest to it.
+    """
+    outputs = []
+    if not start:
+        # trim must end: a branch that never reaches EOF makes ffmpeg queue
+        # every decoded frame for it
+        outputs.append((
+            f"select=gte(t\\,{POSTER_SECONDS}),trim=end_frame=1" if keyframes_only else
+            f"trim=start={POSTER_SECONDS}:end={POSTER_SECONDS + 1},select=eq(n\\,0)",
+            ['-frames:v', '1', '-update', '1', '-q:v', '2',
+             os.path.join(preview_dir, poster_name(safe_base))],
+        ))
+    sprites = trickplay()
+    if sprites:
+        # Tiling happens afterwards (build_sprites): ffmpeg's tile filter only
+        # emits a sheet once it is full, and buffers the other outputs until then
+        if keyframes_only:
+            # One frame per interval, repeating the last keyframe across longer GOPs
+            chain = f"fps=1/{sprites['interval']}:eof_action=pass"
+        else:
+            # First frame at or after every interval (the fps filter drops the
+            # last one when a chunk ends between two intervals)
+            chain = f"select=gte(t\\,selected_n*{sprites['interval']})"
+        outputs.append((
+            f"{chain},scale={sprites['width']}:-2",
+            ['-fps_mode', 'passthrough', '-q:v', '4', '-start_number', '0', '-f', 'image2',
+             os.path.join(preview_dir, preview_prefix(safe_base, start) + "%05d.jpg")],
+        ))
+    return outputs
+
+
+def _preview_maps(outputs, labels):
+    # Poster/sprite chains and their outputs, one per split label
+    chains, args = [], []
+    for i, ((chain, out), label) in enumerate(zip(outputs, labels)):
+        chains.append(f"[{label}]{chain}[pv{i}]")
+        args += ['-map', f'[pv{i}]'] + out
+    return chains, args
+
+
+def copy_command(input_path, output_dir, safe_base, start=None, length=None, append=False,
+                 preview_dir=None):
+    """Fast path: copy H.264 video, transcode audio to AAC stereo.
+
+    With `preview_dir`, the keyframes of the video (and nothing else) are
+    decoded for the poster and sprite sheets in the same run.
+    """
+    m3u8_path = os.path.join(output_dir, f"{safe_base}_hls.m3u8")
+    # MPEG-TS needs Annex B start codes; fMP4 keeps the avcC layout
+    bsf = ['-bsf:v', 'h264_mp4toannexb'] if segment_type() != 'fmp4' else []
+    previews = _preview_outputs(preview_dir, safe_base, start, keyframes_only=True) if preview_dir else []
+    graph, preview_args = [], []
+    if previews:
+        labels = [f"x{i}" for i in range(len(previews))]
+        graph.append(f"[0:v:0]split={len(previews)}" + "".join(f"[{x}]" for x in labels))
+        chains, preview_args = _preview_maps(previews, labels)
+        graph += chains
+    return _input_args(input_path, start, length, keyframes_only=bool(previews)) + (
+        ['-filter_complex', ";".join(graph)] if graph else []) + [
+        '-map', '0:v:0', '-map', '0:a:0?', '-sn',
+        '-c:v', 'copy'] + bsf + [
+        '-c:a', 'aac', '-b:a', '128k', '-ac', '2', '-ar', '48000',
+    ] + _thread_args() + [
+        '-hls_time', str(segment_seconds()),
+        '-hls_list_size', '0',
+        '-hls_playlist_type', 'event',
+    ] + _segment_args(output_dir, f"{safe_base}_hls", append) + [
+        '-hls_base_url', '{{ dynamic_path }}/',
+    ] + _ts_offset_args(start) + [
+        '-f', 'hls', m3u8_path,
+    ] + preview_args
+
+
+def ladder_command(input_path, output_dir, safe_base, renditions, has_audio=True,
+                   start=None, length=None, append=False, preview_dir=None):
+    """Transcode the source into every rendition with a single ffmpeg run.
+
+    Keyframes are forced on segment boundaries so that the renditions stay
+    aligned and players can switch between them at any segment.
+
+    Playlists are written as EVENT so they are updated after every segment
+    while ffmpeg runs; finalize_playlists() turns them into VOD afterwards.
+    """
+    hls_time = segment_seconds()
+    preset = getattr(settings, 'HLS_X264_PRESET', 'veryfast')
+    # ffmpeg only expands %v in the fMP4 init name when there are several variants
+    prefix = f"{safe_base}_%v_" if len(renditions) > 1 else f"{safe_base}_{renditions[0]['name']}_"
+
+    previews = _preview_outputs(preview_dir, safe_base, start) if preview_dir else []
+    extra = [f"x{i}" for i in range(len(previews))]
+    splits = "".join(f"[s{i}]" for i in range(len(renditions))) + "".join(f"[{x}]" for x in extra)
+    graph = [f"[0:v:0]split={len(renditions) + len(extra)}{splits}"]
+    for i, r in enumerate(renditions):
+        graph.append(f"[s{i}]scale={r['width']}:{r['height']},setsar=1,format=yuv420p[v{i}]")
+    preview_chains, preview_args = _preview_maps(previews, extra)
+    graph += preview_chains
+
+    cmd = _input_args(input_path, start, length) + ['-filter_complex', ";".join(graph)]
+    stream_map = []
+    for i, r in enumerate(renditions):
+        vb = int(r["video_bitrate"])
+        cmd += [
+            '-map', f'[v{i}]',
+            f'-c:v:{i}', 'libx264',
+            f'-b:v:{i}', f'{vb}k',
+            f'-maxrate:v:{i}', f'{int(vb * 1.07)}k',
+            f'-bufsize:v:{i}', f'{int(vb * 1.5)}k',
+        ]
+        entry = f"v:{i}"
+        if has_audio:
+            cmd += [
+                '-map', '0:a:0',
+                f'-c:a:{i}', 'aac',
+                f'-b:a:{i}', f"{int(r.get('audio_bitrate', 128))}k",
+            ]
+            entry += f",a:{i}"
+        stream_map.append(f"{entry},name:{r['name']}")
+
+    if has_audio:
+        cmd += ['-ac', '2', '-ar', '48000']
+    cmd += [
+        '-sn',
+        '-preset', preset,
+        '-profile:v', 'high', '-level:v', '4.1',
+        '-force_key_frames', f'expr:gte(t,n_forced*{hls_time})',
+        '-sc_threshold', '0',
+    ] + _thread_args() + [
+        '-var_stream_map', " ".join(stream_map),
+        '-hls_time', str(hls_time),
+        '-hls_list_size', '0',
+        '-hls_playlist_type', 'event',
+    ] + _segment_args(output_dir, prefix, append) + [
+        '-hls_base_url', '{{ dynamic_path }}/',
+    ] + _ts_offset_args(start) + [
+        '-f', 'hls', os.path.join(output_dir, f"{safe_base}_%v.m3u8"),
+    ] + preview_args
+    return cmd
+
+
+def variant_playlist_name(safe_base, rendition) -> str:
+    return f"{safe_base}_{rendition['name']}.m3u8"
+
+
+def output_playlists(safe_base, renditions=None):
+    """(media playlist name, segment file prefix) pairs written by the commands above."""
+    if not renditions:
+        return [(f"{safe_base}_hls.m3u8", f"{safe_base}_hls")]
+    return [(variant_playlist_name(safe_base, r), f"{safe_base}_{r['name']}_") for r in renditions]
+
+
+def _uri_name(value):
+    return value.rsplit("/", 1)[-1]
+
+
+def read_media_playlist(playlist_path):
+    """Return (init, segments, ended) from a media playlist.
+
+    `init` is (file, byterange) from EXT-X-MAP or None; each segment is a
+    (duration, file, byterange) tuple. File names lose any base URL. `ended`
+    tells whether the playlist carries EXT-X-ENDLIST.
+    """
+    init = None
+    segments = []
+    ended = False
+    duration = None
+    byterange = None
+    with open(playlist_path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#EXT-X-MAP:"):
+                attrs = dict(
+                    part.split("=", 1) for part in line[len("#EXT-X-MAP:"):].split(",") if "=" in part
+                )
+                init = (_uri_name(attrs["URI"].strip('"')), attrs.get("BYTERANGE", "").strip('"') or None)
+            elif line.startswith("#EXTINF:"):
+                duration = float(line[len("#EXTINF:"):].split(",", 1)[0])
+            elif line.startswith("#EXT-X-BYTERANGE:"):
+                byterange = line[len("#EXT-X-BYTERANGE:"):]
+            elif line == "#EXT-X-ENDLIST":
+                ended = True
+            elif line and not line.startswith("#"):
+                segments.append((duration, _uri_name(line), byterange))
+                duration = None
+                byterange = None
+    return init, segments, ended
+
+
+def early_playback_segments() -> int:
+    # Segments every rendition needs before an encode in progress is
+    # published for playback (0 = only once it is complete)
+    return int(getattr(settings, 'HLS_EARLY_PLAYBACK_SEGMENTS', 3))
+
+
+def fix_map_uri(content):
+    # ffmpeg leaves EXT-X-MAP out of -hls_base_url; point it at the segment view too
+    fixed = content.replace('#EXT-X-MAP:URI="', '#EXT-X-MAP:URI="{{ dynamic_path }}/')
+    return fixed.replace('{{ dynamic_path }}/{{ dynamic_path }}/', '{{ dynamic_path }}/')
+
+
+def finalize_playlists(output_dir, playlists):
+    """Turn the EVENT playlists ffmpeg wrote into final VOD playlists."""
+    for playlist_name, _ in playlists:
+        path = os.path.join(output_dir, playlist_name)
+        with open(path, "r") as f:
+            content = f.read()
+        fixed = fix_map_uri(content.replace('#EXT-X-PLAYLIST-TYPE:EVENT', '#EXT-X-PLAYLIST-TYPE:VOD'))
+        if fixed != content:
+            with open(path, "w") as f:
+                f.write(fixed)
+
+
+def write_master_playlist(path, safe_base, renditions, has_audio=True):
+    # fMP4 media playlists need version 7; TS ones are fine with 3
+    version = 7 if segment_type() == 'fmp4' else 3
+    lines = ["#EXTM3U", f"#EXT-X-VERSION:{version}", "#EXT-X-INDEPENDENT-SEGMENTS"]
+    for r in renditions:
+        lines.append(stream_inf(r, has_audio))
+        lines.append("{{ playlist_path }}/" + variant_playlist_name(safe_base, r))
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def remove_sprites(output_dir, safe_base):
+    base = glob.escape(safe_base)
+    for pattern in (f"{base}_preview_*.jpg", f"{base}_sprite_*.jpg"):
+        for path in glob.glob(os.path.join(output_dir, pattern)):
+            os.remove(path)
+
+
+def _vtt_time(seconds) -> str:
+    ms = int(round(seconds * 1000))
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}"
+
+
+def build_sprites(output_dir, safe_base, duration):
+    """Tile the preview frames into sprite sheets and write the WebVTT track.
+
+    Each series of previews starts at the media time in its name and has one
+    frame per sprite interval; a series ends where the next one starts. The
+    single frames are removed afterwards. Returns the VTT file name, or None
+    if there were no previews.
+    """
+    from PIL import Image
+
+    sprites = trickplay()
+    pattern = re.compile(re.escape(safe_base) + r"_preview_(\d+)_(\d+)\.jpg$")
+    series = {}
+    for name in os.listdir(output_dir):
+        m = pattern.match(name)
+        if m:
+            series.setdefault(int(m.group(1)) / 1000.0, []).append((int(m.group(2)), name))
+    if not sprites or not series:
+        return None
+
+    interval = sprites["interval"]
+    frames = []  # (start, end, file)
+    starts = sorted(series)
+    for n, start in enumerate(starts):
+        limit = starts[n + 1] if n + 1 < len(starts) else float(duration or 0) or float("inf")
+        for k, name in sorted(series[start]):
+            t0 = start + k * interval
+            if t0 >= limit:
+                break
+            frames.append((t0, min(t0 + interval, limit), name))
+        if frames and frames[-1][0] >= start and limit != float("inf"):
+            # Keyframe-only previews may stop short of the series end; the last frame covers the rest
+            frames[-1] = (frames[-1][0], limit, frames[-1][2])
+
+    for old in glob.glob(os.path.join(output_dir, f"{glob.escape(safe_base)}_sprite_*.jpg")):
+        os.remove(old)
+    cols, rows = sprites["columns"], sprites["rows"]
+    per_sheet = cols * rows
+    with Image.open(os.path.join(output_dir, frames[0][2])) as first:
+        w, h = first.size
+
+    lines = ["WEBVTT", ""]
+    for sheet_no in range(0, len(frames), per_sheet):
+        batch = frames[sheet_no:sheet_no + per_sheet]
+        sheet_name = f"{safe_base}_sprite_{sheet_no // per_sheet:03d}.jpg"
+        sheet = Image.new("RGB", (w * cols, h * ((len(batch) - 1) // cols + 1)))
+        for pos, (t0, t1, name) in enumerate(batch):
+            x, y = pos % cols * w, pos // cols * h
+            with Image.open(os.path.join(output_dir, name)) as frame:
+                sheet.paste(frame.convert("RGB").resize((w, h)), (x, y))
+            lines += [
+                f"{_vtt_time(t0)} --> {_vtt_time(t1)}",
+                "{{ dynamic_path }}/" + f"{sheet_name}#xywh={x},{y},{w},{h}",
+                "",
+            ]
+        sheet.save(os.path.join(output_dir, sheet_name), quality=80)
+
+    name = thumbnails_vtt_name(safe_base)
+    with open(os.path.join(output_dir, name), "w") as f:
+        f.write("\n".join(lines))
+    for frame_list in series.values():
+        for _, frame_name in frame_list:
+            os.remove(os.path.join(output_dir, frame_name))
+    return name
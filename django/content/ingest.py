@@ -0,0 +1,282 @@
+# content/ingest.py
+# Bulk import of the files in ALLOWED_IMPORT_DIRS as server-path videos: no
+# bytes are copied, rows are created in batches and encodes are enqueued a
+# few at a time.
+import os
+import re
+import time
+from collections import defaultdict
+from pathlib import Path
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.text import slugify
+from . import search
+from .models import ImportDir, ImportFile, Video, free_slug
+
+# Encodes that count against the in-flight limit
+IN_FLIGHT = ('Pending', 'Queued', 'Processing')
+
+# Trailing release year: "Movie_Name_2017", "Movie Name (2017)"
+YEAR_RE = re.compile(r'[\s._-]*[(\[]?((?:19|20)\d{2})[)\]]?$')
+
+
+def import_dirs():
+    return [Path(d).expanduser().resolve() for d in (getattr(settings, 'ALLOWED_IMPORT_DIRS', []) or [])]
+
+
+def import_exts():
+    return set(e.lower() for e in getattr(settings, "ALLOWED_IMPORT_EXTS", [".mp4", ".m4v", ".mov", ".mkv", ".webm"]))
+
+
+def scan(dirs=None):
+    """Yield the absolute path of every importable file under `dirs`."""
+    exts = import_exts()
+    for base in dirs or import_dirs():
+        if not base.is_dir():
+            continue
+        for root, subdirs, files in os.walk(base):
+            subdirs[:] = [d for d in subdirs if not d.startswith('.')]
+            for name in files:
+                if not name.startswith('.') and os.path.splitext(name)[1].lower() in exts:
+                    yield str(Path(root, name))
+
+
+def file_label(path):
+    # "Movie.mp4 — /imports/Movies", as the admin picker shows it
+    return f"{os.path.basename(path)} — {os.path.dirname(path)}"
+
+
+# --- Import index (ImportDir / ImportFile) ---
+
+def refresh_index(dirs=None):
+    """Bring the ImportDir/ImportFile index up to date with the import directories.
+
+    A directory whose mtime matches the stored one keeps its listing and only
+    its known subdirectories are stat'ed, so an unchanged tree costs one stat
+    per directory. Returns (directories listed, files added, files removed).
+    """
+    exts = import_exts()
+    known = {d.path: d for d in ImportDir.objects.all()}
+    children = defaultdict(list)
+    for d in known.values():
+        if d.parent_id:
+            children[d.parent_id].append(d.path)
+
+    seen = set()
+    listed = added = removed = 0
+    bases = [str(base) for base in (dirs or import_dirs())]
+    stack = [(base, None) for base in bases]
+    while stack:
+        path, parent = stack.pop()
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            continue
+        seen.add(path)
+        d = known.get(path)
+        if d and d.mtime == mtime and d.parent_id == (parent.pk if parent else None):
+            stack.extend((child, d) for child in children[d.pk])
+            continue
+
+        files, subdirs = [], []
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        continue
+                    if entry.is_dir():
+                        subdirs.append(entry.path)
+                    elif entry.is_file() and os.path.splitext(entry.name)[1].lower() in exts:
+                        files.append(entry.path)
+        except OSError:
+            continue
+        listed += 1
+        # A listing taken within the mtime granularity of a change may miss
+        # it; store no mtime then so the next refresh lists it again
+        stored = mtime if time.time() - mtime > 2 else 0.0
+        if d is None:
+            d = known[path] = ImportDir.objects.create(path=path, parent=parent, mtime=stored)
+        else:
+            d.mtime, d.parent = stored, parent
+            d.save(update_fields=['mtime', 'parent', 'scanned_at'])
+
+        existing = set(d.files.values_list('path', flat=True))
+        gone = existing - set(files)
+        if gone:
+            removed += d.files.filter(path__in=gone).delete()[0]
+        new = [ImportFile(directory=d, path=p, name=os.path.basename(p)) for p in sorted(set(files) - existing)]
+        ImportFile.objects.bulk_create(new, ignore_conflicts=True)
+        added += len(new)
+        stack.extend((sub, d) for sub in subdirs)
+
+    # Directories that disappeared take their files (and subdirectories) along
+    _, deleted = ImportDir.objects.filter(pk__in=[
+        d.pk for p, d in known.items()
+        if p not in seen and any(p == base or p.startswith(base + os.sep) for base in bases)
+    ]).delete()
+    removed += deleted.get(ImportFile._meta.label, 0)
+    return listed, added, removed
+
+
+def ensure_index():
+    """Refresh the import index at most once every IMPORT_INDEX_TTL seconds."""
+    if cache.add('import-index:fresh', True, int(getattr(settings, 'IMPORT_INDEX_TTL', 60))):
+        refresh_index()
+
+
+def title_from_filename(path):
+    """("Jumanji Welcome To The Jungle", 2017) for .../Jumanji_Welcome_To_The_Jungle_2017.mp4"""
+    stem = Path(path).stem
+    year = None
+    m = YEAR_RE.search(stem)
+    if m and m.start() > 0:
+        year = int(m.group(1))
+        stem = stem[:m.start()]
+    name = re.sub(r'[\s._-]+', ' ', stem).strip()
+    if name.islower() or name.isupper():
+        name = name.title()
+    return name or Path(path).stem, year
+
+
+class SlugAllocator:
+    # bulk_create skips the pre_save signal that normally picks unique slugs
+    def __init__(self):
+        self.taken = set(Video.objects.values_list('slug', flat=True))
+
+    def __call__(self, name):
+        slug = free_slug(slugify(name)[:50] or 'video', self.taken)
+        self.taken.add(slug)
+        return slug
+
+
+def imported_paths():
+    return set(Video.objects.filter(source_type='server').values_list('server_path', flat=True))
+
+
+def create_videos(paths, batch_size=500, description=''):
+    """bulk_create a Pending server-path Video per path; returns their ids.
+
+    No signals fire, so nothing is enqueued here (see Enqueuer).
+    """
+    slug_for = SlugAllocator()
+    rows = []
+    for path in paths:
+        name, year = title_from_filename(path)
+        rows.append(Video(
+            source_type='server', server_path=path, name=name, slug=slug_for(name),
+            description=description, release_year=year, status='Pending',
+        ))
+    created = Video.objects.bulk_create(rows, batch_size=batch_size)
+    if created and created[0].pk is None:
+        # Backends that can't return ids from a bulk insert
+        created = Video.objects.filter(server_path__in=[v.server_path for v in rows], status='Pending')
+    ids = [v.pk for v in created]
+    # bulk_create skips the signals that keep the search index current
+    search.index_videos(ids)
+    return ids
+
+
+class Enqueuer:
+    """Feed process_video at most `max_in_flight` unfinished encodes at a time (0 = no limit)."""
+
+    def __init__(self, max_in_flight, poll=5, log=print):
+        self.max_in_flight = max_in_flight
+        self.poll = poll
+        self.log = log
+        self.waiting = []
+        self.in_flight = set()
+
+    def add(self, ids):
+        self.waiting.extend(ids)
+
+    def refresh(self):
+        if self.in_flight:
+            self.in_flight = set(Video.objects.filter(
+                pk__in=self.in_flight, status__in=IN_FLIGHT).values_list('pk', flat=True))
+
+    def pump(self):
+        """Enqueue as many waiting videos as the limit allows; returns how many."""
+        from .tasks import process_video
+        self.refresh()
+        free = len(self.waiting) if not self.max_in_flight else self.max_in_flight - len(self.in_flight)
+        batch, self.waiting = self.waiting[:max(free, 0)], self.waiting[max(free, 0):]
+        for pk in batch:
+            process_video.delay(pk)
+            self.in_flight.add(pk)
+        return len(batch)
+
+    def drain(self):
+        while self.waiting:
+            if self.pump():
+                self.log(f"{len(self.in_flight)} encodes in flight, {len(self.waiting)} waiting")
+            if self.waiting:
+                time.sleep(self.poll)
+
+
+def _inotify():
+    try:
+        import inotify_simple
+    except ImportError:
+        return None
+    return inotify_simple
+
+
+def watch(on_files, poll=10, dirs=None, log=print):
+    """Call `on_files(paths)` with files that land in the import dirs, forever.
+
+    Uses inotify (the optional inotify_simple package) and reacts once a file
+    is closed after writing or moved in; otherwise rescans every `poll`
+    seconds and takes files whose size held still between two scans.
+    """
+    dirs = dirs or import_dirs()
+    inotify = _inotify()
+    if inotify is None:
+        log("inotify_simple not installed; polling the import directories")
+        return _poll(on_files, poll, dirs)
+
+    flags = inotify.flags
+    mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE
+    ino = inotify.INotify()
+    watches = {}
+
+    def add_tree(path):
+        for root, subdirs, _ in os.walk(path):
+            subdirs[:] = [d for d in subdirs if not d.startswith('.')]
+            watches[ino.add_watch(root, mask)] = root
+
+    for base in dirs:
+        if base.is_dir():
+            add_tree(base)
+    exts = import_exts()
+    while True:
+        landed = []
+        for event in ino.read(timeout=poll * 1000):
+            path = os.path.join(watches.get(event.wd, ''), event.name)
+            if event.mask & flags.ISDIR:
+                if event.mask & (flags.CREATE | flags.MOVED_TO):
+                    add_tree(path)
+                    # Files moved in along with the directory raise no events of their own
+                    landed.extend(scan([Path(path)]))
+            elif event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                if os.path.splitext(path)[1].lower() in exts and not event.name.startswith('.'):
+                    landed.append(path)
+        if landed:
+            on_files(landed)
+
+
+def _poll(on_files, poll, dirs):
+    sizes = {}
+    reported = set()
+    while True:
+        time.sleep(poll)
+        current = {}
+        for path in scan(dirs):
+            try:
+                current[path] = os.path.getsize(path)
+            except OSError:
+                continue
+        settled = [p for p, size in current.items() if sizes.get(p) == size and p not in reported]
+        sizes = current
+        reported.update(settled)
+        if settled:
+            on_files(settled)
@@ -0,0 +1,99 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.utils import timezone
+from content import catalog
+from content.ingest import SlugAllocator
+from content.models import Video
+
+# Scratch rows are Failed: never listed, searched, reaped or picked up by an encode
+SCRATCH_STATUS = 'Failed'
+SCRATCH_DESCRIPTION = 'bench_db scratch row'
+
+
+class Command(BaseCommand):
+    help = ('Measure concurrent Video status-update throughput on the configured database '
+            '(run once with and once without DATABASE_URL to compare backends)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=8,
+                            help='Threads writing status rows, like web workers and process_video at once')
+        parser.add_argument('--readers', type=int, default=2, help='Threads reading the catalog meanwhile')
+        parser.add_argument('--updates', type=int, default=200, help='Status updates per writer')
+        parser.add_argument('--videos', type=int, default=50, help='Scratch rows the writers spread over')
+
+    def handle(self, *args, **opts):
+        db = connection.settings_dict
+        self.stdout.write(
+            f"{connection.vendor} {db['NAME']} CONN_MAX_AGE={db['CONN_MAX_AGE']} "
+            f"OPTIONS={db['OPTIONS']}"
+        )
+        # Rows left behind by a run that crashed before its cleanup
+        Video.objects.filter(description=SCRATCH_DESCRIPTION, status=SCRATCH_STATUS).delete()
+        slug_for = SlugAllocator()
+        ids = [v.pk for v in Video.objects.bulk_create(
+            Video(name=f"bench {i}", slug=slug_for(f"bench {i}"), description=SCRATCH_DESCRIPTION,
+                  status=SCRATCH_STATUS)
+            for i in range(opts['videos'])
+        )]
+        try:
+            self.run(ids, opts)
+        finally:
+            Video.objects.filter(pk__in=ids).delete()
+
+    def run(self, ids, opts):
+        done = threading.Event()
+        latencies, errors, reads = [], [], []
+
+        def write(n):
+            mine, failed = [], 0
+            try:
+                for i in range(opts['updates']):
+                    pk = ids[(n * opts['updates'] + i) % len(ids)]
+                    start = time.perf_counter()
+                    try:
+                        # The row writes process_video makes (status and heartbeat updates)
+                        Video.objects.filter(pk=pk).update(
+                            status=SCRATCH_STATUS, is_running=i % 2 == 0, heartbeat_at=timezone.now())
+                    except OperationalError:
+                        failed += 1
+                        continue
+                    mine.append(time.perf_counter() - start)
+            finally:
+                connection.close()
+            latencies.extend(mine)
+            errors.append(failed)
+
+        def read():
+            count = 0
+            try:
+                while not done.is_set():
+                    list(catalog.cards()[:24])
+                    count += 1
+            finally:
+                connection.close()
+            reads.append(count)
+
+        with ThreadPoolExecutor(opts['writers'] + opts['readers']) as pool:
+            readers = [pool.submit(read) for _ in range(opts['readers'])]
+            start = time.perf_counter()
+            writers = [pool.submit(write, n) for n in range(opts['writers'])]
+            for future in writers:
+                future.result()
+            elapsed = time.perf_counter() - start
+            done.set()
+            for future in readers:
+                future.result()
+
+        total = opts['writers'] * opts['updates']
+        self.stdout.write(f"{len(latencies)}/{total} updates in {elapsed:.2f}s: "
+                          f"{len(latencies) / elapsed:.0f} updates/s, {sum(errors)} failed (database locked)")
+        if len(latencies) > 1:
+            cuts = statistics.quantiles(latencies, n=100)
+            self.stdout.write(f"latency p50 {cuts[49] * 1000:.1f}ms  p95 {cuts[94] * 1000:.1f}ms  "
+                              f"p99 {cuts[98] * 1000:.1f}ms  max {max(latencies) * 1000:.1f}ms")
+        if opts['readers']:
+            self.stdout.write(f"{sum(reads)} catalog reads alongside ({sum(reads) / elapsed:.0f}/s)")
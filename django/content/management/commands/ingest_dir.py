@@ -0,0 +1,56 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from pathlib import Path
+from content import ingest
+
+
+class Command(BaseCommand):
+    help = 'Import every video file in the import directories as server-path videos (no copy)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dirs', nargs='*', help='Directories to scan (default: ALLOWED_IMPORT_DIRS)')
+        parser.add_argument('--max-in-flight', type=int,
+                            default=getattr(settings, 'INGEST_MAX_IN_FLIGHT', 4),
+                            help='Unfinished encodes allowed at once; 0 enqueues everything right away')
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--poll', type=int, default=getattr(settings, 'INGEST_POLL_SECONDS', 10),
+                            help='Seconds between in-flight checks (and directory rescans without inotify)')
+        parser.add_argument('--watch', action='store_true', help='Keep running and ingest new files as they land')
+        parser.add_argument('--dry-run', action='store_true', help='List what would be imported')
+
+    def handle(self, *args, **opts):
+        allowed = ingest.import_dirs()
+        dirs = [Path(d).expanduser().resolve() for d in opts['dirs']] or allowed
+        for d in dirs:
+            # server_path must stay inside an allowed directory (see Video.clean)
+            if not any(d == base or base in d.parents for base in allowed):
+                raise CommandError(f"{d} is not inside ALLOWED_IMPORT_DIRS.")
+
+        self.enqueuer = ingest.Enqueuer(opts['max_in_flight'], poll=opts['poll'], log=self.stdout.write)
+        self.opts = opts
+        self.ingest(ingest.scan(dirs))
+        if not opts['dry_run']:
+            self.enqueuer.drain()
+        if opts['watch']:
+            self.stdout.write(f"Watching {', '.join(map(str, dirs))} for new files")
+            ingest.watch(self.on_files, poll=opts['poll'], dirs=dirs, log=self.stdout.write)
+
+    def ingest(self, paths):
+        paths = set(paths)
+        new = sorted(paths - ingest.imported_paths())
+        skipped = len(paths) - len(new)
+        if self.opts['dry_run']:
+            for path in new:
+                name, year = ingest.title_from_filename(path)
+                self.stdout.write(f"{path} -> {name}{f' ({year})' if year else ''}")
+            self.stdout.write(f"{len(new)} new file(s)")
+            return
+        ids = ingest.create_videos(new, batch_size=self.opts['batch_size'])
+        self.enqueuer.add(ids)
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {len(ids)} new video(s); skipped {skipped} already imported"))
+
+    def on_files(self, paths):
+        self.ingest(paths)
+        if not self.opts['dry_run']:
+            self.enqueuer.drain()
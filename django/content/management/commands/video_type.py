@@ -1,13 +1,10 @@
-from django.conf import settings
-import subprocess
-import os
-import json
 from django.core.management.base import BaseCommand, CommandError
 from content.models import Video
-from home.settings import MEDIA_ROOT
+from content.probe import probe_video
+from content.utils import resolve_input_path
 
 class Command(BaseCommand):
-    help = 'Optimize Video'
+    help = 'Show the probed media details of a video'
 
     def add_arguments(self, parser):
         parser.add_argument('video_id', type=str)
@@ -17,28 +14,14 @@ class Command(BaseCommand):
 
         try:
             obj = Video.objects.get(id=video_id)
-            if obj:
-                # Get the relative path from MEDIA_ROOT
-                input_video_rel_path = obj.video.name  # Relative path within MEDIA_ROOT
-                input_video_path = os.path.join(MEDIA_ROOT, input_video_rel_path)
-
-                def get_video_codec(path):
-                    result = subprocess.run(
-                        [
-                            "ffprobe", "-v", "error",
-                            "-select_streams", "v:0",
-                            "-show_entries", "stream=codec_name",
-                            "-of", "default=nw=1:nk=1",
-                            path
-                        ],
-                        capture_output=True,
-                        text=True
-                    )
-                    return result.stdout.strip()
-                codec = get_video_codec(input_video_path)
-                print(f"Video title: {obj.name}")
-                print(f"Video codec: {codec}")
-            else:
-                print('No video with status "Completed" found.')
+            # Reuses the stored probe unless the source file changed
+            probe = probe_video(obj, resolve_input_path(obj))
+            print(f"Video title: {obj.name}")
+            print(f"Video codec: {probe.video_codec}")
+            print(f"Resolution: {probe.resolution or 'unknown'} @ {probe.frame_rate or '?'} fps")
+            print(f"Audio: {probe.audio_codec or 'none'} {probe.audio_layout or ''}".rstrip())
+            print(f"Duration: {probe.duration or 'unknown'}s, {len(probe.keyframes)} keyframes")
+        except Video.DoesNotExist:
+            raise CommandError(f'No video with id={video_id} found.')
         except Exception as e:
             raise CommandError(e)
@@ -0,0 +1,37 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0007_video_server_path_video_source_type_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaProbe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source_path', models.CharField(max_length=1024)),
+                ('source_size', models.BigIntegerField()),
+                ('source_mtime', models.FloatField()),
+                ('format_name', models.CharField(blank=True, max_length=100)),
+                ('duration', models.FloatField(blank=True, null=True)),
+                ('bit_rate', models.BigIntegerField(blank=True, null=True)),
+                ('video_codec', models.CharField(blank=True, max_length=50)),
+                ('width', models.PositiveIntegerField(blank=True, null=True)),
+                ('height', models.PositiveIntegerField(blank=True, null=True)),
+                ('frame_rate', models.FloatField(blank=True, null=True)),
+                ('audio_codec', models.CharField(blank=True, max_length=50)),
+                ('audio_channels', models.PositiveSmallIntegerField(blank=True, null=True)),
+                ('audio_layout', models.CharField(blank=True, max_length=50)),
+                ('streams', models.JSONField(blank=True, default=list)),
+                ('keyframes', models.JSONField(blank=True, default=list)),
+                ('probed_at', models.DateTimeField(auto_now=True)),
+                ('video', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='probe', to='content.video')),
+            ],
+        ),
+    ]
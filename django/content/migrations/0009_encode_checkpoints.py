@@ -0,0 +1,37 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0008_mediaprobe'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='video',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='EncodeCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('plan_key', models.CharField(max_length=40)),
+                ('playlist', models.CharField(max_length=255)),
+                ('sequence', models.PositiveIntegerField()),
+                ('filename', models.CharField(max_length=255)),
+                ('duration', models.FloatField()),
+                ('size', models.BigIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('video', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='content.video')),
+            ],
+            options={
+                'ordering': ('playlist', 'sequence'),
+                'constraints': [models.UniqueConstraint(fields=('video', 'plan_key', 'playlist', 'sequence'), name='unique_encode_checkpoint')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0009_encode_checkpoints'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='video',
+            name='status',
+            field=models.CharField(choices=[('Pending', 'Pending'), ('Queued', 'Queued for encoding'), ('Processing', 'Processing'), ('Completed', 'Completed'), ('Failed', 'Failed')], default='Pending', max_length=20),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0010_video_status_queued'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SourceFingerprint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('digest', models.CharField(max_length=64, unique=True)),
+                ('size', models.BigIntegerField()),
+                ('output_dir', models.CharField(max_length=500)),
+                ('hls', models.CharField(blank=True, max_length=500, null=True)),
+                ('thumbnail', models.CharField(blank=True, max_length=500, null=True)),
+                ('duration', models.CharField(blank=True, max_length=20, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('encoder', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='content.video')),
+            ],
+        ),
+        migrations.AddField(
+            model_name='video',
+            name='fingerprint',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='videos', to='content.sourcefingerprint'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0011_source_fingerprint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportDir',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024, unique=True)),
+                ('mtime', models.FloatField()),
+                ('scanned_at', models.DateTimeField(auto_now=True)),
+                ('parent', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='content.importdir')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ImportFile',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('path', models.CharField(max_length=1024, unique=True)),
+                ('name', models.CharField(max_length=255)),
+                ('directory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='files', to='content.importdir')),
+            ],
+            options={
+                'ordering': ('name', 'path'),
+            },
+        ),
+    ]
@@ -0,0 +1,70 @@
+from django.db import migrations
+
+# Kept here rather than imported from content/search.py, so this migration
+# replays the same way whatever that module becomes.
+
+# PostgreSQL: one tsvector per video, title weighted A, cast and genres B,
+# description C, with a GIN index
+POSTGRES_DOCUMENT = (
+    "setweight(to_tsvector('simple', coalesce(v.name, '')), 'A')"
+    " || setweight(to_tsvector('simple', coalesce((SELECT string_agg(c.name, ' ') FROM content_video_cast vc"
+    " JOIN content_castmember c ON c.id = vc.castmember_id WHERE vc.video_id = v.id), '')), 'B')"
+    " || setweight(to_tsvector('simple', coalesce((SELECT string_agg(g.name, ' ') FROM content_video_genres vg"
+    " JOIN content_genre g ON g.id = vg.genre_id WHERE vg.video_id = v.id), '')), 'B')"
+    " || setweight(to_tsvector('simple', coalesce(v.description, '')), 'C')"
+)
+# SQLite: an FTS5 table whose rowid is the video id
+SQLITE_COLUMNS = (
+    "v.id, coalesce(v.name, ''),"
+    " coalesce((SELECT group_concat(c.name, ' ') FROM content_video_cast vc"
+    " JOIN content_castmember c ON c.id = vc.castmember_id WHERE vc.video_id = v.id), ''),"
+    " coalesce((SELECT group_concat(g.name, ' ') FROM content_video_genres vg"
+    " JOIN content_genre g ON g.id = vg.genre_id WHERE vg.video_id = v.id), ''),"
+    " coalesce(v.description, '')"
+)
+
+CREATE = {
+    'postgresql': [
+        "CREATE TABLE IF NOT EXISTS content_search (video_id bigint PRIMARY KEY, document tsvector NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS content_search_document ON content_search USING gin (document)",
+    ],
+    'sqlite': [
+        "CREATE VIRTUAL TABLE IF NOT EXISTS content_search USING fts5("
+        "name, people, genres, description, tokenize = 'unicode61 remove_diacritics 2')",
+    ],
+}
+BACKFILL = {
+    'postgresql': (
+        f"INSERT INTO content_search (video_id, document) SELECT v.id, {POSTGRES_DOCUMENT}"
+        " FROM content_video v ON CONFLICT (video_id) DO UPDATE SET document = EXCLUDED.document"
+    ),
+    'sqlite': (
+        "INSERT OR REPLACE INTO content_search (rowid, name, people, genres, description)"
+        f" SELECT {SQLITE_COLUMNS} FROM content_video v"
+    ),
+}
+
+
+def create_search_index(apps, schema_editor):
+    # Other backends search without an index (see content/search.py)
+    vendor = schema_editor.connection.vendor
+    if vendor in CREATE:
+        for sql in CREATE[vendor]:
+            schema_editor.execute(sql)
+        schema_editor.execute(BACKFILL[vendor])
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in CREATE:
+        schema_editor.execute("DROP TABLE IF EXISTS content_search")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0013_upload'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('content', '0014_search_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='sourcefingerprint',
+            name='settings_key',
+            field=models.CharField(blank=True, default='', max_length=40),
+        ),
+    ]
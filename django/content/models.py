@@ -1,12 +1,15 @@
 import os
 import math
+import shutil
+import uuid
 from django.core.exceptions import ValidationError
-from django.db.models.signals import pre_save, post_save, post_delete
+from django.db.models.signals import m2m_changed, pre_delete, pre_save, post_save, post_delete
 from django.db import transaction, models
 from django.utils.text import slugify
 from django.dispatch import receiver
 from django.conf import settings
 from pathlib import Path
+from . import caching
 
 def validate_mp4_extension(value):
     ext = os.path.splitext(value.name)[1]  # Get the file extension
@@ -28,12 +31,14 @@ class CastMember(models.Model):
 
 class Video(models.Model):
     PENDING = 'Pending'
+    QUEUED = 'Queued'
     PROCESSING = 'Processing'
     COMPLETED = 'Completed'
     FAILED = 'Failed'
     
     STATUS_CHOICES = (
         (PENDING, 'Pending'),
+        (QUEUED, 'Queued for encoding'),
         (PROCESSING, 'Processing'),
         (COMPLETED, 'Completed'),
         (FAILED, 'Failed'),
@@ -66,6 +71,11 @@ class Video(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
     errors = models.TextField(blank=True, null=True)
     is_running = models.BooleanField(default=False)
+    # Refreshed while an encode runs; a stale value means the worker died
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    # Videos of the same media share the HLS outputs of one SourceFingerprint
+    fingerprint = models.ForeignKey(
+        'SourceFingerprint', null=True, blank=True, on_delete=models.SET_NULL, related_name='videos')
 
     release_year = models.PositiveIntegerField(null=True, blank=True)
     genres = models.ManyToManyField(Genre, blank=True)
@@ -97,31 +107,29 @@ class Video(models.Model):
                 raise ValidationError("server_path must be a file within an allowed import directory.")
 
     def delete(self):
+        # Outputs shared with other videos of the same source stay until the
+        # last of them is deleted
+        from .dedup import release
+        shared = release(self)
+
         # Delete the associated video file before the model instance is deleted
         if self.video:
             self.video.delete(save=False)  # This deletes the video file
 
         # Delete the thumbnail
-        if self.thumbnail:
+        if self.thumbnail and not _thumbnail_in_use(self.thumbnail.name, self.pk):
             self.thumbnail.delete(save=False)
 
         # Delete the corresponding HLS files (m3u8 and segments)
-        if self.hls:
+        if self.hls and not shared:
             # Assuming the hls file path is relative to MEDIA_ROOT
             hls_playlist_path = os.path.join(settings.MEDIA_ROOT, self.hls)
             
-            # Check if the playlist exists and delete it
-            if os.path.exists(hls_playlist_path):
-                os.remove(hls_playlist_path)
-
-            # Delete only the .ts segments related to this specific video
-            hls_dir = os.path.dirname(hls_playlist_path)  # Get the directory where the HLS files are stored
-
-            for filename in os.listdir(hls_dir):
-                os.remove(os.path.join(hls_dir, filename))
-            if os.path.exists(hls_dir):
-                os.rmdir(hls_dir)
-        else:
+            # Everything the encoder wrote (playlists, segments or single-file
+            # renditions, init sections, thumbnails) lives in this one directory
+            hls_dir = os.path.dirname(hls_playlist_path)
+            shutil.rmtree(hls_dir, ignore_errors=True)
+        elif not self.hls:
             # If there is an empty directory, delete it
             try:
                 video_dir = os.path.join(settings.MEDIA_ROOT, f'videos/hls_output/{self.id}')
@@ -162,56 +170,226 @@ class Video(models.Model):
         else:
             return "No duration available"
 
-@receiver(pre_save, sender=Video)
-def delete_old_video_on_change(sender, instance, **kwargs):
-    if not instance.pk:
-        # No primary key yet → it's a new object, nothing to delete
-        return
+class MediaProbe(models.Model):
+    # One ffprobe pass per source file, reused by encoding, the admin and the player
+    video = models.OneToOneField(Video, on_delete=models.CASCADE, related_name='probe')
 
-    try:
-        old_instance = Video.objects.get(pk=instance.pk)
-    except Video.DoesNotExist:
-        return
+    # Identity of the probed file; a different size or mtime means re-probe
+    source_path = models.CharField(max_length=1024)
+    source_size = models.BigIntegerField()
+    source_mtime = models.FloatField()
 
-    old_file = old_instance.video
-    new_file = instance.video
+    format_name = models.CharField(max_length=100, blank=True)
+    duration = models.FloatField(null=True, blank=True)
+    bit_rate = models.BigIntegerField(null=True, blank=True)
 
-    # Only delete if:
-    # 1. There was an old file
-    # 2. The new file is different from the old file
-    if old_file and old_file != new_file:
-        old_path = old_file.path
-        if os.path.isfile(old_path):
-            try:
-                os.remove(old_path)
-                print(f"Deleted old video: {old_path}")
-            except Exception as e:
-                instance.errors = str(e)
+    video_codec = models.CharField(max_length=50, blank=True)
+    width = models.PositiveIntegerField(null=True, blank=True)
+    height = models.PositiveIntegerField(null=True, blank=True)
+    frame_rate = models.FloatField(null=True, blank=True)
+
+    audio_codec = models.CharField(max_length=50, blank=True)
+    audio_channels = models.PositiveSmallIntegerField(null=True, blank=True)
+    audio_layout = models.CharField(max_length=50, blank=True)
+
+    streams = models.JSONField(default=list, blank=True)
+    # Presentation timestamps (seconds) of the video keyframes
+    keyframes = models.JSONField(default=list, blank=True)
+
+    probed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.video_codec or 'unknown'} {self.resolution} ({self.video})"
+
+    def matches(self, path, size, mtime):
+        return self.source_path == path and self.source_size == size and self.source_mtime == mtime
+
+    @property
+    def has_audio(self):
+        return bool(self.audio_codec)
+
+    @property
+    def resolution(self):
+        if self.width and self.height:
+            return f"{self.width}x{self.height}"
+        return ""
+
+    @property
+    def quality_label(self):
+        # Label by the 16:9 box the picture fits in, so 1920x800 is still 1080p
+        if not self.width or not self.height:
+            return ""
+        for label, (w, h) in (("4K", (3840, 2160)), ("1080p", (1920, 1080)), ("720p", (1280, 720))):
+            if self.width >= w * 0.9 or self.height >= h * 0.9:
+                return label
+        return "SD"
+
+class SourceFingerprint(models.Model):
+    # Index of source media by content: size plus a hash of sampled chunks.
+    # Every video whose source has the same digest points here and plays the
+    # one set of HLS outputs; the row (and the files) go with the last video.
+    digest = models.CharField(max_length=64, unique=True)
+    size = models.BigIntegerField()
+    # The video currently producing the outputs; others wait for it
+    encoder = models.ForeignKey(Video, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    output_dir = models.CharField(max_length=500)
+    # Set once the outputs are complete
+    hls = models.CharField(max_length=500, blank=True, null=True)
+    # encoding.settings_key() the outputs were made with; others re-encode
+    settings_key = models.CharField(max_length=40, blank=True, default='')
+    thumbnail = models.CharField(max_length=500, blank=True, null=True)
+    duration = models.CharField(max_length=20, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.digest[:16]} ({self.size} bytes)"
+
+class ImportDir(models.Model):
+    # A directory under ALLOWED_IMPORT_DIRS as it was last listed. Adding,
+    # removing or renaming an entry bumps a directory's mtime, so while it is
+    # unchanged the stored listing is still right and it isn't read again.
+    path = models.CharField(max_length=1024, unique=True)
+    parent = models.ForeignKey('self', null=True, blank=True, on_delete=models.CASCADE, related_name='children')
+    mtime = models.FloatField()
+    scanned_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.path
+
+class ImportFile(models.Model):
+    # An importable file of an ImportDir; backs the admin server_path picker
+    directory = models.ForeignKey(ImportDir, on_delete=models.CASCADE, related_name='files')
+    path = models.CharField(max_length=1024, unique=True)
+    name = models.CharField(max_length=255)
+
+    class Meta:
+        ordering = ('name', 'path')
+
+    def __str__(self):
+        return self.path
+
+class Upload(models.Model):
+    # A resumable (tus-style) upload. Chunks are appended to the file at its
+    # final place under MEDIA_ROOT; once complete it is verified and attached
+    # to a Video.
+    UPLOADING = 'Uploading'
+    VERIFYING = 'Verifying'
+    COMPLETED = 'Completed'
+    FAILED = 'Failed'
+
+    STATUS_CHOICES = (
+        (UPLOADING, 'Uploading'),
+        (VERIFYING, 'Verifying'),
+        (COMPLETED, 'Completed'),
+        (FAILED, 'Failed'),
+    )
+
+    token = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    # Video to attach the file to; a new one is created when empty
+    video = models.ForeignKey(Video, null=True, blank=True, on_delete=models.SET_NULL, related_name='uploads')
+    name = models.CharField(max_length=500, blank=True)
+    # Relative to MEDIA_ROOT, reserved when the upload is created
+    path = models.CharField(max_length=1024)
+    length = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    # "<algorithm> <hex digest>" of the whole file, checked once it is complete
+    checksum = models.CharField(max_length=200, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=UPLOADING)
+    errors = models.TextField(blank=True, null=True)
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.path} ({self.offset}/{self.length})"
+
+class EncodeCheckpoint(models.Model):
+    # A finished segment of an encode that is still in progress. Rows are
+    # scoped by plan_key (the ffmpeg commands plus the source identity) so a
+    # changed source or encode setting never resumes from mismatched output.
+    video = models.ForeignKey(Video, on_delete=models.CASCADE, related_name='checkpoints')
+    plan_key = models.CharField(max_length=40)
+    # Media playlist the segment belongs to, relative to the output directory
+    playlist = models.CharField(max_length=255)
+    sequence = models.PositiveIntegerField()
+    filename = models.CharField(max_length=255)
+    duration = models.FloatField()
+    size = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ('playlist', 'sequence')
+        constraints = [
+            models.UniqueConstraint(
+                fields=['video', 'plan_key', 'playlist', 'sequence'],
+                name='unique_encode_checkpoint',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.playlist}#{self.sequence}"
+
+def free_slug(base, taken):
+    # base, base-1, base-2, ... (kept within the 50-char field): the first not in taken
+    slug, counter = base, 1
+    while slug in taken:
+        suffix = f"-{counter}"
+        slug = base[:50 - len(suffix)] + suffix
+        counter += 1
+    return slug
+
+# Fields the pre_save receiver compares against the stored row
+PRESAVE_FIELDS = ('slug', 'video', 'thumbnail', 'name', 'description')
+# Fields of the search index entry (content/search.py)
+SEARCH_FIELDS = ('name', 'description')
 
 @receiver(pre_save, sender=Video)
-def video_presave(sender, instance, **kwargs):
-    # --- slug handling ---
-    if not instance.slug:
-        instance.slug = slugify(instance.name or "")
-    original_slug = instance.slug
-    qs = Video.objects.filter(slug=instance.slug)
+def video_presave(sender, instance, update_fields=None, **kwargs):
+    # One snapshot of the stored row per save; saves limited to other fields
+    # (status updates from process_video) skip it altogether
+    instance._video_changed = False
+    instance._search_changed = False
+    if update_fields is not None and not set(update_fields) & set(PRESAVE_FIELDS):
+        return
+    old = None
     if instance.pk:
-        qs = qs.exclude(pk=instance.pk)
-    counter = 1
-    while qs.exists():
-        instance.slug = f"{original_slug}-{counter}"
-        counter += 1
-        qs = Video.objects.filter(slug=instance.slug)
-        if instance.pk:
-            qs = qs.exclude(pk=instance.pk)
+        old = Video.objects.only(*PRESAVE_FIELDS).filter(pk=instance.pk).first()
+
+    # --- slug handling ---
+    if update_fields is None or 'slug' in update_fields:
+        if not instance.slug:
+            instance.slug = slugify(instance.name or "")[:50] or 'video'
+        if old is None or instance.slug != old.slug:
+            # Every slug the suffix loop could reach, in one query
+            base = instance.slug
+            taken = set(
+                Video.objects.filter(slug__startswith=base[:40])
+                .exclude(pk=instance.pk).values_list('slug', flat=True)
+            )
+            instance.slug = free_slug(base, taken)
+
+    instance._search_changed = old is None or any(
+        getattr(old, f) != getattr(instance, f) for f in SEARCH_FIELDS
+        if update_fields is None or f in update_fields
+    )
+
+    if old is not None:
+        # --- old video file ---
+        if old.video and old.video != instance.video:
+            old_path = old.video.path
+            if os.path.isfile(old_path):
+                try:
+                    os.remove(old_path)
+                    print(f"Deleted old video: {old_path}")
+                except Exception as e:
+                    instance.errors = str(e)
+
+        # --- old thumbnail: deleted when changed or cleared ---
+        if old.thumbnail and old.thumbnail != instance.thumbnail and not _thumbnail_in_use(old.thumbnail.name, instance.pk):
+            _safe_delete(old.thumbnail)
 
     # --- detect file change ---
-    instance._video_changed = False
     if instance.pk:
-        try:
-            old = Video.objects.get(pk=instance.pk)
-        except Video.DoesNotExist:
-            old = None
         if old:
             # If the underlying file changed, mark for reprocess
             if old.video and instance.video and old.video.name != instance.video.name:
@@ -245,6 +423,14 @@ def trigger_video_processing(sender, instance, created, **kwargs):
         from content.tasks import process_video
         transaction.on_commit(lambda: process_video.delay(instance.id))
 
+def _thumbnail_in_use(name, exclude_pk=None):
+    # Shared encodes hand the same poster to every video of the source; it
+    # stays as long as the outputs it belongs to
+    if not name:
+        return False
+    return (Video.objects.filter(thumbnail=name).exclude(pk=exclude_pk).exists()
+            or SourceFingerprint.objects.filter(thumbnail=name).exists())
+
 def _safe_delete(filefield):
     try:
         if filefield and filefield.name and filefield.storage.exists(filefield.name):
@@ -253,21 +439,107 @@ def _safe_delete(filefield):
         # swallow storage errors; optionally log
         pass
 
+@receiver(post_save, sender=Video)
 @receiver(post_delete, sender=Video)
-def video_files_on_delete(sender, instance, **kwargs):
-    # Delete thumbnail file when the whole object is deleted
-    _safe_delete(getattr(instance, "thumbnail", None))
+def bump_video_cache_version(sender, instance, **kwargs):
+    # Playlists (and anything else cached per video) are keyed by this version
+    caching.bump_video_version(instance.pk)
+
+@receiver(post_save, sender=MediaProbe)
+@receiver(post_delete, sender=MediaProbe)
+def bump_probe_video_version(sender, instance, **kwargs):
+    # The detail page shows the probe's quality label
+    caching.bump_video_version(instance.video_id)
+
+@receiver(m2m_changed, sender=Video.genres.through)
+@receiver(m2m_changed, sender=Video.cast.through)
+def bump_versions_on_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'pre_clear'):
+        return
+    if not reverse:
+        caching.bump_video_version(instance.pk)
+        return
+    # genre.video_set.add(...) and the like: pk_set holds videos
+    if action == 'pre_clear':
+        column = next(f.name for f in sender._meta.fields if f.related_model is type(instance))
+        pk_set = sender.objects.filter(**{column: instance}).values_list('video_id', flat=True)
+    for pk in pk_set or ():
+        caching.bump_video_version(pk)
+
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=CastMember)
+@receiver(pre_delete, sender=Genre)
+@receiver(pre_delete, sender=CastMember)
+def bump_versions_on_related_change(sender, instance, created=False, **kwargs):
+    # Renamed or deleted: every video listing it shows it
+    if created:
+        return
+    field = 'genres' if sender is Genre else 'cast'
+    for pk in Video.objects.filter(**{field: instance}).values_list('pk', flat=True):
+        caching.bump_video_version(pk)
 
-@receiver(pre_save, sender=Video)
-def video_thumbnail_on_change(sender, instance, **kwargs):
-    # On update, if the thumbnail changes OR is cleared, delete the old file
-    if not instance.pk:
+# --- Search index (content/search.py) ---
+
+@receiver(post_save, sender=Video)
+def index_video(sender, instance, created, **kwargs):
+    # Only when the title or description changed (see video_presave)
+    if getattr(instance, "_search_changed", False):
+        from content import search
+        search.index_video(instance, created)
+
+@receiver(post_delete, sender=Video)
+def unindex_video(sender, instance, **kwargs):
+    from content import search
+    search.remove([instance.pk])
+
+@receiver(m2m_changed, sender=Video.genres.through)
+@receiver(m2m_changed, sender=Video.cast.through)
+def reindex_on_m2m(sender, instance, action, reverse, pk_set, **kwargs):
+    from content import search
+    if not reverse:
+        if action in ('post_add', 'post_remove', 'post_clear'):
+            search.index_videos([instance.pk])
         return
-    try:
-        old = sender.objects.get(pk=instance.pk)
-    except sender.DoesNotExist:
+    # genre.video_set.clear() and the like: remember the videos before the rows go
+    field = 'genres' if sender is Video.genres.through else 'cast'
+    if action == 'pre_clear':
+        instance._search_video_ids = list(Video.objects.filter(**{field: instance}).values_list('pk', flat=True))
+    elif action == 'post_clear':
+        search.index_videos(instance.__dict__.pop('_search_video_ids', ()))
+    elif action in ('post_add', 'post_remove'):
+        search.index_videos(pk_set or ())
+
+@receiver(pre_delete, sender=Genre)
+@receiver(pre_delete, sender=CastMember)
+def collect_videos_before_related_delete(sender, instance, **kwargs):
+    field = 'genres' if sender is Genre else 'cast'
+    instance._search_video_ids = list(Video.objects.filter(**{field: instance}).values_list('pk', flat=True))
+
+@receiver(post_save, sender=Genre)
+@receiver(post_save, sender=CastMember)
+@receiver(post_delete, sender=Genre)
+@receiver(post_delete, sender=CastMember)
+def reindex_on_related_change(sender, instance, created=False, **kwargs):
+    # Renamed, or deleted (the videos were collected before the through rows went)
+    if created:
         return
-    old_file = getattr(old, "thumbnail", None)
-    new_file = getattr(instance, "thumbnail", None)
-    if old_file and old_file != new_file:
-        _safe_delete(old_file)
+    from content import search
+    if '_search_video_ids' in instance.__dict__:
+        video_ids = instance.__dict__.pop('_search_video_ids')
+    else:
+        field = 'genres' if sender is Genre else 'cast'
+        video_ids = Video.objects.filter(**{field: instance}).values_list('pk', flat=True)
+    search.index_videos(video_ids)
+
+@receiver(post_delete, sender=Video)
+def release_source_on_delete(sender, instance, **kwargs):
+    # Queryset deletes skip Video.delete(); a second release is a no-op
+    from content.dedup import release
+    release(instance)
+
+@receiver(post_delete, sender=Video)
+def video_files_on_delete(sender, instance, **kwargs):
+    # Delete thumbnail file when the whole object is deleted
+    thumbnail = getattr(instance, "thumbnail", None)
+    if not (thumbnail and _thumbnail_in_use(thumbnail.name, instance.pk)):
+        _safe_delete(thumbnail)
@@ -0,0 +1,115 @@
+# content/probe.py
+import json
+import os
+import subprocess
+from .models import MediaProbe
+
+
+def run_ffprobe(path) -> dict:
+    """Container and stream metadata (one short ffprobe run)."""
+    r = subprocess.run(
+        ["ffprobe", "-v", "error", "-print_format", "json",
+         "-show_format", "-show_streams",
+         path],
+        check=True, capture_output=True, text=True,
+    )
+    return json.loads(r.stdout)
+
+
+def parse_keyframes(lines):
+    """Sorted keyframe times from "pts_time,flags" CSV lines."""
+    times = []
+    for line in lines:
+        pts, _, flags = line.strip().partition(",")
+        if "K" not in flags:
+            continue
+        try:
+            times.append(float(pts))
+        except ValueError:
+            continue
+    return sorted(times)
+
+
+def keyframe_times(path):
+    """Keyframe timestamps (seconds) of the first video stream.
+
+    Only that stream's packets are listed, without decoding, as compact CSV
+    that is parsed line by line instead of being held in memory whole.
+    """
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0",
+           "-show_entries", "packet=pts_time,flags", "-of", "csv=print_section=0",
+           path]
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True) as proc:
+        times = parse_keyframes(proc.stdout)
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
+    return times
+
+
+def _frame_rate(stream):
+    for key in ("avg_frame_rate", "r_frame_rate"):
+        num, _, den = (stream.get(key) or "").partition("/")
+        try:
+            if float(den or 1):
+                rate = float(num) / float(den or 1)
+                if rate:
+                    return round(rate, 3)
+        except ValueError:
+            continue
+    return None
+
+
+def _int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def apply_ffprobe(probe, meta, keyframes=()):
+    """Copy the interesting parts of an ffprobe result onto a MediaProbe."""
+    fmt = meta.get("format", {})
+    streams = meta.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), {})
+
+    duration = _float(fmt.get("duration")) or _float(video.get("duration"))
+
+    probe.format_name = fmt.get("format_name", "")
+    probe.duration = duration
+    probe.bit_rate = _int(fmt.get("bit_rate"))
+    probe.video_codec = (video.get("codec_name") or "").lower()
+    probe.width = _int(video.get("width"))
+    probe.height = _int(video.get("height"))
+    probe.frame_rate = _frame_rate(video)
+    probe.audio_codec = (audio.get("codec_name") or "").lower()
+    probe.audio_channels = _int(audio.get("channels"))
+    probe.audio_layout = audio.get("channel_layout", "")
+    probe.streams = streams
+    probe.keyframes = list(keyframes)
+    return probe
+
+
+def probe_video(video, path):
+    """Return the MediaProbe for `video`, running ffprobe only if the source changed."""
+    st = os.stat(path)
+    probe = MediaProbe.objects.filter(video=video).first()
+    if probe and probe.matches(path, st.st_size, st.st_mtime):
+        return probe
+
+    probe = probe or MediaProbe(video=video)
+    meta = run_ffprobe(path)
+    has_video = any(s.get("codec_type") == "video" for s in meta.get("streams", []))
+    apply_ffprobe(probe, meta, keyframe_times(path) if has_video else ())
+    probe.source_path = path
+    probe.source_size = st.st_size
+    probe.source_mtime = st.st_mtime
+    probe.save()
+    return probe
@@ -0,0 +1,112 @@
+# content/progress.py
+# Live encode telemetry: ffmpeg's -progress output, published to the cache so
+# the admin and the status endpoint can show how far along (and how fast) a job is.
+import time
+from django.core.cache import cache
+
+# Entries outlive a dead worker long enough to be noticed, then expire
+PROGRESS_TIMEOUT = 6 * 3600
+
+
+def progress_args():
+    # key=value blocks on stdout; -nostats keeps the stderr log free of the stats line
+    return ['-progress', 'pipe:1', '-nostats']
+
+
+def parse_progress(stream):
+    """Yield one dict per block of ffmpeg -progress output.
+
+    Each block ends with a `progress=continue` (or `progress=end`) line.
+    """
+    block = {}
+    for line in stream:
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            continue
+        block[key] = value.strip()
+        if key == "progress":
+            yield block
+            block = {}
+
+
+def _seconds(block):
+    # out_time_us is microseconds (out_time_ms is too, despite its name)
+    for key in ("out_time_us", "out_time_ms"):
+        try:
+            return max(0.0, int(block[key]) / 1e6)
+        except (KeyError, ValueError):
+            continue
+    return 0.0
+
+
+def _number(value, suffix=""):
+    try:
+        return float(str(value).strip().rstrip(suffix))
+    except (TypeError, ValueError):
+        return None
+
+
+def _key(video_id, part=None):
+    return f"encode-progress:{video_id}" if part is None else f"encode-progress:{video_id}:{part}"
+
+
+def start(video_id, duration, parts=1, offset=0.0):
+    """Reset the telemetry of `video_id` for a job split into `parts` ffmpeg runs.
+
+    `offset` is media time already encoded by an earlier, interrupted run.
+    """
+    cache.delete_many([_key(video_id, part) for part in range(parts)])
+    cache.set(_key(video_id), {
+        "duration": float(duration or 0),
+        "parts": parts,
+        "offset": offset,
+        "started_at": time.time(),
+    }, PROGRESS_TIMEOUT)
+
+
+def publish(video_id, block, part=0):
+    cache.set(_key(video_id, part), {
+        "out_time": _seconds(block),
+        "fps": _number(block.get("fps")),
+        "speed": _number(block.get("speed"), "x"),
+        "bitrate_kbps": _number(block.get("bitrate"), "kbits/s"),
+        "frame": int(_number(block.get("frame")) or 0),
+        "ended": block.get("progress") == "end",
+        "updated_at": time.time(),
+    }, PROGRESS_TIMEOUT)
+
+
+def finish(video_id):
+    cache.delete(_key(video_id))
+
+
+def snapshot(video_id):
+    """Combined progress of every part of a running encode, or None.
+
+    Chunked encodes run several ffmpeg processes at once; their encoded time,
+    fps and speed add up, so the ETA reflects the whole fleet working on it.
+    """
+    meta = cache.get(_key(video_id))
+    if not meta:
+        return None
+    parts = [p for p in cache.get_many([_key(video_id, i) for i in range(meta["parts"])]).values() if p]
+    duration = meta["duration"]
+    done = meta["offset"] + sum(p["out_time"] for p in parts)
+    if duration:
+        done = min(done, duration)
+    running = [p for p in parts if not p["ended"]]
+    speed = sum(p["speed"] or 0 for p in running)
+    eta = (duration - done) / speed if duration and speed else None
+    return {
+        "out_time": round(done, 3),
+        "duration": duration,
+        "percent": round(100.0 * done / duration, 1) if duration else None,
+        "fps": round(sum(p["fps"] or 0 for p in running), 2),
+        "speed": round(speed, 3),
+        "bitrate_kbps": round(sum(p["bitrate_kbps"] or 0 for p in running), 1),
+        "eta_seconds": round(eta) if eta is not None else None,
+        "parts": meta["parts"],
+        "parts_running": len(running),
+        "elapsed_seconds": round(time.time() - meta["started_at"]),
+        "updated_at": max((p["updated_at"] for p in parts), default=meta["started_at"]),
+    }
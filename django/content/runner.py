@@ -0,0 +1,72 @@
+# content/runner.py
+import shutil
+import subprocess
+import threading
+from django.conf import settings
+from .progress import parse_progress, progress_args
+
+
+def priority_prefix():
+    """nice/ionice wrapper for encode processes, from HLS_NICE / HLS_IONICE_CLASS."""
+    prefix = []
+    nice = getattr(settings, 'HLS_NICE', None)
+    if nice is not None and shutil.which('nice'):
+        prefix += ['nice', '-n', str(nice)]
+    io_class = getattr(settings, 'HLS_IONICE_CLASS', None)
+    if io_class is not None and shutil.which('ionice'):
+        prefix += ['ionice', '-c', str(io_class)]
+        # Levels only exist for the best-effort (2) and realtime (1) classes
+        if str(io_class) in ('1', '2'):
+            prefix += ['-n', str(getattr(settings, 'HLS_IONICE_LEVEL', 7))]
+    return prefix
+
+
+def run_ffmpeg(cmd, on_tick=None, interval=5, on_progress=None, on_start=None):
+    """Run ffmpeg like subprocess.run(check=True), calling `on_tick` while it works.
+
+    `on_tick` runs every `interval` seconds and once more after ffmpeg exits,
+    from the calling thread (so it may use the ORM). With `on_progress`, ffmpeg
+    reports on stdout via -progress and the latest block is passed to
+    `on_progress` on the same schedule. `on_start(proc)` gets the Popen as
+    soon as ffmpeg is started, so another thread can kill it.
+    """
+    latest = []
+    reader = None
+    if on_progress:
+        cmd = priority_prefix() + cmd[:1] + progress_args() + cmd[1:]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+
+        def read():
+            for block in parse_progress(proc.stdout):
+                latest[:] = [block]
+        reader = threading.Thread(target=read, daemon=True)
+        reader.start()
+    else:
+        cmd = priority_prefix() + cmd
+        proc = subprocess.Popen(cmd)
+    if on_start:
+        on_start(proc)
+
+    def tick():
+        if on_progress and latest:
+            on_progress(latest[0])
+        if on_tick:
+            on_tick()
+
+    try:
+        while True:
+            try:
+                proc.wait(timeout=interval)
+                break
+            except subprocess.TimeoutExpired:
+                tick()
+    except BaseException:
+        # Worker shutdown or a failing callback: don't leave ffmpeg behind
+        proc.kill()
+        proc.wait()
+        raise
+    if reader:
+        reader.join(timeout=interval)
+    tick()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, cmd)
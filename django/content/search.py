@@ -0,0 +1,129 @@
+# content/search.py
+# Full-text search over titles, descriptions, cast and genres. The index is
+# the content_search table (migration 0014): a tsvector column with a GIN
+# index on PostgreSQL, an FTS5 virtual table on SQLite. The Video, Genre and
+# CastMember signals keep it current one video at a time; other backends
+# fall back to unindexed icontains lookups.
+import re
+from django.db import connection
+from django.db.models import Q
+from . import catalog
+from .models import Video
+
+TABLE = 'content_search'
+# Words of a query used at most; each is matched as a prefix (type-ahead)
+MAX_TERMS = 8
+MAX_LIMIT = 50
+
+# PostgreSQL: one tsvector per video, fields weighted A (title) to C (description)
+POSTGRES_DOCUMENT = (
+    "setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B')"
+    " || setweight(to_tsvector('simple', %s), 'B') || setweight(to_tsvector('simple', %s), 'C')"
+)
+# SQLite: rowid is the video id; bm25 weights follow the column order
+SQLITE_WEIGHTS = (10.0, 4.0, 4.0, 1.0)
+
+
+def indexed():
+    return connection.vendor in ('postgresql', 'sqlite')
+
+
+def write(rows):
+    """Replace the index entries of (video_id, name, people, genres, description) rows."""
+    rows = list(rows)
+    if not rows or not indexed():
+        return
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.executemany(
+                f"INSERT INTO {TABLE} (video_id, document) VALUES (%s, {POSTGRES_DOCUMENT})"
+                " ON CONFLICT (video_id) DO UPDATE SET document = EXCLUDED.document",
+                rows,
+            )
+        else:
+            # FTS5 drops the replaced row's terms too
+            cursor.executemany(
+                f"INSERT OR REPLACE INTO {TABLE} (rowid, name, people, genres, description)"
+                " VALUES (%s, %s, %s, %s, %s)",
+                rows,
+            )
+
+
+def rows(videos):
+    # videos come with genres and cast prefetched
+    return [
+        (
+            video.pk, video.name or '',
+            ' '.join(member.name for member in video.cast.all()),
+            ' '.join(genre.name for genre in video.genres.all()),
+            video.description or '',
+        )
+        for video in videos
+    ]
+
+
+def index_video(video, created=False):
+    if not indexed():
+        return
+    # A video just created has no cast or genres yet
+    people = '' if created else ' '.join(video.cast.values_list('name', flat=True))
+    genres = '' if created else ' '.join(video.genres.values_list('name', flat=True))
+    write([(video.pk, video.name or '', people, genres, video.description or '')])
+
+
+def index_videos(video_ids):
+    video_ids = list(video_ids)
+    if not video_ids or not indexed():
+        return
+    videos = (Video.objects.filter(pk__in=video_ids).only('id', 'name', 'description')
+              .prefetch_related(catalog.RELATIONS['genres'], catalog.RELATIONS['cast']))
+    write(rows(videos))
+
+
+def remove(video_ids):
+    video_ids = list(video_ids)
+    if not video_ids or not indexed():
+        return
+    column = 'video_id' if connection.vendor == 'postgresql' else 'rowid'
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {TABLE} WHERE {column} = %s", [(pk,) for pk in video_ids])
+
+
+def terms(query):
+    # Word characters only, so the terms are safe inside tsquery / FTS5 syntax
+    return re.findall(r'\w+', (query or '').lower())[:MAX_TERMS]
+
+
+def search(query, limit=20):
+    """Playable videos matching every word of `query` as a prefix, best match first."""
+    words = terms(query)
+    if not words:
+        return []
+    limit = min(max(limit, 1), MAX_LIMIT)
+    if not indexed():
+        match = Q()
+        for word in words:
+            match &= (Q(name__icontains=word) | Q(description__icontains=word)
+                      | Q(cast__name__icontains=word) | Q(genres__name__icontains=word))
+        return list(catalog.cards().filter(match).distinct()[:limit])
+
+    playable, params = catalog.playable().values('pk').query.sql_with_params()
+    if connection.vendor == 'postgresql':
+        sql = (
+            f"SELECT video_id FROM {TABLE}, to_tsquery('simple', %s) AS q"
+            f" WHERE document @@ q AND video_id IN ({playable})"
+            " ORDER BY ts_rank(document, q) DESC, video_id DESC LIMIT %s"
+        )
+        params = [' & '.join(f"{word}:*" for word in words), *params, limit]
+    else:
+        weights = ', '.join(map(str, SQLITE_WEIGHTS))
+        sql = (
+            f"SELECT rowid FROM {TABLE} WHERE {TABLE} MATCH %s AND rowid IN ({playable})"
+            f" ORDER BY bm25({TABLE}, {weights}), rowid DESC LIMIT %s"
+        )
+        params = [' '.join(f'"{word}"*' for word in words), *params, limit]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        ids = [row[0] for row in cursor.fetchall()]
+    videos = catalog.cards().in_bulk(ids)
+    return [videos[pk] for pk in ids if pk in videos]
@@ -0,0 +1,52 @@
+# content/signing.py
+# Stateless access tokens for segment URLs: the playlist view signs the video
+# id and an expiry with SECRET_KEY, and serve_hls_segment checks the HMAC
+# without a database lookup. By default tokens only bound how long a copied
+# segment URL works: the playlist is public and every viewer gets the same
+# URLs, which edge caches can share. With HLS_SIGNED_URLS_BIND_SESSION the
+# viewer's session key is signed too and compared with the session cookie of
+# the segment request, so a URL only works in the browser it was issued to.
+import time
+from urllib.parse import urlencode
+from django.conf import settings
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+SALT = 'content.signing.segment-url'
+# Expiries are rounded up to this step, so segment URLs stay the same (and
+# cacheable) across playlist fetches for a while
+EXPIRY_STEP = 300
+
+
+def enabled():
+    return getattr(settings, 'HLS_SIGNED_URLS', False)
+
+
+def bind_session():
+    return enabled() and getattr(settings, 'HLS_SIGNED_URLS_BIND_SESSION', False)
+
+
+def _signature(video_id, expires, session=''):
+    return salted_hmac(SALT, f"{video_id}:{expires}:{session}", algorithm='sha256').hexdigest()[:32]
+
+
+def token(video_id, now=None, session=''):
+    """Query string ("exp=...&sig=...") granting access to a video's segments.
+
+    `session` (a session key) is signed but not included; the segment request
+    must present it again.
+    """
+    ttl = int(getattr(settings, 'HLS_URL_TTL', 6 * 3600))
+    now = int(time.time() if now is None else now)
+    expires = -(-(now + ttl) // EXPIRY_STEP) * EXPIRY_STEP
+    return urlencode({'exp': expires, 'sig': _signature(video_id, expires, session)})
+
+
+def verify(video_id, params, now=None, session=''):
+    """True if `params` (a request's GET) carry an unexpired token for `video_id` (and `session`)."""
+    try:
+        expires = int(params.get('exp', ''))
+    except ValueError:
+        return False
+    if expires < (time.time() if now is None else now):
+        return False
+    return constant_time_compare(params.get('sig', ''), _signature(video_id, expires, session))
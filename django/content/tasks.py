@@ -1,40 +1,65 @@
-from celery import shared_task
-from .models import Video
+from celery import shared_task, chord
+from .models import MediaProbe, Upload, Video
 import os
 import subprocess
-import json
+import time
+from datetime import timedelta
 from pathlib import Path
 from django.conf import settings
 from django.core.management.base import CommandError
+from django.db.models import Q
+from django.utils import timezone
 from django.utils.text import slugify
 from .utils import resolve_input_path  # make sure this exists
+from . import caching, encoding, chunked, checkpoints, dedup, ingest, progress, uploads
+from .probe import probe_video
+from .runner import run_ffmpeg
 
 MEDIA_ROOT = settings.MEDIA_ROOT
 
-def get_video_codec(path: str) -> str:
-    try:
-        r = subprocess.run(
-            ["ffprobe", "-v", "error",
-             "-select_streams", "v:0",
-             "-show_entries", "stream=codec_name",
-             "-of", "default=nw=1:nk=1",
-             path],
-            capture_output=True, text=True, check=True,
-        )
-        return r.stdout.strip()
-    except subprocess.CalledProcessError as e:
-        print(f"[ffprobe] failed: {e.stderr or e}")
-        return ""
 
-@shared_task
+def _stale_before():
+    return timezone.now() - timedelta(seconds=int(getattr(settings, 'HLS_STALE_SECONDS', 600)))
+
+
+def _heartbeat_ticker(video_id, record=None):
+    """on_tick callback: record checkpoints every tick, heartbeat at most every HLS_HEARTBEAT_SECONDS."""
+    every = int(getattr(settings, 'HLS_HEARTBEAT_SECONDS', 30))
+    last = [time.monotonic()]
+
+    def tick():
+        if record:
+            record()
+        if time.monotonic() - last[0] >= every:
+            checkpoints.heartbeat(video_id)
+            last[0] = time.monotonic()
+    return tick
+
+
+# acks_late: a job whose worker dies mid-encode goes back to the queue
+@shared_task(acks_late=True, reject_on_worker_lost=True)
 def process_video(video_id):
     obj = None
     try:
-        obj = Video.objects.filter(pk=video_id, status='Pending').first()
+        # Claim the row atomically. A Processing row whose heartbeat stopped
+        # belongs to a worker that died, so it may be taken over and resumed.
+        stale = _stale_before()
+        claimed = Video.objects.filter(pk=video_id).filter(
+            Q(status='Pending')
+            | Q(status='Processing', heartbeat_at__lt=stale)
+            | Q(status='Processing', heartbeat_at__isnull=True)
+        ).update(status='Processing', is_running=True, errors=None, heartbeat_at=timezone.now())
+        if claimed:
+            # .update() sends no signals; cached pages still show the old status
+            caching.bump_video_version(video_id)
+        obj = Video.objects.filter(pk=video_id).first() if claimed else None
         if not obj:
             # Nothing to do; surface a clear message on the record if it exists.
             maybe = Video.objects.filter(pk=video_id).first()
-            if maybe:
+            if maybe and maybe.status in ('Queued', 'Processing'):
+                # Redelivered while another worker is still encoding it
+                print(f'Video id={video_id} is already being processed.')
+            elif maybe:
                 msg = f'Video id={video_id} is not Pending (status={maybe.status}).'
                 print(msg)
                 maybe.errors = msg
@@ -44,46 +69,40 @@ def process_video(video_id):
                 print(f'No video with id={video_id} found.')
             return
 
-        obj.errors = None
-        obj.status = 'Processing'
-        obj.is_running = True
-        obj.save(update_fields=["errors", "status", "is_running"])
-
         # --- INPUT PATH (upload or server path) ---
         input_video_path = resolve_input_path(obj)  # absolute path        
         src_stem = Path(input_video_path).stem
         safe_base = slugify(src_stem) or f"video_{obj.id}"
 
-        # --- DURATION PROBE ---
-        try:
-            probe = subprocess.run(
-                ["ffprobe", "-v", "quiet", "-print_format", "json",
-                 "-show_format", "-show_streams", input_video_path],
-                check=True, stdout=subprocess.PIPE
-            )
-            meta = json.loads(probe.stdout)
-            duration = None
-            if "format" in meta and "duration" in meta["format"]:
-                duration = float(meta["format"]["duration"])
-            else:
-                for s in meta.get("streams", []):
-                    if s.get("codec_type") == "video" and "duration" in s:
-                        duration = float(s["duration"]); break
-            if duration:
-                obj.duration = duration
-                obj.save(update_fields=["duration"])
-        except Exception as e:
-            print(f"[ffprobe] duration probe failed: {e}")
+        # --- DEDUP (the same media may already be encoded, or encoding) ---
+        entry = None
+        if dedup.enabled():
+            entry, role = dedup.claim(obj, input_video_path)
+            if role == 'reuse':
+                dedup.adopt(obj, entry, input_video_path)
+                print(f'Video id={obj.id} reuses the HLS outputs at {entry.hls}')
+                return
+            if role == 'wait':
+                print(f'Video id={obj.id} waits for video id={entry.encoder_id}, '
+                      'which is encoding the same source.')
+                return
+
+        # --- PROBE (cached per source file; re-run only if size/mtime changed) ---
+        probe = probe_video(obj, input_video_path)
+        if probe.duration:
+            obj.duration = probe.duration
+            obj.save(update_fields=["duration"])
 
         # --- CODEC DECISION ---
-        codec = (get_video_codec(input_video_path) or "").strip().lower()
+        codec = probe.video_codec
+        mode = getattr(settings, 'HLS_ENCODE_MODE', 'auto')
         # print(f"Video title: {obj.name}")
         # print(f"Video codec: {codec or 'unknown'}")
 
-        if codec != "h264":
+        if codec != "h264" and mode == 'copy':
             msg = (
                 f"Unsupported codec for fast HLS path: '{codec or 'unknown'}'. "
-                "Re-encode to H.264 (or add a fallback that re-encodes)."
+                "Re-encode to H.264 or set HLS_ENCODE_MODE to 'auto' or 'ladder'."
             )
             print(msg)
             obj.status = 'Failed'
@@ -91,66 +110,347 @@ def process_video(video_id):
             obj.errors = msg
             obj.save(update_fields=["status", "is_running", "errors"])
             return
+        transcode = mode == 'ladder' or codec != "h264"
 
-        # --- OUTPUT PATHS (always under MEDIA_ROOT/hls_output/<id>/) ---
-        output_dir_rel = os.path.join("videos/hls_output", str(obj.id))
+        # --- OUTPUT PATHS (under MEDIA_ROOT/hls_output/<id>/, or the shared directory of the source) ---
+        output_dir_rel = entry.output_dir if entry else os.path.join("videos/hls_output", str(obj.id))
         # print('output_dir_rel', output_dir_rel)
         output_dir_abs = os.path.join(MEDIA_ROOT, output_dir_rel)
         # print('output_dir_abs', output_dir_abs)
         os.makedirs(output_dir_abs, exist_ok=True)
 
-        m3u8_name = f"{safe_base}_hls.m3u8"
-        seg_pattern = f"{safe_base}_hls%03d.ts"
+        if transcode:
+            # Master playlist pointing at one variant playlist per rendition
+            m3u8_name = f"{safe_base}_master.m3u8"
+        else:
+            m3u8_name = f"{safe_base}_hls.m3u8"
 
         output_hls_rel_path = os.path.join(output_dir_rel, m3u8_name)
         output_hls_path = os.path.join(MEDIA_ROOT, output_hls_rel_path)
 
         # Thumbnail next to the playlist
-        thumb_name = f"{safe_base}_thumb.jpg"
+        thumb_name = encoding.poster_name(safe_base)
         output_thumbnail_rel_path = os.path.join(output_dir_rel, thumb_name)
-        output_thumbnail_path = os.path.join(MEDIA_ROOT, output_thumbnail_rel_path)
-
-        # --- FFMPEG: copy H.264 video to Annex B, transcode audio to AAC stereo ---
-        cmd = [
-            'ffmpeg', '-i', input_video_path,
-            '-map', '0:v:0', '-map', '0:a:0?', '-sn',
-            '-c:v', 'copy', '-bsf:v', 'h264_mp4toannexb',
-            '-c:a', 'aac', '-b:a', '128k', '-ac', '2', '-ar', '48000',
-            '-hls_time', '6',
-            '-hls_flags', 'independent_segments',
-            '-hls_list_size', '0',
-            '-hls_playlist_type', 'vod',
-            '-hls_segment_filename', os.path.join(output_dir_abs, seg_pattern),
-            '-hls_base_url', '{{ dynamic_path }}/',
-            '-f', 'hls', output_hls_path,
-        ]
-        subprocess.run(cmd, check=True)
-
-        # --- THUMBNAIL (only if missing) ---
-        if not obj.thumbnail:
+
+        # --- FFMPEG ---
+        renditions = None
+        if transcode:
+            renditions = encoding.select_renditions(probe.width, probe.height)
+            encoding.write_master_playlist(output_hls_path, safe_base, renditions, probe.has_audio)
+
+        # Long sources can be cut at keyframes and encoded chunk by chunk in parallel
+        chunks = []
+        parallel = chunked.parallel_mode()
+        if parallel != 'off' and (probe.duration or 0) > 2 * chunked.chunk_seconds() and probe.keyframes:
+            chunks = chunked.plan_chunks(probe.keyframes, probe.duration)
+
+        job = {
+            "input": input_video_path,
+            "output_dir_rel": output_dir_rel,
+            "hls": output_hls_rel_path,
+            "thumbnail": output_thumbnail_rel_path,
+            "playlists": encoding.output_playlists(safe_base, renditions),
+            "chunks": len(chunks),
+            "chunk_plan": chunks,
+            "safe_base": safe_base,
+            "renditions": renditions,
+            "has_audio": probe.has_audio,
+            "duration": probe.duration,
+        }
+
+        # The encode itself waits on the transcode queue; the row is Queued
+        # (not Processing) until a transcode worker picks it up, so the stale
+        # reaper only requeues it after HLS_QUEUED_STALE_SECONDS.
+        Video.objects.filter(pk=obj.id).update(status='Queued', heartbeat_at=timezone.now())
+        caching.bump_video_version(obj.id)
+
+        if len(chunks) > 1 and parallel == 'celery':
+            todo = _pending_chunks(obj.id, job, probe)
+            if todo:
+                # Fan the chunks out to the transcode workers; the last one to finish stitches
+                chord(
+                    encode_chunk.si(obj.id, cmd, job, index) for index, cmd in todo.items()
+                )(finalize_encode.si(obj.id, job))
+                print(f'Queued {len(todo)} chunk encodes for video id={obj.id}')
+            else:
+                finalize_encode.delay(obj.id, job)
+            return
+
+        encode_video.delay(obj.id, job)
+
+    except Exception as e:
+        _fail(obj, e)
+        raise CommandError(e)
+
+
+def _pending_chunks(video_id, job, probe):
+    """Chunk commands still to run; chunks finished by an interrupted run are kept."""
+    output_dir_abs = os.path.join(MEDIA_ROOT, job["output_dir_rel"])
+    chunks = job["chunk_plan"]
+    cmds = chunked.chunk_commands(
+        job["input"], output_dir_abs, job["safe_base"], chunks, job["renditions"], job["has_audio"])
+    key = job["plan_key"] = checkpoints.plan_key(list(cmds.values()), probe)
+    checkpoints.discard_other_plans(video_id, key)
+    todo = {
+        index: cmd for index, cmd in cmds.items()
+        if not (checkpoints.enabled()
+                and checkpoints.chunk_done(video_id, key, output_dir_abs, index, job["playlists"]))
+    }
+    if len(todo) < len(cmds):
+        print(f'Resuming video id={video_id}: {len(cmds) - len(todo)} of {len(cmds)} chunks already encoded')
+    else:
+        encoding.remove_sprites(output_dir_abs, job["safe_base"])
+    encoded = sum(
+        (c["length"] or (probe.duration or 0) - c["start"]) for c in chunks if c["index"] not in todo)
+    progress.start(video_id, probe.duration, parts=len(chunks), offset=encoded)
+    return todo
+
+
+def _claim_encode(video_id):
+    """Move a Queued video (or one whose encode worker died) to Processing."""
+    claimed = Video.objects.filter(pk=video_id).filter(
+        Q(status='Queued')
+        | Q(status='Processing', heartbeat_at__lt=_stale_before())
+        | Q(status='Processing', heartbeat_at__isnull=True)
+    ).update(status='Processing', heartbeat_at=timezone.now())
+    if claimed:
+        caching.bump_video_version(video_id)
+    return claimed
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def encode_video(video_id, job):
+    """The heavy part of the pipeline: one ffmpeg run, or every chunk in this worker."""
+    obj = None
+    try:
+        if not _claim_encode(video_id):
+            print(f'Video id={video_id} is not queued for encoding; skipping.')
+            return
+        obj = Video.objects.get(pk=video_id)
+        probe = MediaProbe.objects.get(video_id=video_id)
+        output_dir_abs = os.path.join(MEDIA_ROOT, job["output_dir_rel"])
+
+        if job["chunks"] > 1:
+            todo = _pending_chunks(obj.id, job, probe)
+            key = job["plan_key"]
+            chunked.run_local(
+                todo,
+                on_done=lambda index: checkpoints.record_chunk(
+                    obj.id, key, output_dir_abs, index, job["playlists"]),
+                on_tick=_heartbeat_ticker(obj.id),
+                on_progress=lambda index, block: progress.publish(obj.id, block, part=index),
+            )
+        else:
+            def build(start=None, append=False):
+                if job["renditions"]:
+                    return encoding.ladder_command(
+                        job["input"], output_dir_abs, job["safe_base"], job["renditions"], job["has_audio"],
+                        start=start, append=append, preview_dir=output_dir_abs)
+                return encoding.copy_command(
+                    job["input"], output_dir_abs, job["safe_base"], start=start, append=append,
+                    preview_dir=output_dir_abs)
+
+            cmd = build()
+            key = checkpoints.plan_key(cmd, probe)
+            done, start = checkpoints.prepare_resume(obj.id, key, output_dir_abs, job["playlists"])
+            if done:
+                if not job["renditions"] and probe.keyframes:
+                    # Copied segments end on source keyframes; seek to that exact one
+                    start = min(probe.keyframes, key=lambda t: abs(t - start))
+                print(f'Resuming video id={obj.id} after {done} segments ({start:.3f}s)')
+                cmd = build(start=start, append=True)
+            else:
+                encoding.remove_sprites(output_dir_abs, job["safe_base"])
+            progress.start(obj.id, probe.duration, offset=start)
+            early = [encoding.early_playback_segments()]
+
+            def record():
+                if checkpoints.enabled():
+                    for name, _ in job["playlists"]:
+                        checkpoints.record(obj.id, key, output_dir_abs, name)
+                if early[0] and _publish_early(obj.id, job, early[0]):
+                    early[0] = 0
+
+            run_ffmpeg(cmd, on_tick=_heartbeat_ticker(obj.id, record),
+                       on_progress=lambda block: progress.publish(obj.id, block))
+
+        # Playlist finalize and the thumbnail are quick; hand them back to the light queue
+        finalize_encode.delay(obj.id, job)
+
+    except Exception as e:
+        _fail(obj, e)
+        raise CommandError(e)
+
+
+def _publish_early(video_id, job, needed):
+    """Make a video playable from its growing EVENT playlists once every rendition has `needed` segments.
+
+    Chunked encodes only have playlists after the stitch, so they are
+    published when they complete.
+    """
+    output_dir_abs = os.path.join(MEDIA_ROOT, job["output_dir_rel"])
+    for name, _ in job["playlists"]:
+        path = os.path.join(output_dir_abs, name)
+        if not os.path.isfile(path) or len(encoding.read_media_playlist(path)[1]) < needed:
+            return False
+    if os.path.isfile(os.path.join(MEDIA_ROOT, job["thumbnail"])):
+        Video.objects.filter(pk=video_id).filter(Q(thumbnail='') | Q(thumbnail__isnull=True)).update(
+            thumbnail=job["thumbnail"])
+    Video.objects.filter(pk=video_id).update(hls=job["hls"])
+    caching.bump_video_version(video_id)
+    print(f'Video id={video_id} is playable while encoding ({needed} segments ready)')
+    return True
+
+
+def _finalize(obj, job):
+    # --- THUMBNAIL (only if missing) ---
+    if not obj.thumbnail:
+        poster = os.path.join(MEDIA_ROOT, job["thumbnail"])
+        # The encode writes the poster frame itself; only a source shorter than
+        # POSTER_SECONDS comes out without one, and then its first frame will do
+        if not os.path.isfile(poster):
             thumb_cmd = [
-                'ffmpeg', '-i', input_video_path,
-                '-ss', '2', '-vframes', '1', '-q:v', '2', '-y',
-                output_thumbnail_path
+                'ffmpeg', '-i', job["input"],
+                '-vframes', '1', '-q:v', '2', '-y',
+                poster
             ]
             subprocess.run(thumb_cmd, check=True)
-            obj.thumbnail = output_thumbnail_rel_path
+        obj.thumbnail = job["thumbnail"]
+
+    # --- FINALIZE ---
+    stats = progress.snapshot(obj.id)
+    if stats and stats["elapsed_seconds"]:
+        print(f'Encoded {stats["duration"]:.0f}s of video id={obj.id} in {stats["elapsed_seconds"]}s '
+              f'({stats["duration"] / stats["elapsed_seconds"]:.2f}x realtime)')
+    progress.finish(obj.id)
+    checkpoints.clear(obj.id)
+    obj.hls = job["hls"]
+    obj.status = 'Completed'
+    obj.is_running = False
+    obj.save(update_fields=["hls", "thumbnail", "status", "is_running"])
+    print(f'HLS segments generated at: {job["hls"]}')
+    poster = job["thumbnail"] if os.path.isfile(os.path.join(MEDIA_ROOT, job["thumbnail"])) else obj.thumbnail.name
+    shared = dedup.complete(obj, job["hls"], poster)
+    if shared:
+        print(f'{shared} other video(s) of the same source now play these outputs')
+
+
+def _fail(obj, e):
+    # Ensure flags reset on error
+    if obj:
+        try:
+            obj.errors = str(e)
+            obj.is_running = False
+            obj.status = 'Failed'
+            obj.save(update_fields=["errors", "is_running", "status"])
+            # Videos waiting on this encode of the same source take it over
+            dedup.abandon(obj)
+        except Exception:
+            pass
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def encode_chunk(video_id, cmd, job=None, index=None):
+    try:
+        # The first chunk to start marks the video as encoding
+        if Video.objects.filter(pk=video_id, status='Queued').update(
+                status='Processing', heartbeat_at=timezone.now()):
+            caching.bump_video_version(video_id)
+        run_ffmpeg(cmd, on_tick=_heartbeat_ticker(video_id),
+                   on_progress=lambda block: progress.publish(video_id, block, part=index or 0))
+        if job and index is not None:
+            output_dir_abs = os.path.join(MEDIA_ROOT, job["output_dir_rel"])
+            checkpoints.record_chunk(video_id, job["plan_key"], output_dir_abs, index, job["playlists"])
+    except Exception as e:
+        # A failed chunk aborts the chord, so the finalize task never runs
+        _fail(Video.objects.filter(pk=video_id).first(), e)
+        raise CommandError(e)
+
+
+@shared_task
+def finalize_encode(video_id, job):
+    """Stitch chunks or close the playlists, then grab the thumbnail and mark Completed."""
+    obj = Video.objects.filter(pk=video_id).first()
+    if not obj:
+        print(f'No video with id={video_id} found.')
+        return
+    try:
+        output_dir_abs = os.path.join(MEDIA_ROOT, job["output_dir_rel"])
+        if job["chunks"] > 1:
+            chunked.stitch(output_dir_abs, job["playlists"], job["chunks"])
+        else:
+            encoding.finalize_playlists(output_dir_abs, job["playlists"])
+        encoding.build_sprites(output_dir_abs, job["safe_base"], job["duration"])
+        _finalize(obj, job)
+    except Exception as e:
+        _fail(obj, e)
+        raise CommandError(e)
+
+
+@shared_task
+def reap_stale_encodes():
+    """Requeue encodes whose worker stopped sending heartbeats (run by celery beat).
 
-        # --- FINALIZE ---
-        obj.hls = output_hls_rel_path
-        obj.status = 'Completed'
+    Videos Queued for longer than HLS_QUEUED_STALE_SECONDS are requeued too:
+    their encode message was lost. Saving the row as Pending re-triggers
+    process_video, which resumes from the last checkpoint.
+    """
+    stale = _stale_before()
+    queued_stale = timezone.now() - timedelta(seconds=int(getattr(settings, 'HLS_QUEUED_STALE_SECONDS', 6 * 3600)))
+    reaped = 0
+    for obj in Video.objects.filter(
+            Q(status='Processing', heartbeat_at__lt=stale)
+            | Q(status='Queued', heartbeat_at__lt=queued_stale)
+            | Q(status__in=('Processing', 'Queued'), heartbeat_at__isnull=True)):
+        if obj.status == 'Queued':
+            obj.errors = f'Queued since {obj.heartbeat_at} without an encode starting; requeued.'
+        else:
+            obj.errors = f'Encode stalled (no heartbeat since {obj.heartbeat_at}); requeued.'
+        obj.status = 'Pending'
         obj.is_running = False
-        obj.save(update_fields=["hls", "thumbnail", "status", "is_running"])
-        print(f'HLS segments generated at: {output_hls_rel_path}')
+        obj.save(update_fields=["status", "is_running", "errors"])
+        reaped += 1
+    if reaped:
+        print(f'Requeued {reaped} stalled encode(s)')
+    return reaped
 
+
+@shared_task
+def refresh_import_index():
+    """Re-list the import directories that changed (run by celery beat)."""
+    listed, added, removed = ingest.refresh_index()
+    if added or removed:
+        print(f'Import index: {listed} directories listed, {added} files added, {removed} removed')
+    return added, removed
+
+
+@shared_task
+def finish_upload(upload_id):
+    """Verify a completed resumable upload and attach it to its Video (which queues the encode)."""
+    upload = Upload.objects.filter(pk=upload_id, status=Upload.VERIFYING).first()
+    if not upload:
+        print(f'No upload id={upload_id} waiting for verification.')
+        return
+    try:
+        uploads.verify(upload)
+        video = uploads.attach(upload)
+        print(f'Upload {upload.token} attached to video id={video.id}')
     except Exception as e:
-        # Ensure flags reset on error
-        if obj:
-            try:
-                obj.errors = str(e)
-                obj.is_running = False
-                obj.status = 'Failed'
-                obj.save(update_fields=["errors", "is_running", "status"])
-            except Exception:
-                pass
-        raise CommandError(e)
\ No newline at end of file
+        # A corrupt file is no use for a resume either; the client starts over
+        uploads.discard(upload)
+        upload.status = Upload.FAILED
+        upload.errors = str(e)
+        upload.save(update_fields=["status", "errors", "updated_at"])
+        print(f'Upload {upload.token} failed: {e}')
+
+
+@shared_task
+def expire_uploads():
+    """Remove resumable uploads abandoned for UPLOAD_EXPIRE_HOURS (run by celery beat)."""
+    stale = list(uploads.expired())
+    for upload in stale:
+        uploads.discard(upload)
+        upload.delete()
+    if stale:
+        print(f'Removed {len(stale)} abandoned upload(s)')
+    return len(stale)
@@ -1,3 +1,954 @@
-from django.test import TestCase
+import base64
+import hashlib
+import importlib
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from datetime import timedelta
+from unittest import skipUnless
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.http import FileResponse
+from django.db import connection
+from django.conf import settings
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from . import checkpoints, chunked, dedup, encoding, ingest, probe, search, signing, tasks, uploads, views
+from .models import CastMember, EncodeCheckpoint, Genre, ImportDir, ImportFile, MediaProbe, SourceFingerprint, Upload, Video
 
 # Create your tests here.
+
+class CatalogQueryCountTests(TestCase):
+    # Query counts must not grow with the number of videos or relations shown
+
+    @classmethod
+    def setUpTestData(cls):
+        genres = [Genre.objects.create(name=f"Genre {i}") for i in range(3)]
+        cast = [CastMember.objects.create(name=f"Actor {i}", bio="") for i in range(3)]
+        cls.videos = []
+        for i in range(30):
+            video = Video.objects.create(
+                name=f"Movie {i}", description="A movie.", status="Completed",
+                hls=f"videos/hls_output/{i}/movie_{i}_hls.m3u8", duration="5400",
+            )
+            video.genres.set(genres)
+            video.cast.set(cast)
+            cls.videos.append(video)
+        # Not playable: never listed
+        Video.objects.create(name="Queued", description="", status="Pending")
+
+    def setUp(self):
+        # Rendered pages are cached; every test starts cold
+        cache.clear()
+
+    def test_home_page_queries(self):
+        # COUNT for the paginator and the page itself
+        with self.settings(HOME_PAGE_SIZE=12), self.assertNumQueries(2):
+            resp = self.client.get(reverse("home"))
+        self.assertEqual(len(resp.context["videos"]), 12)
+        self.assertEqual(resp.context["page_obj"].paginator.count, 30)
+        with self.settings(HOME_PAGE_SIZE=12), self.assertNumQueries(2):
+            resp = self.client.get(reverse("home"), {"page": 3})
+        self.assertEqual(len(resp.context["videos"]), 6)
+
+    def test_movie_detail_queries(self):
+        # Video with its probe, genres and cast; the Open Graph tags reuse the same video
+        with self.assertNumQueries(3):
+            resp = self.client.get(reverse("movie", args=[self.videos[0].slug]))
+        self.assertContains(resp, "Genre 2")
+        self.assertContains(resp, "Actor 2")
+        self.assertContains(resp, '<meta property="og:title" content="Movie 0">')
+
+    def test_catalog_api_pages(self):
+        url = reverse("catalog_api")
+        with self.assertNumQueries(1):
+            first = self.client.get(url, {"limit": 20, "fields": "id,name,playlist"}).json()
+        self.assertEqual(len(first["results"]), 20)
+        self.assertEqual(set(first["results"][0]), {"id", "name", "playlist"})
+        self.assertEqual(first["results"][0]["id"], self.videos[-1].pk)
+
+        # Keyset pagination: no OFFSET, no COUNT; one query per prefetched relation
+        with self.assertNumQueries(3):
+            second = self.client.get(first["next"].replace("fields=id%2Cname%2Cplaylist", "fields=id%2Cgenres%2Ccast")).json()
+        self.assertEqual(len(second["results"]), 10)
+        self.assertIsNone(second["next"])
+        self.assertEqual(second["results"][0]["genres"], ["Genre 0", "Genre 1", "Genre 2"])
+        seen = {item["id"] for item in first["results"] + second["results"]}
+        self.assertEqual(seen, {v.pk for v in self.videos})
+
+    def test_catalog_api_etag(self):
+        url = reverse("catalog_api")
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        resp = self.client.get(url, HTTP_IF_NONE_MATCH=resp["ETag"])
+        self.assertEqual(resp.status_code, 304)
+
+        Video.objects.filter(pk=self.videos[-1].pk).update(name="Renamed")
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=resp["ETag"]).status_code, 200)
+
+    def test_catalog_api_rejects_unknown_fields(self):
+        resp = self.client.get(reverse("catalog_api"), {"fields": "id,secret"})
+        self.assertEqual(resp.status_code, 400)
+
+
+class PageCacheTests(TestCase):
+    # Anonymous page views come from the cache until a video they show changes
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.genre = Genre.objects.create(name="Drama")
+        cls.video = Video.objects.create(
+            name="Cached Movie", description="A movie.", status="Completed",
+            hls="videos/hls_output/1/movie_hls.m3u8", duration="5400",
+        )
+        cls.video.genres.add(cls.genre)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_home_page_cached_until_a_video_changes(self):
+        self.client.get(reverse("home"))
+        with self.assertNumQueries(0):
+            resp = self.client.get(reverse("home"))
+        self.assertContains(resp, "Cached Movie")
+
+        self.video.name = "Renamed Movie"
+        self.video.save()
+        resp = self.client.get(reverse("home"))
+        self.assertContains(resp, "Renamed Movie")
+
+    def test_movie_detail_cached_until_the_video_changes(self):
+        url = reverse("movie", args=[self.video.slug])
+        self.client.get(url)
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            resp = self.client.get(url)
+        self.assertContains(resp, "Drama")
+
+        self.genre.name = "Comedy"
+        self.genre.save()
+        self.assertContains(self.client.get(url), "Comedy")
+
+        self.video.genres.clear()
+        self.client.get(url)
+        self.assertNotContains(self.client.get(url), "Comedy")
+
+    def test_unknown_query_parameters_bypass_the_page_cache(self):
+        # Pages echoing request input must never be served to other visitors
+        for url in (reverse("home"), reverse("movie", args=[self.video.slug])):
+            for _ in range(3):
+                # Rendered every time (cached pages have no template context)
+                self.assertIsNotNone(self.client.get(url, {"q": "injected"}).context)
+            self.assertNotContains(self.client.get(url), "injected")
+
+    def test_logged_in_users_bypass_the_page_cache(self):
+        self.client.force_login(User.objects.create_user("viewer", password="x"))
+        self.client.get(reverse("home"))
+        # Rendered again (cached pages have no template context)
+        self.assertIsNotNone(self.client.get(reverse("home")).context)
+
+
+class VideoSaveQueryTests(TestCase):
+    # Query budget for Video.save(): one snapshot of the stored row and one
+    # slug lookup at most, however many videos share the slug
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(5):
+            Video.objects.create(name="Same Title", description="", status="Completed")
+
+    def test_create(self):
+        # Slug lookup, INSERT and the search index entry
+        with self.assertNumQueries(3):
+            video = Video.objects.create(name="Same Title", description="", status="Completed")
+        self.assertEqual(video.slug, "same-title-5")
+
+    def test_update(self):
+        video = Video.objects.get(slug="same-title-2")
+        video.release_year = 1999
+        # Snapshot and UPDATE; the slug is unchanged, so no lookup
+        with self.assertNumQueries(2):
+            video.save()
+        self.assertEqual(video.slug, "same-title-2")
+
+        # New text to index: the video's cast and genres, and the index entry
+        video.description = "Changed."
+        with self.assertNumQueries(5):
+            video.save()
+
+    def test_rename_slug(self):
+        video = Video.objects.get(slug="same-title-2")
+        video.slug = "same-title"
+        with self.assertNumQueries(3):
+            video.save()
+        self.assertEqual(video.slug, "same-title-2")
+
+    def test_status_only_save(self):
+        video = Video.objects.get(slug="same-title")
+        video.status = "Processing"
+        with self.assertNumQueries(1):
+            video.save(update_fields=["status"])
+        video.refresh_from_db()
+        self.assertEqual(video.status, "Processing")
+
+    def test_long_names_stay_within_the_slug_field(self):
+        name = "x" * 80
+        first = Video.objects.create(name=name, description="")
+        second = Video.objects.create(name=name, description="")
+        self.assertEqual(first.slug, "x" * 50)
+        self.assertEqual(second.slug, "x" * 48 + "-1")
+
+
+class SearchTests(TestCase):
+    # The index follows Video, Genre and CastMember changes through their signals
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.scifi = Genre.objects.create(name="Science Fiction")
+        cls.keanu = CastMember.objects.create(name="Keanu Reeves", bio="")
+        cls.matrix = Video.objects.create(
+            name="The Matrix", description="A hacker learns the truth.", status="Completed",
+            hls="videos/hls_output/1/matrix_hls.m3u8",
+        )
+        cls.matrix.genres.add(cls.scifi)
+        cls.matrix.cast.add(cls.keanu)
+        cls.documentary = Video.objects.create(
+            name="Making Movies", description="How the matrix was filmed.", status="Completed",
+            hls="videos/hls_output/2/making_hls.m3u8",
+        )
+        # Not playable: never found
+        Video.objects.create(name="Matrix Reloaded", description="", status="Pending")
+
+    def names(self, query):
+        return [video.name for video in search.search(query)]
+
+    def test_prefix_matching_across_fields(self):
+        self.assertEqual(self.names("matr"), ["The Matrix", "Making Movies"])
+        self.assertEqual(self.names("kea"), ["The Matrix"])
+        self.assertEqual(self.names("science fic"), ["The Matrix"])
+        self.assertEqual(self.names("hacker matrix"), ["The Matrix"])
+        self.assertEqual(self.names("nothing"), [])
+        self.assertEqual(self.names("  !! "), [])
+
+    def test_query_count(self):
+        # Index lookup and the cards
+        with self.assertNumQueries(2):
+            search.search("matrix")
+
+    def test_index_follows_changes(self):
+        self.matrix.name = "Neo"
+        self.matrix.save()
+        self.assertEqual(self.names("neo"), ["Neo"])
+
+        self.scifi.name = "Cyberpunk"
+        self.scifi.save()
+        self.assertEqual(self.names("cyber"), ["Neo"])
+        self.assertEqual(self.names("science"), [])
+
+        self.keanu.delete()
+        self.assertEqual(self.names("keanu"), [])
+
+        self.documentary.cast.add(CastMember.objects.create(name="Wachowski", bio=""))
+        self.assertEqual(self.names("wach"), ["Making Movies"])
+        self.scifi.video_set.clear()
+        self.assertEqual(self.names("cyber"), [])
+
+        self.documentary.delete()
+        self.assertEqual(self.names("movies"), [])
+
+    def test_status_only_saves_leave_the_index_alone(self):
+        self.matrix.status = "Processing"
+        with self.assertNumQueries(1):
+            self.matrix.save(update_fields=["status"])
+
+    def test_search_page_and_api(self):
+        resp = self.client.get(reverse("search"), {"q": "matrix"})
+        self.assertContains(resp, "2 results")
+        self.assertContains(resp, self.matrix.slug)
+
+        # The navbar never echoes the query into the page markup
+        self.assertNotContains(self.client.get(reverse("home"), {"q": "<injected>"}), "injected")
+
+        results = self.client.get(reverse("search_api"), {"q": "kea"}).json()["results"]
+        self.assertEqual(results, [{
+            "id": self.matrix.pk, "slug": self.matrix.slug, "name": "The Matrix",
+            "url": reverse("movie", args=[self.matrix.slug]),
+        }])
+
+    def test_migration_backfill(self):
+        # Migration 0014 fills the index from existing rows with its own SQL
+        migration = importlib.import_module("content.migrations.0014_search_index")
+        with connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {search.TABLE}")
+            self.assertEqual(self.names("kea"), [])
+            cursor.execute(migration.BACKFILL[connection.vendor])
+        self.assertEqual(self.names("kea"), ["The Matrix"])
+        self.assertEqual(self.names("science"), ["The Matrix"])
+        self.assertEqual(self.names("matr"), ["The Matrix", "Making Movies"])
+
+
+@skipUnless(connection.vendor == "postgresql", "PostgreSQL tsvector index")
+class PostgresSearchIndexTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Video.objects.create(name="Alien", description="Space horror.", status="Completed", hls="a.m3u8")
+
+    def test_document_weights(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT document::text FROM {search.TABLE}")
+            document = cursor.fetchone()[0]
+        self.assertIn("'alien':1A", document)
+        self.assertIn("'space':2C", document)
+
+    def test_prefix_queries_use_the_gin_index(self):
+        with connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute(
+                f"EXPLAIN SELECT video_id FROM {search.TABLE} WHERE document @@ to_tsquery('simple', %s)",
+                ["ali:*"],
+            )
+            plan = "\n".join(row[0] for row in cursor.fetchall())
+        self.assertIn("content_search_document", plan)
+
+
+class ReapStaleEncodesTests(TestCase):
+
+    def video(self, status, age):
+        heartbeat = None if age is None else timezone.now() - timedelta(seconds=age)
+        return Video.objects.create(name=f"{status} {age}", description="", status=status,
+                                    heartbeat_at=heartbeat, is_running=status == "Processing")
+
+    def test_requeues_stalled_and_lost_encodes(self):
+        with self.settings(HLS_STALE_SECONDS=600, HLS_QUEUED_STALE_SECONDS=3600):
+            running = self.video("Processing", 60)
+            stalled = self.video("Processing", 700)
+            waiting = self.video("Queued", 700)
+            lost = self.video("Queued", 4000)
+            never = self.video("Processing", None)
+            self.assertEqual(tasks.reap_stale_encodes(), 3)
+
+        statuses = dict(Video.objects.values_list("pk", "status"))
+        self.assertEqual(statuses[running.pk], "Processing")
+        self.assertEqual(statuses[waiting.pk], "Queued")
+        for video in (stalled, lost, never):
+            self.assertEqual(statuses[video.pk], "Pending")
+        self.assertIn("without an encode starting", Video.objects.get(pk=lost.pk).errors)
+
+
+class ProbeTests(TestCase):
+
+    def test_parse_keyframes(self):
+        # ffprobe -select_streams v:0 -show_entries packet=pts_time,flags -of csv=print_section=0
+        lines = ["4.004000,K__\n", "0.041708,___\n", "0.000000,K_\n", "N/A,K__\n", "2.002000,_D_\n", "\n"]
+        self.assertEqual(probe.parse_keyframes(lines), [0.0, 4.004])
+
+    def test_apply_ffprobe(self):
+        meta = {
+            "format": {"format_name": "mov,mp4", "duration": "12.5", "bit_rate": "800000"},
+            "streams": [
+                {"index": 0, "codec_type": "video", "codec_name": "H264", "width": 1280, "height": 720,
+                 "avg_frame_rate": "24000/1001"},
+                {"index": 1, "codec_type": "audio", "codec_name": "aac", "channels": 2},
+            ],
+        }
+        result = probe.apply_ffprobe(MediaProbe(), meta, [0.0, 4.004])
+        self.assertEqual((result.video_codec, result.width, result.height), ("h264", 1280, 720))
+        self.assertEqual(result.frame_rate, 23.976)
+        self.assertEqual(result.duration, 12.5)
+        self.assertEqual(result.audio_channels, 2)
+        self.assertEqual(result.keyframes, [0.0, 4.004])
+
+
+class LadderTests(TestCase):
+
+    def test_renditions_come_from_the_settings_ladder(self):
+        ladder = [
+            {"name": "720p", "height": 720, "video_bitrate": 2800, "audio_bitrate": 128},
+            {"name": "360p", "height": 360, "video_bitrate": 800, "audio_bitrate": 96},
+        ]
+        with self.settings(HLS_LADDER=ladder):
+            self.assertEqual([r["name"] for r in encoding.select_renditions(1920, 1080)], ["720p", "360p"])
+            # No upscaling; 4:3 sources keep their aspect ratio
+            rungs = encoding.select_renditions(640, 480)
+        self.assertEqual([(r["name"], r["width"], r["height"]) for r in rungs], [("360p", 480, 360)])
+
+    def test_missing_ladder_is_a_configuration_error(self):
+        with self.settings(HLS_LADDER=[]):
+            with self.assertRaisesMessage(ImproperlyConfigured, "HLS_LADDER"):
+                encoding.get_ladder()
+        with self.settings():
+            del settings.HLS_LADDER
+            with self.assertRaisesMessage(ImproperlyConfigured, "HLS_LADDER"):
+                encoding.get_ladder()
+
+
+@override_settings(HLS_TRICKPLAY=True, HLS_SPRITE_INTERVAL=10)
+class PreviewCommandTests(TestCase):
+
+    def test_copy_mode_decodes_keyframes_only(self):
+        cmd = encoding.copy_command("/src.mp4", "/out", "movie", preview_dir="/out")
+        self.assertEqual(cmd[cmd.index("-skip_frame") + 1], "nokey")
+        self.assertLess(cmd.index("-skip_frame"), cmd.index("-i"))
+        graph = cmd[cmd.index("-filter_complex") + 1]
+        self.assertIn("fps=1/10", graph)
+        self.assertIn("trim=end_frame=1", graph)
+        self.assertEqual(cmd[cmd.index("-c:v") + 1], "copy")
+
+    def test_copy_mode_without_previews_decodes_nothing(self):
+        cmd = encoding.copy_command("/src.mp4", "/out", "movie")
+        self.assertNotIn("-skip_frame", cmd)
+        self.assertNotIn("-filter_complex", cmd)
+
+    def test_ladder_previews_use_every_frame(self):
+        renditions = encoding.select_renditions(1920, 1080)
+        cmd = encoding.ladder_command("/src.mp4", "/out", "movie", renditions, preview_dir="/out")
+        self.assertNotIn("-skip_frame", cmd)
+        self.assertIn("select=gte(t\\,selected_n*10)", cmd[cmd.index("-filter_complex") + 1])
+
+
+class BuildSpritesTests(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def frames(self, start, count):
+        from PIL import Image
+        for k in range(count):
+            Image.new("RGB", (16, 9)).save(
+                os.path.join(self.dir, f"{encoding.preview_prefix('movie', start)}{k:05d}.jpg"))
+
+    def cues(self):
+        with open(os.path.join(self.dir, encoding.thumbnails_vtt_name("movie"))) as f:
+            return [line for line in f.read().splitlines() if "-->" in line]
+
+    def test_series_are_stitched_and_the_last_frame_covers_the_tail(self):
+        # Two chunks (0s and 30s); keyframe-only previews stop before the end of each
+        self.frames(0, 2)
+        self.frames(30, 3)
+        with self.settings(HLS_TRICKPLAY=True, HLS_SPRITE_INTERVAL=10, HLS_SPRITE_COLUMNS=2, HLS_SPRITE_ROWS=2):
+            encoding.build_sprites(self.dir, "movie", 65)
+        self.assertEqual(self.cues(), [
+            "00:00:00.000 --> 00:00:10.000",
+            "00:00:10.000 --> 00:00:30.000",
+            "00:00:30.000 --> 00:00:40.000",
+            "00:00:40.000 --> 00:00:50.000",
+            "00:00:50.000 --> 00:01:05.000",
+        ])
+        self.assertEqual(sorted(os.listdir(self.dir)), [
+            "movie_sprite_000.jpg", "movie_sprite_001.jpg", "movie_thumbs.vtt"])
+
+
+class DedupTests(TestCase):
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = self.settings(MEDIA_ROOT=self.media, HLS_DEDUP=True)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.source = os.path.join(self.media, "source.mp4")
+        with open(self.source, "wb") as f:
+            f.write(b"not really a movie" * 100)
+
+    def video(self, name, status="Processing"):
+        return Video.objects.create(name=name, description="", status=status, is_running=status == "Processing")
+
+    def finish(self, video, entry):
+        # What process_video leaves behind: a playlist in the shared output dir
+        os.makedirs(os.path.join(self.media, entry.output_dir), exist_ok=True)
+        hls = os.path.join(entry.output_dir, "movie_hls.m3u8")
+        open(os.path.join(self.media, hls), "w").close()
+        Video.objects.filter(pk=video.pk).update(status="Completed", hls=hls)
+        video.refresh_from_db()
+        dedup.complete(video, hls, "")
+        return hls
+
+    def test_claim_roles(self):
+        first, second, third = self.video("First"), self.video("Second"), self.video("Third")
+        entry, role = dedup.claim(first, self.source)
+        self.assertEqual(role, "encode")
+        self.assertEqual(dedup.claim(second, self.source)[1], "wait")
+        second.refresh_from_db()
+        self.assertEqual(second.status, "Queued")
+
+        hls = self.finish(first, entry)
+        second.refresh_from_db()
+        self.assertEqual((second.status, second.hls), ("Completed", hls))
+        self.assertEqual(dedup.claim(third, self.source)[1], "reuse")
+
+    def test_new_encode_settings_make_the_outputs_stale(self):
+        first, second = self.video("First"), self.video("Second")
+        entry, _ = dedup.claim(first, self.source)
+        self.finish(first, entry)
+        ladder = [{"name": "360p", "height": 360, "video_bitrate": 800, "audio_bitrate": 96}]
+        with self.settings(HLS_LADDER=ladder):
+            entry, role = dedup.claim(second, self.source)
+            self.assertEqual(role, "encode")
+            self.assertEqual(entry.settings_key, encoding.settings_key())
+        self.assertEqual(SourceFingerprint.objects.get().encoder_id, second.pk)
+
+    def test_queryset_delete_releases_the_outputs(self):
+        first, second = self.video("First"), self.video("Second")
+        entry, _ = dedup.claim(first, self.source)
+        dedup.claim(second, self.source)
+        # The encoder goes: the video waiting on it takes the encode over
+        # (requeued as Pending; process_video isn't run here)
+        with self.captureOnCommitCallbacks():
+            Video.objects.filter(pk=first.pk).delete()
+        second.refresh_from_db()
+        self.assertEqual(second.status, "Pending")
+
+        self.finish(second, entry)
+        output_dir = os.path.join(self.media, entry.output_dir)
+        self.assertTrue(os.path.isdir(output_dir))
+        with self.captureOnCommitCallbacks(execute=True):
+            Video.objects.filter(pk=second.pk).delete()
+        self.assertFalse(SourceFingerprint.objects.exists())
+        self.assertFalse(os.path.exists(output_dir))
+
+
+@override_settings(HLS_SIGNED_URLS=True, HLS_URL_TTL=3600)
+class SigningTests(TestCase):
+    NOW = 1_700_000_000
+
+    def params(self, query):
+        return dict(pair.split("=") for pair in query.split("&"))
+
+    def test_token_verifies_until_it_expires(self):
+        params = self.params(signing.token(7, now=self.NOW))
+        expires = int(params["exp"])
+        # Rounded up to the step, so every viewer gets the same URLs for a while
+        self.assertEqual(expires % signing.EXPIRY_STEP, 0)
+        self.assertGreaterEqual(expires, self.NOW + 3600)
+        self.assertEqual(signing.token(7, now=self.NOW + 1), signing.token(7, now=self.NOW))
+        self.assertTrue(signing.verify(7, params, now=self.NOW))
+        self.assertTrue(signing.verify(7, params, now=expires))
+        self.assertFalse(signing.verify(7, params, now=expires + 1))
+
+    def test_token_is_bound_to_video_and_expiry(self):
+        params = self.params(signing.token(7, now=self.NOW))
+        self.assertFalse(signing.verify(8, params, now=self.NOW))
+        self.assertFalse(signing.verify(7, {**params, "exp": str(int(params["exp"]) + 300)}, now=self.NOW))
+        self.assertFalse(signing.verify(7, {"exp": params["exp"]}, now=self.NOW))
+        self.assertFalse(signing.verify(7, {**params, "exp": "soon"}, now=self.NOW))
+
+    def test_session_bound_token(self):
+        params = self.params(signing.token(7, now=self.NOW, session="abc"))
+        self.assertTrue(signing.verify(7, params, now=self.NOW, session="abc"))
+        self.assertFalse(signing.verify(7, params, now=self.NOW, session="other"))
+        self.assertFalse(signing.verify(7, params, now=self.NOW))
+
+    @override_settings(HLS_SIGNED_URLS_BIND_SESSION=True)
+    def test_segment_urls_only_work_in_the_issuing_session(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        os.makedirs(os.path.join(media, "hls"))
+        with open(os.path.join(media, "hls", "movie_hls.m3u8"), "w") as f:
+            f.write("#EXTM3U\n#EXTINF:6.0,\n{{ dynamic_path }}/movie_0.ts?v=1{{ access_token }}\n#EXT-X-ENDLIST\n")
+        with open(os.path.join(media, "hls", "movie_0.ts"), "wb") as f:
+            f.write(b"segment")
+        video = Video.objects.create(name="Movie", description="", status="Completed", hls="hls/movie_hls.m3u8")
+        for lru in (views._playlist_paths, views._rendered_playlists, views._hot_segments):
+            lru.clear()
+        cache.clear()
+        with self.settings(MEDIA_ROOT=media):
+            # An anonymous viewer gets a session along with the playlist
+            playlist = self.client.get(reverse("serve_hls_playlist", args=[video.pk]))
+            self.assertIn(settings.SESSION_COOKIE_NAME, playlist.cookies)
+            url = next(line for line in playlist.content.decode().splitlines() if "movie_0.ts" in line)
+            self.assertEqual(self.client.get(url).status_code, 200)
+            # The same URL from another browser
+            self.assertEqual(Client().get(url).status_code, 403)
+
+    def test_segment_view_refuses_unsigned_urls(self):
+        url = reverse("serve_hls_segment", args=[7, "movie_0.ts"])
+        self.assertEqual(self.client.get(url).status_code, 403)
+        self.assertEqual(self.client.get(f"{url}?{signing.token(8)}").status_code, 403)
+        # Signed for this video: past the check (no such video here)
+        self.assertEqual(self.client.get(f"{url}?{signing.token(7)}").status_code, 404)
+
+
+class SegmentViewTests(TestCase):
+    SEGMENT = bytes(range(256)) * 40
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = self.settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.media, "hls"))
+        with open(os.path.join(self.media, "hls", "movie_hls.m3u8"), "w") as f:
+            f.write("#EXTM3U\n#EXTINF:6.0,\n{{ dynamic_path }}/movie_0.ts\n#EXT-X-ENDLIST\n")
+        with open(os.path.join(self.media, "hls", "movie_0.ts"), "wb") as f:
+            f.write(self.SEGMENT)
+        self.video = Video.objects.create(name="Movie", description="", status="Completed",
+                                          hls="hls/movie_hls.m3u8")
+        self.url = reverse("serve_hls_segment", args=[self.video.pk, "movie_0.ts"])
+        for lru in (views._playlist_paths, views._rendered_playlists, views._hot_segments):
+            lru.clear()
+        cache.clear()
+
+    async def abody(self, resp):
+        if not resp.streaming:
+            return resp.content
+        return b"".join([chunk async for chunk in resp.streaming_content])
+
+    def body(self, resp):
+        return b"".join(resp.streaming_content) if resp.streaming else resp.content
+
+    def test_wsgi(self):
+        resp = self.client.get(self.url)
+        self.assertEqual((resp.status_code, self.body(resp)), (200, self.SEGMENT))
+        # A whole file goes out with sendfile(), past the hot-segment cache
+        self.assertIsInstance(resp, FileResponse)
+        self.assertEqual(views._hot_segments.bytes, 0)
+        resp = self.client.get(self.url, HTTP_RANGE="bytes=100-199")
+        self.assertEqual((resp.status_code, resp["Content-Range"]), (206, "bytes 100-199/10240"))
+        self.assertEqual(self.body(resp), self.SEGMENT[100:200])
+
+    async def test_asgi(self):
+        resp = await self.async_client.get(self.url)
+        self.assertEqual((resp.status_code, await self.abody(resp)), (200, self.SEGMENT))
+        self.assertEqual(views._hot_segments.bytes, len(self.SEGMENT))
+        resp = await self.async_client.get(self.url, headers={"Range": "bytes=-24"})
+        self.assertEqual((resp.status_code, resp["Content-Range"]), (206, "bytes 10216-10239/10240"))
+        self.assertEqual(await self.abody(resp), self.SEGMENT[-24:])
+        # The playlist view stats the playlist off the event loop too
+        resp = await self.async_client.get(reverse("serve_hls_playlist", args=[self.video.pk]))
+        self.assertContains(resp, f"/serve_hls_segment/{self.video.pk}/movie_0.ts")
+
+    @override_settings(HLS_ACCEL_REDIRECT=True, HLS_ACCEL_PREFIX="/protected-media/")
+    def test_accel_redirect_skips_the_hot_segment_cache(self):
+        resp = self.client.get(self.url, HTTP_RANGE="bytes=0-99")
+        self.assertEqual(resp["X-Accel-Redirect"], "/protected-media/hls/movie_0.ts")
+        self.assertEqual(resp.content, b"")
+        self.assertEqual(views._hot_segments.bytes, 0)
+
+    def test_parse_ranges(self):
+        self.assertIsNone(views._parse_ranges(None, 100))
+        self.assertIsNone(views._parse_ranges("items=0-1", 100))
+        self.assertIsNone(views._parse_ranges("bytes=5-2", 100))
+        self.assertIsNone(views._parse_ranges("bytes=a-b", 100))
+        self.assertIsNone(views._parse_ranges("bytes=" + ",".join(["0-0"] * (views.MAX_RANGES + 1)), 100))
+        self.assertEqual(views._parse_ranges("bytes=0-9, 90-, -5", 100), [(0, 9), (90, 99), (95, 99)])
+        # Clamped to the file; ranges starting past the end are dropped (all gone: 416)
+        self.assertEqual(views._parse_ranges("bytes=50-500,200-300", 100), [(50, 99)])
+        self.assertEqual(views._parse_ranges("bytes=100-", 100), [])
+
+    def test_multiple_ranges(self):
+        resp = self.client.get(self.url, HTTP_RANGE="bytes=0-3,10-11")
+        self.assertEqual(resp.status_code, 206)
+        content_type, boundary = resp["Content-Type"].split("; boundary=")
+        self.assertEqual(content_type, "multipart/byteranges")
+        body = self.body(resp)
+        self.assertEqual(int(resp["Content-Length"]), len(body))
+        self.assertEqual(body, (
+            f"--{boundary}\r\nContent-Type: video/mp2t\r\nContent-Range: bytes 0-3/10240\r\n\r\n".encode()
+            + self.SEGMENT[0:4] + b"\r\n"
+            + f"--{boundary}\r\nContent-Type: video/mp2t\r\nContent-Range: bytes 10-11/10240\r\n\r\n".encode()
+            + self.SEGMENT[10:12] + b"\r\n"
+            + f"--{boundary}--\r\n".encode()
+        ))
+
+    def test_unsatisfiable_range(self):
+        resp = self.client.get(self.url, HTTP_RANGE="bytes=20000-")
+        self.assertEqual((resp.status_code, resp["Content-Range"]), (416, "bytes */10240"))
+
+    def test_if_range(self):
+        etag = self.client.get(self.url)["ETag"]
+        resp = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE=etag)
+        self.assertEqual((resp.status_code, self.body(resp)), (206, self.SEGMENT[:10]))
+        # A stale validator: the whole file instead of the range
+        resp = self.client.get(self.url, HTTP_RANGE="bytes=0-9", HTTP_IF_RANGE='"stale"')
+        self.assertEqual((resp.status_code, self.body(resp)), (200, self.SEGMENT))
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+
+class CheckpointResumeTests(TestCase):
+    PLAYLISTS = [("720p.m3u8", None), ("360p.m3u8", None)]
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.video = Video.objects.create(name="Movie", description="", status="Processing")
+
+    def write(self, name, count, ended=False):
+        stem = name.split(".")[0]
+        lines = ["#EXTM3U", "#EXT-X-TARGETDURATION:6"]
+        for i in range(count):
+            with open(os.path.join(self.dir, f"{stem}_{i}.ts"), "wb") as f:
+                f.write(b"x" * (100 + i))
+            lines += ["#EXTINF:6.000000,", f"{stem}_{i}.ts"]
+        if ended:
+            lines.append("#EXT-X-ENDLIST")
+        with open(os.path.join(self.dir, name), "w") as f:
+            f.write("\n".join(lines) + "\n")
+        return checkpoints.record(self.video.pk, "plan", self.dir, name)
+
+    def test_resume_truncates_to_the_segments_every_rendition_has(self):
+        self.assertEqual(self.write("720p.m3u8", 4), 4)
+        self.assertEqual(self.write("360p.m3u8", 4), 4)
+        # Recording again stores nothing new
+        self.assertEqual(checkpoints.record(self.video.pk, "plan", self.dir, "360p.m3u8"), 0)
+        # A segment that changed on disk ends the verified run of its rendition
+        with open(os.path.join(self.dir, "360p_3.ts"), "wb") as f:
+            f.write(b"short")
+        EncodeCheckpoint.objects.create(video=self.video, plan_key="old", playlist="720p.m3u8",
+                                        sequence=0, filename="720p_0.ts", duration=6, size=1)
+
+        count, start = checkpoints.prepare_resume(self.video.pk, "plan", self.dir, self.PLAYLISTS)
+        # Three verified segments in 360p; the last of them is given back
+        self.assertEqual((count, start), (2, 12.0))
+        for name, _ in self.PLAYLISTS:
+            _, segments, ended = encoding.read_media_playlist(os.path.join(self.dir, name))
+            self.assertEqual([s[1] for s in segments], [f"{name[:-5]}_0.ts", f"{name[:-5]}_1.ts"])
+            self.assertFalse(ended)
+        self.assertEqual(
+            sorted(EncodeCheckpoint.objects.values_list("plan_key", "playlist", "sequence")),
+            [("plan", "360p.m3u8", 0), ("plan", "360p.m3u8", 1), ("plan", "720p.m3u8", 0), ("plan", "720p.m3u8", 1)])
+
+    def test_nothing_to_resume(self):
+        self.write("720p.m3u8", 1)
+        self.write("360p.m3u8", 1)
+        self.assertEqual(checkpoints.prepare_resume(self.video.pk, "plan", self.dir, self.PLAYLISTS), (0, 0.0))
+
+    def test_truncate_drops_tags_of_the_cut_segment(self):
+        path = os.path.join(self.dir, "movie.m3u8")
+        with open(path, "w") as f:
+            f.write("#EXTM3U\n#EXTINF:6,\na.ts\n#EXT-X-DISCONTINUITY\n#EXTINF:6,\nb.ts\n#EXT-X-ENDLIST\n")
+        checkpoints._truncate(path, 1)
+        with open(path) as f:
+            self.assertEqual(f.read(), "#EXTM3U\n#EXTINF:6,\na.ts\n")
+
+
+class ChunkStitchTests(TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def chunk(self, index, durations):
+        src = chunked.chunk_dir(self.dir, index)
+        os.makedirs(src)
+        lines = ["#EXTM3U"]
+        for i, duration in enumerate(durations):
+            with open(os.path.join(src, f"movie_{i:03d}.ts"), "w") as f:
+                f.write(f"{index}:{i}")
+            lines += [f"#EXTINF:{duration},", f"movie_{i:03d}.ts"]
+        with open(os.path.join(src, "movie_hls.m3u8"), "w") as f:
+            f.write("\n".join(lines + ["#EXT-X-ENDLIST"]) + "\n")
+
+    def test_plan_chunks_cuts_at_keyframes(self):
+        chunks = chunked.plan_chunks([0, 4, 11, 13, 21, 26], 29, target=10)
+        self.assertEqual([(c["start"], c["length"]) for c in chunks], [(0.0, 11), (11, 10), (21, None)])
+
+    def test_run_local_stops_at_the_first_failure(self):
+        # Chunk 0 fails at once: chunk 1 is killed, chunks 2 and 3 never start
+        cmds = {0: ["false"], 1: ["sleep", "30"]}
+        for index in (2, 3):
+            cmds[index] = ["touch", os.path.join(self.dir, f"started-{index}")]
+        start = time.monotonic()
+        with self.assertRaises(subprocess.CalledProcessError):
+            chunked.run_local(cmds, workers=2, interval=0.1)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_stitch_drops_the_sliver_before_a_chunk_boundary(self):
+        # A stream-copied chunk ends with a sliver repeating the next chunk's keyframe
+        self.chunk(0, [6.0, 6.0, 0.04])
+        self.chunk(1, [6.0, 0.2])
+        chunked.stitch(self.dir, [("movie_hls.m3u8", "movie_")], 2)
+
+        with open(os.path.join(self.dir, "movie_hls.m3u8")) as f:
+            lines = f.read().splitlines()
+        self.assertIn("#EXT-X-TARGETDURATION:6", lines)
+        body = lines[lines.index("#EXT-X-INDEPENDENT-SEGMENTS") + 1:]
+        self.assertEqual(body, [
+            "#EXTINF:6.000000,", "{{ dynamic_path }}/movie_000.ts",
+            "#EXTINF:6.000000,", "{{ dynamic_path }}/movie_001.ts",
+            "#EXT-X-DISCONTINUITY",
+            "#EXTINF:6.000000,", "{{ dynamic_path }}/movie_002.ts",
+            # The last chunk keeps its short final segment
+            "#EXTINF:0.200000,", "{{ dynamic_path }}/movie_003.ts",
+            "#EXT-X-ENDLIST",
+        ])
+        contents = []
+        for i in range(4):
+            with open(os.path.join(self.dir, f"movie_{i:03d}.ts")) as f:
+                contents.append(f.read())
+        self.assertEqual(contents, ["0:0", "0:1", "1:0", "1:1"])
+        self.assertFalse(os.path.exists(os.path.join(self.dir, "chunks")))
+
+
+class TusUploadTests(TestCase):
+    DATA = b"0123456789" * 10
+
+    def setUp(self):
+        self.media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media)
+        override = self.settings(MEDIA_ROOT=self.media)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.client.force_login(User.objects.create_user("staff", password="x", is_staff=True))
+
+    def create(self, **metadata):
+        metadata.setdefault("filename", "movie.mp4")
+        header = ",".join(f"{k} {base64.b64encode(v.encode()).decode()}" for k, v in metadata.items())
+        resp = self.client.post(reverse("upload_create"), headers={
+            "Tus-Resumable": "1.0.0", "Upload-Length": str(len(self.DATA)), "Upload-Metadata": header})
+        self.assertEqual(resp.status_code, 201)
+        return resp["Location"]
+
+    def patch(self, url, offset, data, checksum=None):
+        headers = {"Tus-Resumable": "1.0.0", "Upload-Offset": str(offset)}
+        if checksum:
+            headers["Upload-Checksum"] = checksum
+        return self.client.patch(url, data, content_type="application/offset+octet-stream", headers=headers)
+
+    def sha1(self, data):
+        return "sha1 " + base64.b64encode(hashlib.sha1(data).digest()).decode()
+
+    def test_chunks_append_at_the_reported_offset(self):
+        url = self.create()
+        resp = self.patch(url, 0, self.DATA[:40])
+        self.assertEqual((resp.status_code, resp["Upload-Offset"]), (204, "40"))
+        # A client that lost track of the offset is told where to resume
+        resp = self.patch(url, 10, self.DATA[10:50])
+        self.assertEqual(resp.status_code, 409)
+        self.assertEqual(self.client.head(url, headers={"Tus-Resumable": "1.0.0"})["Upload-Offset"], "40")
+        self.assertEqual(self.patch(url, 40, self.DATA[40:] + b"extra").status_code, 413)
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            resp = self.patch(url, 40, self.DATA[40:])
+        self.assertEqual((resp.status_code, resp["Upload-Offset"]), (204, "100"))
+        upload = Upload.objects.get()
+        self.assertEqual(upload.status, Upload.VERIFYING)
+        # finish_upload is queued to verify the file
+        self.assertEqual(len(callbacks), 1)
+        with open(os.path.join(self.media, upload.path), "rb") as f:
+            self.assertEqual(f.read(), self.DATA)
+
+    def test_chunk_checksum(self):
+        url = self.create()
+        resp = self.patch(url, 0, self.DATA[:50], checksum=self.sha1(b"something else"))
+        self.assertEqual(resp.status_code, 460)
+        # All or nothing: the bad chunk left no bytes behind
+        self.assertEqual(Upload.objects.get().offset, 0)
+        self.assertEqual(os.path.getsize(os.path.join(self.media, Upload.objects.get().path)), 0)
+        resp = self.patch(url, 0, self.DATA[:50], checksum=self.sha1(self.DATA[:50]))
+        self.assertEqual((resp.status_code, resp["Upload-Offset"]), (204, "50"))
+        self.assertEqual(self.patch(url, 50, self.DATA[50:], checksum="crc32 abcd").status_code, 400)
+
+    def test_whole_file_checksum(self):
+        self.create(checksum="sha256 " + hashlib.sha256(self.DATA).hexdigest())
+        upload = Upload.objects.get()
+        with open(os.path.join(self.media, upload.path), "wb") as f:
+            f.write(self.DATA)
+        uploads.verify(upload)
+        with open(os.path.join(self.media, upload.path), "wb") as f:
+            f.write(self.DATA[::-1])
+        with self.assertRaisesMessage(ValueError, "sha256 checksum mismatch"):
+            uploads.verify(upload)
+
+
+class ImportIndexTests(TestCase):
+
+    def setUp(self):
+        self.base = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.base)
+        self.age = 1000
+
+    def touch(self, *parts):
+        path = os.path.join(self.base, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+
+    def settle(self, *dirs):
+        # Directories changed within the mtime granularity are listed again on
+        # every refresh; back-date them (the changed ones, or all) instead
+        self.age += 10
+        for root in dirs or [root for root, _, _ in os.walk(self.base)]:
+            os.utime(root, (time.time() - self.age, time.time() - self.age))
+
+    def refresh(self):
+        return ingest.refresh_index([self.base])
+
+    def paths(self):
+        return sorted(os.path.relpath(p, self.base) for p in ImportFile.objects.values_list("path", flat=True))
+
+    def test_refresh_follows_the_tree(self):
+        self.touch("a.mp4")
+        self.touch("notes.txt")
+        self.touch(".hidden.mp4")
+        self.touch("Series", "s01e01.mkv")
+        self.touch("Series", "Extras", "x.mov")
+        self.settle()
+        self.assertEqual(self.refresh(), (3, 3, 0))
+        self.assertEqual(self.paths(), ["Series/Extras/x.mov", "Series/s01e01.mkv", "a.mp4"])
+        # Unchanged: every directory is stat'ed, none listed
+        self.assertEqual(self.refresh(), (0, 0, 0))
+
+        self.touch("Series", "s01e02.mkv")
+        os.remove(os.path.join(self.base, "a.mp4"))
+        self.settle(self.base, os.path.join(self.base, "Series"))
+        self.assertEqual(self.refresh(), (2, 1, 1))
+        self.assertEqual(self.paths(), ["Series/Extras/x.mov", "Series/s01e01.mkv", "Series/s01e02.mkv"])
+
+        shutil.rmtree(os.path.join(self.base, "Series", "Extras"))
+        self.settle(os.path.join(self.base, "Series"))
+        self.assertEqual(self.refresh(), (1, 0, 1))
+        self.assertFalse(ImportDir.objects.filter(path=os.path.join(self.base, "Series", "Extras")).exists())
+
+    def test_recent_changes_are_listed_again(self):
+        self.touch("a.mp4")
+        self.assertEqual(self.refresh(), (1, 1, 0))
+        # Changed just now: the stored mtime is left unset, so the next refresh lists it
+        self.assertEqual(ImportDir.objects.get().mtime, 0.0)
+        self.assertEqual(self.refresh(), (1, 0, 0))
+
+
+class IngestTests(TestCase):
+
+    def test_title_from_filename(self):
+        self.assertEqual(ingest.title_from_filename("/m/Jumanji_Welcome_To_The_Jungle_2017.mp4"),
+                         ("Jumanji Welcome To The Jungle", 2017))
+        self.assertEqual(ingest.title_from_filename("/m/the.matrix (1999).mkv"), ("The Matrix", 1999))
+        self.assertEqual(ingest.title_from_filename("/m/2012.mp4"), ("2012", None))
+
+    def test_create_videos(self):
+        Video.objects.create(name="Alien", description="", status="Completed")
+        ids = ingest.create_videos(["/imports/Alien.mp4", "/imports/alien (1979).mp4"])
+        videos = Video.objects.filter(pk__in=ids).order_by("pk")
+        self.assertEqual([(v.name, v.release_year, v.status) for v in videos],
+                         [("Alien", None, "Pending"), ("Alien", 1979, "Pending")])
+        # bulk_create skips the slug signal; the allocator keeps them unique
+        self.assertEqual(sorted(Video.objects.values_list("slug", flat=True)), ["alien", "alien-1", "alien-2"])
+        self.assertEqual(ingest.imported_paths(), {"/imports/Alien.mp4", "/imports/alien (1979).mp4"})
+
+
+class VideoStatusTests(TestCase):
+
+    def test_staff_only(self):
+        video = Video.objects.create(name="Movie", description="", status="Failed",
+                                     errors="ffmpeg: /mnt/nas/private/movie.mkv: Invalid data")
+        url = reverse("video_status", args=[video.pk])
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 403)
+        self.assertNotIn(b"/mnt/nas", resp.content)
+        self.client.force_login(User.objects.create_user("viewer", password="x"))
+        self.assertEqual(self.client.get(url).status_code, 403)
+
+        self.client.force_login(User.objects.create_user("staff", password="x", is_staff=True))
+        resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["status"], "Failed")
+        self.assertIsNone(resp.json()["progress"])
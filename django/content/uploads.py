@@ -0,0 +1,207 @@
+# content/uploads.py
+# Resumable uploads, following the tus 1.0 protocol (core, creation,
+# termination and checksum): a client creates an upload, PATCHes chunks at the
+# offset the server reports and resumes from HEAD's Upload-Offset after a
+# dropped connection. No request ever carries more than one chunk.
+import base64
+import binascii
+import fcntl
+import hashlib
+import os
+from datetime import timedelta
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from django.utils.text import get_valid_filename
+from .models import Upload, Video, validate_mp4_extension
+
+TUS_VERSION = '1.0.0'
+TUS_EXTENSIONS = 'creation,termination,checksum'
+CHECKSUM_ALGORITHMS = ('sha256', 'sha1', 'md5')
+BLOCK_SIZE = 1024 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def max_size() -> int:
+    return int(getattr(settings, 'UPLOAD_MAX_SIZE', 10000 * 1024 * 1024))
+
+
+def parse_metadata(header):
+    """Upload-Metadata: comma separated "key base64(value)" pairs (the value is optional)."""
+    meta = {}
+    for pair in (header or '').split(','):
+        key, _, value = pair.strip().partition(' ')
+        if not key:
+            continue
+        try:
+            meta[key] = base64.b64decode(value, validate=True).decode() if value else ''
+        except (binascii.Error, UnicodeDecodeError):
+            raise UploadError(f"Invalid Upload-Metadata value for '{key}'.")
+    return meta
+
+
+def _parse_checksum(value, encoding='hex'):
+    algorithm, _, digest = (value or '').strip().partition(' ')
+    algorithm = algorithm.lower()
+    if algorithm not in CHECKSUM_ALGORITHMS or not digest:
+        raise UploadError(f"Checksum must be '<{'|'.join(CHECKSUM_ALGORITHMS)}> <digest>'.")
+    try:
+        raw = bytes.fromhex(digest) if encoding == 'hex' else base64.b64decode(digest, validate=True)
+    except (ValueError, binascii.Error):
+        raise UploadError("Malformed checksum digest.")
+    return algorithm, raw
+
+
+def create(length, metadata, user=None):
+    """Reserve the final file for a new upload and return the Upload."""
+    if length <= 0 or length > max_size():
+        raise UploadError(f"Upload-Length must be between 1 and {max_size()}.", status=413)
+    filename = get_valid_filename(os.path.basename(metadata.get('filename', '')))
+    if not filename:
+        raise UploadError("Upload-Metadata must include a filename.")
+    try:
+        validate_mp4_extension(File(None, name=filename))
+    except ValidationError as e:
+        raise UploadError(e.messages[0])
+    checksum = metadata.get('checksum', '').strip()
+    if checksum:
+        _parse_checksum(checksum)
+    elif getattr(settings, 'UPLOAD_REQUIRE_CHECKSUM', False):
+        raise UploadError("Upload-Metadata must include a checksum.")
+
+    video = None
+    if metadata.get('video_id'):
+        video_id = metadata['video_id']
+        video = Video.objects.filter(pk=int(video_id)).first() if video_id.isdigit() else None
+        if not video:
+            raise UploadError(f"No video with id={metadata['video_id']}.", status=404)
+
+    # Video.video uploads to "videos/"; the name is claimed by creating the
+    # empty file, so two uploads of the same filename get different names
+    while True:
+        path = default_storage.get_available_name(os.path.join('videos', filename))
+        abs_path = os.path.join(settings.MEDIA_ROOT, path)
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        try:
+            open(abs_path, 'xb').close()
+            break
+        except FileExistsError:
+            continue
+    return Upload.objects.create(
+        video=video, name=metadata.get('name', ''), path=path, length=length,
+        checksum=checksum, created_by=user if user and user.is_authenticated else None,
+    )
+
+
+def append(upload, stream, content_length, offset, chunk_checksum=None):
+    """Write one PATCH body at `offset`; returns the new offset.
+
+    Whatever arrives before a dropped connection is kept, so the client
+    resumes from there. With an Upload-Checksum the chunk is all or nothing.
+    """
+    if upload.status != Upload.UPLOADING:
+        raise UploadError(f"Upload is {upload.status.lower()}.", status=403)
+    if offset != upload.offset:
+        raise UploadError(f"Upload-Offset is {upload.offset}.", status=409)
+    if content_length is None or content_length < 0 or offset + content_length > upload.length:
+        raise UploadError("Chunk runs past Upload-Length.", status=413)
+    algorithm, expected = _parse_checksum(chunk_checksum, 'base64') if chunk_checksum else (None, None)
+    digest = hashlib.new(algorithm) if algorithm else None
+
+    path = os.path.join(settings.MEDIA_ROOT, upload.path)
+    try:
+        f = open(path, 'r+b')
+    except FileNotFoundError:
+        raise UploadError("Upload file is gone.", status=410)
+    with f:
+        try:
+            # One writer per upload; a second PATCH racing the first is refused
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise UploadError("Another request is writing this upload.", status=423)
+        upload.refresh_from_db(fields=['offset'])
+        if offset != upload.offset:
+            raise UploadError(f"Upload-Offset is {upload.offset}.", status=409)
+        # Bytes past the recorded offset belong to a request that died before recording them
+        f.seek(offset)
+        f.truncate()
+        remaining = content_length
+        complete = False
+        try:
+            while remaining:
+                data = stream.read(min(BLOCK_SIZE, remaining))
+                if not data:
+                    break
+                f.write(data)
+                if digest:
+                    digest.update(data)
+                remaining -= len(data)
+            complete = True
+        finally:
+            f.flush()
+            written = f.tell()
+            if digest and (not complete or remaining or digest.digest() != expected):
+                f.truncate(offset)
+                written = offset
+            Upload.objects.filter(pk=upload.pk).update(offset=written, updated_at=timezone.now())
+            upload.offset = written
+    if digest and written == offset and content_length:
+        # tus checksum extension: 460 Checksum Mismatch
+        raise UploadError("Chunk checksum mismatch.", status=460)
+    return written
+
+
+def verify(upload):
+    path = os.path.join(settings.MEDIA_ROOT, upload.path)
+    size = os.path.getsize(path)
+    if size != upload.length:
+        raise ValueError(f"Uploaded file is {size} bytes, expected {upload.length}.")
+    if not upload.checksum:
+        return
+    algorithm, expected = _parse_checksum(upload.checksum)
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(BLOCK_SIZE), b''):
+            digest.update(block)
+    if digest.digest() != expected:
+        raise ValueError(f"{algorithm} checksum mismatch.")
+
+
+def attach(upload):
+    """Hand the finished file to its Video; saving it queues process_video."""
+    video = upload.video
+    if video is None:
+        from .ingest import title_from_filename
+        name, year = title_from_filename(upload.path)
+        video = Video(name=upload.name or name, release_year=year, description='')
+    video.source_type = 'upload'
+    video.server_path = ''
+    # The file is already in place; assigning the name skips the storage copy
+    video.video = upload.path
+    video.save()
+    upload.video = video
+    upload.status = Upload.COMPLETED
+    upload.save(update_fields=['video', 'status', 'updated_at'])
+    return video
+
+
+def discard(upload):
+    try:
+        os.remove(os.path.join(settings.MEDIA_ROOT, upload.path))
+    except FileNotFoundError:
+        pass
+
+
+def expired():
+    hours = int(getattr(settings, 'UPLOAD_EXPIRE_HOURS', 24))
+    return Upload.objects.filter(
+        status__in=(Upload.UPLOADING, Upload.FAILED),
+        updated_at__lt=timezone.now() - timedelta(hours=hours),
+    )
@@ -6,7 +6,16 @@ from django.conf.urls.static import static
 urlpatterns = [
     path('', views.home, name='home'),
     path('movie/<slug:video_id>', views.movie_detail_view, name='movie'),
+    path('video/<int:video_id>/status', views.video_status, name='video_status'),
+    path('api/catalog', views.catalog_api, name='catalog_api'),
+    path('search', views.search_results, name='search'),
+    path('api/search', views.search_api, name='search_api'),
+    path('stats/caches', views.cache_stats, name='cache_stats'),
+    path('uploads/', views.upload_create, name='upload_create'),
+    path('uploads/<uuid:token>', views.upload_detail, name='upload_detail'),
     path('serve_hls_playlist/<int:video_id>', views.serve_hls_playlist, name='serve_hls_playlist'),
+    path('serve_hls_playlist/<int:video_id>/<str:playlist_name>', views.serve_hls_playlist, name='serve_hls_variant_playlist'),
+    path('serve_thumbnails_vtt/<int:video_id>', views.serve_thumbnails_vtt, name='serve_thumbnails_vtt'),
     path('serve_hls_segment/<int:video_id>/<str:segment_name>', views.serve_hls_segment, name='serve_hls_segment'),
 ]
 if settings.DEBUG:
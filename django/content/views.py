@@ -1,88 +1,630 @@
-from django.shortcuts import render
-from django.templatetags.static import static
-# Create your views here.
+import asyncio
+import hashlib
+import os
+import re
+import secrets
+import stat
+from pathlib import Path
+from urllib.parse import quote
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
-
-import os 
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.core.paginator import Paginator
+from django.db import transaction
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404, render
 from django.urls import reverse
-from django.http import FileResponse, HttpResponse
-from django.shortcuts import get_object_or_404
-from .models import Video
-from home.settings import MEDIA_ROOT
-from django.conf import settings
-from django.http import FileResponse, Http404, HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags, quote_etag
+from django.views.decorators.http import require_http_methods
+from . import caching, catalog, encoding, progress, search, signing, uploads
+from .models import Upload, Video
+
+
+def _page_cache_key(request, *parts, params=()):
+    # A cached page is served to every anonymous visitor, so only requests
+    # whose query string is fully described by `parts` are cached: `params`
+    # names the parameters the caller put there; anything else renders fresh
+    if request.GET.keys() - set(params):
+        return None
+    return ':'.join(['page', request.scheme, request.get_host(), *map(str, parts)])
 
+def _page_cache_timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 3600)
 
 # @login_required
 def home(request):
-    return render(request, 'content/index.html', {'videos': Video.objects.filter(status='Completed')})
+    page = request.GET.get('page') or '1'
+    # Anonymous visitors share one rendering per catalog version and page
+    key = None
+    if not request.user.is_authenticated and page.isdigit():
+        key = _page_cache_key(request, 'home', caching.catalog_version(), page, params=('page',))
+        html = cache.get(key) if key else None
+        if html is not None:
+            return HttpResponse(html)
+
+    paginator = Paginator(catalog.cards(), getattr(settings, 'HOME_PAGE_SIZE', 24))
+    page_obj = paginator.get_page(page)
+    # Each card is a template fragment cached under its video's version
+    versions = caching.video_versions([video.pk for video in page_obj])
+    for video in page_obj:
+        video.cache_version = versions[video.pk]
+    resp = render(request, 'content/index.html', {
+        'videos': page_obj, 'page_obj': page_obj, 'fragment_timeout': _page_cache_timeout(),
+    })
+    if key:
+        cache.set(key, resp.content, _page_cache_timeout())
+    return resp
 
 # @login_required
 def movie_detail_view(request, video_id):
-    video = Video.objects.filter(slug=video_id).first()
+    # Anonymous visitors get the page rendered for the video's current version;
+    # the slug -> id map lets a hit skip the database entirely
+    anonymous = not request.user.is_authenticated
+    pk = cache.get(f"video-slug:{video_id}") if anonymous else None
+    key = _page_cache_key(request, 'movie', video_id, pk, caching.video_version(pk)) if pk else None
+    if key:
+        html = cache.get(key)
+        if html is not None:
+            return HttpResponse(html)
+
+    # The template walks genres and cast more than once; prefetched, that's one query each
+    video = get_object_or_404(Video.objects.select_related('probe').prefetch_related('genres', 'cast'), slug=video_id)
+    # For the Open Graph context processor, which would otherwise look it up again
+    request.og_video = video
     hls_playlist_url = reverse('serve_hls_playlist', args=[video.id])
 
     context = {
         'hls_url': hls_playlist_url,
         'video': video,
+        'probe': getattr(video, 'probe', None),
+        'thumbnails_url': reverse('serve_thumbnails_vtt', args=[video.id]) if _thumbnails_vtt_path(video) else None,
+        # Still encoding: the playlist is a growing EVENT one
+        'encoding_live': video.status != 'Completed',
     }
-    return render(request, 'content/movie_detail.html', context)
+    resp = render(request, 'content/movie_detail.html', context)
+    if key and pk == video.pk:
+        cache.set(key, resp.content, _page_cache_timeout())
+    elif anonymous:
+        # Only the next view caches the page: it reads the version before the lookup
+        cache.set(f"video-slug:{video_id}", video.pk, _page_cache_timeout())
+    return resp
+
+def video_status(request, video_id):
+    # Polled by the admin/ops dashboards; progress is None unless an encode is running.
+    # errors holds raw ffmpeg output (server paths included): staff only
+    if not request.user.is_staff:
+        return HttpResponse("Staff only.", status=403)
+    video = get_object_or_404(Video.objects.only('id', 'status', 'errors', 'duration'), pk=video_id)
+    return JsonResponse({
+        'id': video.id,
+        'status': video.status,
+        'errors': video.errors,
+        'duration': video.duration,
+        'progress': progress.snapshot(video.id) if video.status == 'Processing' else None,
+    })
+
+def cache_stats(request):
+    # This process's in-memory caches, for tuning PLAYLIST_CACHE_SIZE and HLS_SEGMENT_CACHE_BYTES
+    if not request.user.is_staff:
+        return HttpResponse("Staff only.", status=403)
+    return JsonResponse({
+        'pid': os.getpid(),
+        'playlist_paths': _playlist_paths.stats(),
+        'rendered_playlists': _rendered_playlists.stats(),
+        'hot_segments': _hot_segments.stats(),
+    })
+
+def catalog_api(request):
+    # Keyset-paginated catalog for player clients:
+    #   ?fields=id,name,playlist&limit=50&after=<id of the last video of the previous page>
+    try:
+        fields = catalog.parse_fields(request.GET.get('fields'))
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    try:
+        limit = int(request.GET.get('limit') or getattr(settings, 'CATALOG_PAGE_SIZE', 50))
+        after = int(request.GET['after']) if request.GET.get('after') else None
+    except ValueError:
+        return JsonResponse({'error': "limit and after must be integers."}, status=400)
+    limit = min(max(limit, 1), catalog.MAX_LIMIT)
+
+    videos, more = catalog.page(fields, after, limit)
+    next_url = None
+    if more:
+        params = request.GET.copy()
+        params['after'] = videos[-1].pk
+        next_url = request.build_absolute_uri(f"{request.path}?{params.urlencode()}")
+    resp = JsonResponse({'results': [catalog.serialize(v, fields, request) for v in videos], 'next': next_url})
+
+    etag = quote_etag(hashlib.sha1(resp.content).hexdigest())
+    if etag in parse_etags(request.headers.get('If-None-Match', '')):
+        resp = HttpResponseNotModified()
+    resp['ETag'] = etag
+    resp['Cache-Control'] = 'no-cache'
+    return resp
+
+def search_results(request):
+    query = request.GET.get('q', '').strip()
+    videos = search.search(query, search.MAX_LIMIT) if query else []
+    return render(request, 'content/search.html', {'query': query, 'videos': videos})
+
+def search_api(request):
+    # Type-ahead for the navbar: ?q=matr&limit=8
+    try:
+        limit = int(request.GET.get('limit') or 8)
+    except ValueError:
+        return JsonResponse({'error': "limit must be an integer."}, status=400)
+    videos = search.search(request.GET.get('q', ''), limit)
+    return JsonResponse({'results': [
+        {'id': v.pk, 'slug': v.slug, 'name': v.name, 'url': reverse('movie', args=[v.slug])}
+        for v in videos
+    ]})
+
+def _thumbnails_vtt_path(video):
+    # The WebVTT thumbnail track sits next to the playlist, named after the same base
+    if not video or not video.hls:
+        return None
+    hls_path = os.path.join(settings.MEDIA_ROOT, video.hls)
+    safe_base = os.path.basename(hls_path).rsplit('_', 1)[0]
+    path = os.path.join(os.path.dirname(hls_path), encoding.thumbnails_vtt_name(safe_base))
+    return path if os.path.isfile(path) else None
 
 # @login_required
-def serve_hls_playlist(request, video_id):
+def serve_thumbnails_vtt(request, video_id):
+    video = get_object_or_404(Video, pk=video_id)
+    path = _thumbnails_vtt_path(video)
+    if not path:
+        return HttpResponse("Thumbnail track not generated.", status=404)
+    with open(path, 'r') as vtt_file:
+        content = _versioned_segment_urls(vtt_file.read(), os.path.dirname(path))
+    serve_hls_segment_url = request.build_absolute_uri('/') + "serve_hls_segment/" + str(video_id)
+    session = _session_key(request) if signing.bind_session() else ''
+    content = content.replace('{{ access_token }}', _access_query(video_id, session))
+    return HttpResponse(content.replace('{{ dynamic_path }}', serve_hls_segment_url), content_type='text/vtt')
+
+def _access_query(video_id, session=''):
+    # "&exp=...&sig=..." for every segment URL when HLS_SIGNED_URLS is on
+    if not signing.enabled():
+        return ''
+    return '&' + signing.token(video_id, session=session)
+
+def _session_key(request):
+    # Session-bound tokens need a session, anonymous viewers included; a
+    # non-empty session is what makes SessionMiddleware send the cookie
+    if not request.session.session_key:
+        request.session['hls_viewer'] = True
+        request.session.save()
+    return request.session.session_key
+
+async def _asession_key(request):
+    if not request.session.session_key:
+        request.session['hls_viewer'] = True
+        await request.session.asave()
+    return request.session.session_key
+
+# Rendered playlists: an in-process LRU in front of the Django cache. Entries
+# are keyed by the video's version (bumped by the Video signals), the
+# playlist's mtime and the scheme/host the absolute URLs were built for.
+# Segment requests find their HLS directory through _playlist_paths too.
+_playlist_paths = caching.LRU(max_items=getattr(settings, 'PLAYLIST_CACHE_SIZE', 512))
+_rendered_playlists = caching.LRU(max_items=getattr(settings, 'PLAYLIST_CACHE_SIZE', 512))
+# Bytes of recently served segments, keyed by path and generation: a title's
+# first segments are read from disk once however many viewers start it at once
+_hot_segments = caching.LRU(max_bytes=getattr(settings, 'HLS_SEGMENT_CACHE_BYTES', 64 * 1024 * 1024))
+
+async def _playlist_path(video_id, playlist_name, version):
+    """Absolute path of a video's master/media playlist, or None; cached per video version."""
+    key = (video_id, version, playlist_name)
+    path = _playlist_paths.get(key)
+    if path:
+        return path
+    hls = await Video.objects.filter(pk=video_id).values_list('hls', flat=True).afirst()
+    if not hls:
+        return None
+    path = os.path.abspath(os.path.join(settings.MEDIA_ROOT, hls))
+    # Variant playlists of an adaptive ladder live next to the master playlist
+    if playlist_name:
+        hls_directory = os.path.dirname(path)
+        path = os.path.normpath(os.path.join(hls_directory, playlist_name))
+        if not path.startswith(hls_directory + os.sep) or not path.endswith('.m3u8'):
+            raise ValueError("Invalid playlist path.")
+    _playlist_paths.set(key, path)
+    return path
+
+def _render_playlist(request, video_id, path):
+    with open(path, 'r') as m3u8_file:
+        m3u8_content = m3u8_file.read()
+    if '#EXT-X-PLAYLIST-TYPE:EVENT' in m3u8_content:
+        # An encode in progress; finalize_playlists() does this once it completes
+        m3u8_content = encoding.fix_map_uri(m3u8_content)
+
+    # Segment URLs carry their file's generation, so they can be cached as immutable
+    m3u8_content = _versioned_segment_urls(m3u8_content, os.path.dirname(path))
+    if '#EXT-X-ENDLIST' in m3u8_content:
+        _readahead(os.path.dirname(path), m3u8_content)
+
+    base_url = request.build_absolute_uri('/') 
+    serve_hls_segment_url = base_url +"serve_hls_segment/" + str(video_id)
+    serve_hls_playlist_url = base_url + "serve_hls_playlist/" + str(video_id)
+    m3u8_content = m3u8_content.replace('{{ dynamic_path }}', serve_hls_segment_url)
+    m3u8_content = m3u8_content.replace('{{ playlist_path }}', serve_hls_playlist_url)
+    return m3u8_content
+
+# @login_required
+async def serve_hls_playlist(request, video_id, playlist_name=None):
     try:
-        video = get_object_or_404(Video, pk=video_id)
-        hls_playlist_path = MEDIA_ROOT / video.hls
-        with open(hls_playlist_path, 'r') as m3u8_file:
-            m3u8_content = m3u8_file.read()
+        version = await caching.avideo_version(video_id)
+        try:
+            path = await _playlist_path(video_id, playlist_name or '', version)
+        except ValueError as e:
+            return HttpResponse(str(e), status=400)
+        if not path:
+            if not await Video.objects.filter(pk=video_id).aexists():
+                raise Http404("No Video matches the given query.")
+            return HttpResponse("HLS playlist not generated yet.", status=404)
+
+        # A stat is all a repeat fetch costs: the body comes from memory (or the shared cache)
+        mtime = (await asyncio.to_thread(os.stat, path)).st_mtime_ns
+        key = f"playlist:{video_id}:{version}:{playlist_name or ''}:{mtime}:{request.scheme}://{request.get_host()}"
+        entry = _rendered_playlists.get(key)
+        if entry is None:
+            entry = await cache.aget(key)
+            if entry is None:
+                # Reads the playlist and stats its segments: off the event loop
+                body = await asyncio.to_thread(_render_playlist, request, video_id, path)
+                live = '#EXT-X-PLAYLIST-TYPE:EVENT' in body and '#EXT-X-ENDLIST' not in body
+                entry = (body, quote_etag(hashlib.sha1(body.encode()).hexdigest()), live)
+                # A growing playlist is superseded within seconds
+                await cache.aset(key, entry, 60 if live else getattr(settings, 'PLAYLIST_CACHE_TIMEOUT', 3600))
+            _rendered_playlists.set(key, entry)
+        body, etag, live = entry
 
-        base_url = request.build_absolute_uri('/') 
-        serve_hls_segment_url = base_url +"serve_hls_segment/" + str(video_id)
-        m3u8_content = m3u8_content.replace('{{ dynamic_path }}', serve_hls_segment_url)
+        # Segment URLs are signed after the shared cache: the token changes every EXPIRY_STEP
+        session = await _asession_key(request) if signing.bind_session() else ''
+        access = _access_query(video_id, session)
+        if access:
+            etag = quote_etag(hashlib.sha1((etag + access).encode()).hexdigest())
 
-        return HttpResponse(m3u8_content, content_type='application/vnd.apple.mpegurl')
-    except (Video.DoesNotExist, FileNotFoundError) as e:
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            resp = HttpResponseNotModified()
+        else:
+            resp = HttpResponse(body.replace('{{ access_token }}', access), content_type='application/vnd.apple.mpegurl')
+        resp['ETag'] = etag
+        if live:
+            # Still growing: players reload it every target duration
+            resp['Cache-Control'] = 'no-cache'
+        if access:
+            # Holds expiring tokens; shared caches may only store the segments
+            resp['Cache-Control'] = 'private, no-cache' if live else 'private'
+        return resp
+    except FileNotFoundError as e:
         print(f"Error: {e}")
         return HttpResponse("Video or HLS playlist not found", status=404)
 
-def serve_hls_segment(request, video_id, segment_name):
-    video = get_object_or_404(Video, pk=video_id)
+# --- Resumable uploads (tus 1.0) ---
+
+def _tus_response(status=204, **headers):
+    resp = HttpResponse(status=status)
+    resp['Tus-Resumable'] = uploads.TUS_VERSION
+    resp['Cache-Control'] = 'no-store'
+    for name, value in headers.items():
+        resp[name.replace('_', '-')] = str(value)
+    return resp
+
+def _tus_error(e):
+    resp = HttpResponse(str(e), status=e.status, content_type='text/plain')
+    resp['Tus-Resumable'] = uploads.TUS_VERSION
+    return resp
+
+def _int_header(request, name):
+    try:
+        return int(request.headers.get(name, ''))
+    except ValueError:
+        return None
+
+@require_http_methods(['OPTIONS', 'POST'])
+def upload_create(request):
+    if request.method == 'OPTIONS':
+        return _tus_response(
+            Tus_Version=uploads.TUS_VERSION, Tus_Extension=uploads.TUS_EXTENSIONS,
+            Tus_Max_Size=uploads.max_size(), Tus_Checksum_Algorithm=','.join(uploads.CHECKSUM_ALGORITHMS))
+    if not request.user.is_staff:
+        return HttpResponse("Staff only.", status=403)
+    length = _int_header(request, 'Upload-Length')
+    if length is None:
+        return _tus_error(uploads.UploadError("Upload-Length is required."))
+    try:
+        upload = uploads.create(length, uploads.parse_metadata(request.headers.get('Upload-Metadata')), request.user)
+    except uploads.UploadError as e:
+        return _tus_error(e)
+    return _tus_response(201, Location=request.build_absolute_uri(reverse('upload_detail', args=[upload.token])))
+
+@require_http_methods(['OPTIONS', 'HEAD', 'PATCH', 'DELETE'])
+def upload_detail(request, token):
+    if request.method == 'OPTIONS':
+        return upload_create(request)
+    if not request.user.is_staff:
+        return HttpResponse("Staff only.", status=403)
+    upload = Upload.objects.filter(token=token).first()
+    if not upload:
+        return _tus_response(404)
+
+    if request.method == 'HEAD':
+        return _tus_response(200, Upload_Offset=upload.offset, Upload_Length=upload.length)
+
+    if request.method == 'DELETE':
+        if upload.status == Upload.COMPLETED:
+            return _tus_error(uploads.UploadError("Upload is already attached to a video.", status=403))
+        uploads.discard(upload)
+        upload.delete()
+        return _tus_response(204)
+
+    if request.content_type != 'application/offset+octet-stream':
+        return _tus_error(uploads.UploadError("Content-Type must be application/offset+octet-stream.", status=415))
+    offset = _int_header(request, 'Upload-Offset')
+    if offset is None:
+        return _tus_error(uploads.UploadError("Upload-Offset is required."))
+    try:
+        # The body is read straight from the socket in blocks, never buffered whole
+        new_offset = uploads.append(upload, request, _int_header(request, 'Content-Length'), offset,
+                                    request.headers.get('Upload-Checksum'))
+    except uploads.UploadError as e:
+        return _tus_error(e)
+    if new_offset == upload.length:
+        # Verifying a multi-GB checksum is left to a worker
+        Upload.objects.filter(pk=upload.pk, status=Upload.UPLOADING).update(status=Upload.VERIFYING)
+        from .tasks import finish_upload
+        transaction.on_commit(lambda: finish_upload.delay(upload.pk))
+    return _tus_response(204, Upload_Offset=new_offset)
+
+SEGMENT_CONTENT_TYPES = {
+    '.ts': 'video/mp2t',
+    '.m4s': 'video/iso.segment',
+    '.mp4': 'video/mp4',
+    '.jpg': 'image/jpeg',  # seek-preview sprite sheets
+}
+
+# More ranges than this in one request are ignored and the whole file is sent
+MAX_RANGES = 16
+# A {{ dynamic_path }}/<file> reference in a stored playlist or VTT track
+SEGMENT_REF = re.compile(r'\{\{ dynamic_path \}\}/([^"\s?#]+)')
+# posix_fadvise(WILLNEED) covers at most this much of each file
+READAHEAD_MAX_BYTES = 16 * 1024 * 1024
+# Segment URLs carrying their file's current generation (?v=) never change content
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+SEGMENT_CACHE_CONTROL = 'public, max-age=300'
+
+def _file_generation(st):
+    # Changes whenever an encode rewrites or appends to the file
+    return f"{st.st_size:x}-{st.st_mtime_ns:x}"
+
+def _versioned_segment_urls(content, hls_directory):
+    """Append ?v=<generation>{{ access_token }} to every {{ dynamic_path }}/<file> reference
+    in a playlist or VTT track; the token placeholder is filled in per response."""
+    generations = {}
+
+    def versioned(match):
+        name = match.group(1)
+        if name not in generations:
+            try:
+                generations[name] = _file_generation(os.stat(os.path.join(hls_directory, name)))
+            except OSError:
+                generations[name] = ''
+        return match.group(0) + '?v=' + generations[name] + '{{ access_token }}'
+
+    return SEGMENT_REF.sub(versioned, content)
+
+def _readahead(hls_directory, content):
+    """Ask the kernel to start reading a playlist's first segments before they are requested."""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    names = list(dict.fromkeys(SEGMENT_REF.findall(content)))
+    for name in names[:int(getattr(settings, 'HLS_READAHEAD_SEGMENTS', 3))]:
+        try:
+            fd = os.open(os.path.join(hls_directory, name), os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            # Only the head of a single-file rendition
+            os.posix_fadvise(fd, 0, READAHEAD_MAX_BYTES, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+
+def _parse_ranges(header, size):
+    """[(start, end), ...] for a "bytes=" Range header, or None if it is absent or malformed.
+
+    Unsatisfiable ranges are dropped, so an empty list means 416.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    ranges = []
+    for spec in header[len('bytes='):].split(','):
+        start, sep, end = spec.strip().partition('-')
+        if not sep:
+            return None
+        try:
+            if not start:
+                length = int(end)
+                if length > 0 and size:
+                    ranges.append((max(0, size - length), size - 1))
+                continue
+            start = int(start)
+            end = int(end) if end else None
+        except ValueError:
+            return None
+        if end is not None and start > end:
+            return None
+        if start < size:
+            ranges.append((start, size - 1 if end is None else min(end, size - 1)))
+    return ranges if len(ranges) <= MAX_RANGES else None
+
+def _file_range(path, start, length, block=64 * 1024):
+    with open(path, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(block, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+
+async def _afile_range(path, start, length, block=256 * 1024):
+    # Each read runs in a worker thread, so the event loop keeps serving other streams
+    fd = await asyncio.to_thread(os.open, path, os.O_RDONLY)
+    try:
+        while length > 0:
+            data = await asyncio.to_thread(os.pread, fd, min(block, length), start)
+            if not data:
+                break
+            start += len(data)
+            length -= len(data)
+            yield data
+    finally:
+        os.close(fd)
+
+def _stream(request, path, pieces):
+    """Iterate `pieces`: bytes, or (offset, length) spans of `path`.
+
+    ASGI servers get an async iterator; Django would otherwise read a sync one
+    into memory whole before sending it.
+    """
+    if isinstance(request, ASGIRequest):
+        async def body():
+            for piece in pieces:
+                if isinstance(piece, bytes):
+                    yield piece
+                else:
+                    async for data in _afile_range(path, *piece):
+                        yield data
+    else:
+        def body():
+            for piece in pieces:
+                if isinstance(piece, bytes):
+                    yield piece
+                else:
+                    yield from _file_range(path, *piece)
+    return body()
+
+def _file_response(request, path, ranges, size, content_type, data=None):
+    """200/206 response for `ranges` of the file; served from `data` (its bytes) when given."""
+    if not ranges and data is None and not isinstance(request, ASGIRequest):
+        # WSGI servers can sendfile() a whole file
+        return FileResponse(open(path, 'rb'), content_type=content_type)
+    if not ranges:
+        status, pieces = 200, [(0, size)]
+    elif len(ranges) == 1:
+        start, end = ranges[0]
+        status, pieces = 206, [(start, end - start + 1)]
+    else:
+        # multipart/byteranges body (RFC 9110 §14.6), streamed part by part
+        boundary = secrets.token_hex(16)
+        status, pieces = 206, []
+        for start, end in ranges:
+            pieces.append((f"--{boundary}\r\nContent-Type: {content_type}\r\n"
+                           f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode())
+            pieces.append((start, end - start + 1))
+            pieces.append(b"\r\n")
+        pieces.append(f"--{boundary}--\r\n".encode())
+        content_type = f'multipart/byteranges; boundary={boundary}'
+
+    if data is not None:
+        resp = HttpResponse(b''.join(p if isinstance(p, bytes) else data[p[0]:p[0] + p[1]] for p in pieces),
+                            status=status, content_type=content_type)
+    else:
+        resp = StreamingHttpResponse(_stream(request, path, pieces), status=status, content_type=content_type)
+    if ranges and len(ranges) == 1:
+        resp['Content-Range'] = f'bytes {ranges[0][0]}-{ranges[0][1]}/{size}'
+    resp['Content-Length'] = str(sum(len(p) if isinstance(p, bytes) else p[1] for p in pieces))
+    return resp
+
+async def _hot_segment(path, generation, size):
+    """The file's bytes from the hot-segment cache, read in on a miss; None if it isn't cacheable."""
+    # One big file (a single-file rendition) must not flush every segment out
+    if not size or size > _hot_segments.max_bytes // 8:
+        return None
+    key = (path, generation)
+    data = _hot_segments.get(key)
+    if data is None:
+        data = await asyncio.to_thread(Path(path).read_bytes)
+        if len(data) != size:
+            # Still being written
+            return None
+        _hot_segments.set(key, data, size)
+    return data
+
+def _accel_redirect_path(path):
+    # MEDIA_ROOT/... on disk -> HLS_ACCEL_PREFIX/..., which nginx aliases to MEDIA_ROOT
+    rel = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, '/')
+    return getattr(settings, 'HLS_ACCEL_PREFIX', '/protected-media/').rstrip('/') + '/' + quote(rel)
+
+async def serve_hls_segment(request, video_id, segment_name):
+    # The session key comes from the cookie; no session lookup
+    session = (request.session.session_key or '') if signing.bind_session() else ''
+    if signing.enabled() and not signing.verify(video_id, request.GET, session=session):
+        return HttpResponse("Invalid or expired segment URL.", status=403)
 
     # We expect video.hls to be a relative path under MEDIA_ROOT, like:
     #   hls_output/<id>/<name>_hls.m3u8
-    if not video.hls:
+    # Resolved once per video version, so steady-state requests make no queries
+    playlist_abs = await _playlist_path(video_id, '', await caching.avideo_version(video_id))
+    if not playlist_abs:
+        if not await Video.objects.filter(pk=video_id).aexists():
+            raise Http404("No Video matches the given query.")
         return HttpResponse("HLS playlist not generated yet.", status=404)
-
-    playlist_abs = os.path.join(settings.MEDIA_ROOT, video.hls)
-    hls_directory = os.path.dirname(playlist_abs)  # folder that contains the .ts files
+    hls_directory = os.path.dirname(playlist_abs)  # folder that contains the segments
 
     # Normalize/secure the requested segment path to prevent path traversal
     requested = os.path.normpath(os.path.join(hls_directory, segment_name))
     if not requested.startswith(os.path.abspath(hls_directory) + os.sep):
         return HttpResponse("Invalid segment path.", status=400)
 
-    if not os.path.isfile(requested):
+    try:
+        st = await asyncio.to_thread(os.stat, requested)
+    except OSError:
+        raise Http404("Segment not found")
+    if not stat.S_ISREG(st.st_mode):
         raise Http404("Segment not found")
 
-    # Serve with proper content-type and a bit of caching
-    resp = FileResponse(open(requested, 'rb'), content_type='video/mp2t')
-    resp['Cache-Control'] = 'public, max-age=300'
-    resp['X-Content-Type-Options'] = 'nosniff'
-    return resp
-
-# @login_required
-# def serve_hls_segment(request, video_id, segment_name):
-#     try:
-#         video = get_object_or_404(Video, pk=video_id)
-#         try:
-#             hls_directory = os.path.join(os.path.dirname(video.video.path), f'hls_output/{video.id}')
-#         except:
-#             hls_directory = os.path.join(os.path.dirname(video.video.path), f'hls_output/{video.id}')
-
-#         segment_path = os.path.join(hls_directory, segment_name)
+    content_type = SEGMENT_CONTENT_TYPES.get(os.path.splitext(requested)[1].lower(), 'application/octet-stream')
+    generation = _file_generation(st)
+    etag = quote_etag(generation)
+    last_modified = http_date(st.st_mtime)
+    cache_control = IMMUTABLE_CACHE_CONTROL if request.GET.get('v') == generation else SEGMENT_CACHE_CONTROL
 
-#         # Serve the HLS segment as a binary file response
-#         return FileResponse(open(segment_path, 'rb'))
-#     except (Video.DoesNotExist, FileNotFoundError):
-#         return HttpResponse("Video or HLS segment not found", status=404)
+    resp = get_conditional_response(request, etag=etag, last_modified=int(st.st_mtime))
+    if resp is None:
+        if getattr(settings, 'HLS_ACCEL_REDIRECT', False):
+            # nginx sends the file (and answers Range) from its internal location;
+            # it keeps our Content-Type and Cache-Control
+            resp = HttpResponse(content_type=content_type)
+            resp['X-Accel-Redirect'] = _accel_redirect_path(requested)
+            resp['Cache-Control'] = cache_control
+            resp['X-Content-Type-Options'] = 'nosniff'
+            return resp
+        # Single-file fMP4 renditions are addressed with EXT-X-BYTERANGE
+        ranges = _parse_ranges(request.headers.get('Range'), st.st_size)
+        if_range = request.headers.get('If-Range')
+        if ranges is not None and if_range and if_range not in (etag, last_modified):
+            # The client's partial copy is stale: send the whole file
+            ranges = None
+        if ranges == []:
+            resp = HttpResponse(status=416)
+            resp['Content-Range'] = f'bytes */{st.st_size}'
+            return resp
+        # Offloaded (X-Accel above, or sendfile() of a whole file under WSGI),
+        # the bytes never pass through Python: the hot-segment cache is for the rest
+        data = None
+        if ranges or isinstance(request, ASGIRequest):
+            data = await _hot_segment(requested, generation, st.st_size)
+        # May open the file (a whole one under WSGI): off the event loop
+        resp = await asyncio.to_thread(_file_response, request, requested, ranges, st.st_size, content_type, data)
 
+    # Validators let players and CDNs revalidate instead of re-downloading
+    resp['ETag'] = etag
+    resp['Last-Modified'] = last_modified
+    resp['Accept-Ranges'] = 'bytes'
+    resp['Cache-Control'] = cache_control
+    resp['X-Content-Type-Options'] = 'nosniff'
+    return resp
@@ -1,5 +1,14 @@
 # deploy/django/gunicorn.conf.py
+import os
+
 bind = "0.0.0.0:8000"
-workers = 3
+workers = int(os.environ.get("GUNICORN_WORKERS", 3))
 accesslog = "-"
-errorlog = "-"
\ No newline at end of file
+errorlog = "-"
+
+# "sync" holds a worker per request, including every segment download. With
+# GUNICORN_WORKER_CLASS=uvicorn_worker.UvicornWorker the ASGI app is served and
+# the async playlist/segment views stream thousands of clients per worker.
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "sync")
+# The only place the app is chosen: don't pass one on the gunicorn command line
+wsgi_app = "home.asgi:application" if "uvicorn" in worker_class.lower() else "home.wsgi:application"
@@ -72,7 +72,7 @@ echo ""
 echo "OR"
 echo ""
 echo "🛠️  OPTIONAL: Start the Celery worker to handle tasks in background"
-echo "👉 Run: celery -A home worker --loglevel=info"
+echo "👉 Run: celery -A home worker -Q light,transcode --loglevel=info"
 echo ""
 echo "✅ Done! Your video will be available for streaming once encoding finishes."
 echo ""